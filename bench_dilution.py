@@ -0,0 +1,182 @@
+# bench_dilution.py
+# Mesures de temps et de mémoire des moteurs de dilution : python bench_dilution.py
+import json
+import time
+import tracemalloc
+
+import dilution_engine as engine
+
+CAS = [
+    (5.0, 100.0),
+    (0.8, 40.0),
+    (12.5, 10.0),
+    (2.4, 1.0),
+]
+
+def chronometrer(fonction, *args, repetitions=1, **kwargs):
+    debut = time.perf_counter()
+    for _ in range(repetitions):
+        resultat = fonction(*args, **kwargs)
+    return (time.perf_counter() - debut) / repetitions * 1000, resultat
+
+def pic_memoire_etape(moteur, syringes):
+    """Pic d'allocation (en kio) pendant le choix d'une étape discontinue."""
+    choisir = engine.MOTEURS_DISCONTINU[moteur]
+    choisir(syringes, 5.0, 100.0, 1)  # construit les éventuels caches hors mesure
+    tracemalloc.start()
+    choisir(syringes, 5.0, 100.0, 1)
+    _, pic = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return pic / 1024
+
+def bench_moteurs():
+    print("== Temps par protocole (ms) ==")
+    for moteur in engine.MOTEURS_DISCONTINU:
+        for dose_mg, concentration in CAS:
+            t_disc, _ = chronometrer(engine.generate_dilution_steps_discontinu, dose_mg, concentration, moteur=moteur)
+            t_cont, _ = chronometrer(engine.generate_dilution_steps_continu, dose_mg, concentration, moteur=moteur)
+            print(f"{moteur:>8} dose={dose_mg:<6} C={concentration:<6} discontinu={t_disc:8.1f}  continu={t_cont:8.1f}")
+
+def bench_memoire():
+    print("== Pic mémoire d'une étape, moteur flux (kio) ==")
+    for syringes in ({2: 0.1}, {10: 0.2}, {60: 1.0}, engine.SYRINGES):
+        print(f"{str(syringes):>60} : {pic_memoire_etape('flux', syringes):7.1f}")
+
+def _ecart_final(etapes, cle_dose, dose_mg):
+    reelles = [e for e in etapes if e.get("type") == "réelle"]
+    return abs(reelles[-1][cle_dose] - dose_mg) if reelles else None
+
+def bench_faisceau(largeurs=(1, 4, 16)):
+    """Qualité du plan (écart final moyen) gagnée par milliseconde selon la largeur du faisceau."""
+    print("== Recherche en faisceau : écart final moyen (mg) et gain par ms ==")
+    cas = [(d, c) for d in (0.37, 0.8, 2.4, 5.0, 7.0, 12.5, 25.0, 43.6, 56.4) for c in (1.0, 10.0, 40.0, 100.0, 250.0, 1000.0)]
+    for mode, generer, cle_dose in (("discontinu", engine.generate_dilution_steps_discontinu, "dose obtenue"),
+                                    ("continu", engine.generate_dilution_steps_continu, "dose")):
+        reference = None
+        for largeur in largeurs:
+            temps, ecarts = 0.0, []
+            for dose_mg, concentration in cas:
+                t, etapes = chronometrer(generer, dose_mg, concentration, faisceau=largeur)
+                temps += t
+                ecarts.append(_ecart_final(etapes, cle_dose, dose_mg))
+            # Cas atteignables (dans la cible) avec la recherche gloutonne.
+            if reference is None:
+                retenus = [i for i, e in enumerate(ecarts) if e is not None and e <= 1.0]
+            ecart = sum(ecarts[i] for i in retenus) / len(retenus)
+            temps /= len(cas)
+            if reference is None:
+                reference = (ecart, temps)
+                gain = ""
+            else:
+                gain = f"  gain={(reference[0] - ecart) / max(temps - reference[1], 1e-9):.4f} mg/ms"
+            print(f"{mode:>10} B={largeur:<3} {temps:7.1f} ms/protocole  écart={ecart:.4f}{gain}")
+
+def bench_numba(repetitions=20):
+    """Moteur numba compilé contre son repli (moteur index), étape par étape."""
+    import dilution_numba
+    print("== Moteur numba : noyau compilé et repli index (ms par étape) ==")
+    engine.construire_index()
+    if dilution_numba.disponible():
+        dilution_numba.choisir_discontinu(engine.SYRINGES, 5.0, 100.0, 1)  # compilation hors mesure
+        dilution_numba.choisir_continu(engine.SYRINGES, 5.0, 100.0, 0, 2.4, None)
+    else:
+        print("numba absent : le moteur numba se replie sur index")
+    for dose_mg, concentration in CAS:
+        t_repli, attendu = chronometrer(engine._choisir_discontinu, engine.SYRINGES, dose_mg, concentration, 1,
+                                        repetitions=repetitions)
+        t_numba, obtenu = chronometrer(dilution_numba.choisir_discontinu, engine.SYRINGES, dose_mg, concentration, 1,
+                                       repetitions=repetitions)
+        tc_repli, attendu_c = chronometrer(engine._choisir_continu, engine.SYRINGES, dose_mg, concentration, 0, 2.4,
+                                           None, repetitions=repetitions)
+        tc_numba, obtenu_c = chronometrer(dilution_numba.choisir_continu, engine.SYRINGES, dose_mg, concentration, 0,
+                                          2.4, None, repetitions=repetitions)
+        print(f"dose={dose_mg:<6} C={concentration:<6} discontinu index={t_repli:6.2f} numba={t_numba:6.2f}  "
+              f"continu index={tc_repli:6.2f} numba={tc_numba:6.2f}  "
+              f"identique={repr(obtenu) == repr(attendu) and repr(obtenu_c) == repr(attendu_c)}")
+
+class _Enregistreur:
+    """Remplace st : compte les éléments émis et la taille JSON de leurs arguments."""
+
+    def __init__(self):
+        self.elements = 0
+        self.octets = 0
+
+    def __getattr__(self, nom):
+        def element(*args, **kwargs):
+            self.elements += 1
+            self.octets += len(json.dumps([args, kwargs], ensure_ascii=False, default=float).encode("utf-8"))
+            return self
+        return element
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+def bench_affichage(repetitions=200):
+    """Éléments Streamlit (un message websocket chacun) et charge estimée des rendus compact et détaillé."""
+    import dilution_affichage
+    print("== Rendu d'un protocole : éléments, charge estimée (octets) et temps (ms) ==")
+    for mode, generer in (("Discontinu", engine.generate_dilution_steps_discontinu),
+                          ("Continu", engine.generate_dilution_steps_continu)):
+        for dose_mg, concentration in CAS:
+            resultats = generer(dose_mg, concentration)
+            mesures = []
+            for compact in (False, True):
+                ui = _Enregistreur()
+                dilution_affichage.afficher_protocole(ui, resultats, mode, compact=compact)
+                temps, _ = chronometrer(dilution_affichage.afficher_protocole, _Enregistreur(), resultats, mode,
+                                        compact=compact, repetitions=repetitions)
+                mesures.append(f"{ui.elements:3d} éléments {ui.octets:6d} o {temps:6.3f} ms")
+            print(f"{mode:>10} dose={dose_mg:<6} C={concentration:<6} détaillé : {mesures[0]}   compact : {mesures[1]}")
+
+def bench_lot(nombre=50, concentrations=(100.0, 10.0, 1.0)):
+    """Table de titration : nombre doses cibles en un lot contre un appel par dose (ms)."""
+    print(f"== Lot de {nombre} doses cibles contre {nombre} appels séparés (ms) ==")
+    engine.construire_index()
+    cibles = [round(0.1 + 39.9 * i / (nombre - 1), 2) for i in range(nombre)]
+    for mode, generer, generer_lot in (
+            ("Discontinu", engine.generate_dilution_steps_discontinu, engine.generate_dilution_steps_discontinu_lot),
+            ("Continu", engine.generate_dilution_steps_continu, engine.generate_dilution_steps_continu_lot)):
+        for concentration in concentrations:
+            t_separes, attendus = chronometrer(lambda: [generer(d, concentration) for d in cibles])
+            t_lot, obtenus = chronometrer(generer_lot, cibles, concentration)
+            print(f"{mode:>10} C={concentration:<6} séparés={t_separes:8.1f}  lot={t_lot:8.1f}"
+                  f"  identique={repr(obtenus) == repr(attendus)}")
+
+def bench_parallele(nombre=48, processus=(1, 2, 4)):
+    """Protocoles indépendants (préchauffage du cache) : dans le processus contre le pool (ms).
+
+    Le pool est démarré et mis en route hors mesure, comme le processus courant. Sur une machine à un cœur, les
+    processus se partagent ce cœur : le pool ne peut y gagner, le banc le signale.
+    """
+    import os
+
+    import dilution_parallel
+    print(f"== {nombre} protocoles indépendants : processus courant contre pool ({os.cpu_count()} cœur(s)) ==")
+    taches = [("Continu" if i % 2 else "Discontinu", (round(0.5 + 39.5 * i / (nombre - 1), 2), concentration),
+               {"syringes": engine.SYRINGES})
+              for i in range(nombre) for concentration in (100.0,)]
+    dilution_parallel._tache_protocoles(taches)  # tables et caches du processus courant, hors mesure
+    t_seq, attendus = chronometrer(dilution_parallel._tache_protocoles, taches)
+    print(f"  processus courant : {t_seq:8.1f}")
+    for nb_processus in processus:
+        dilution_parallel.arreter()
+        dilution_parallel.demarrer(nb_processus)
+        dilution_parallel._protocoles_en_pool(taches, engine.SYRINGES)  # idem dans chaque processus
+        t_pool, obtenus = chronometrer(dilution_parallel._protocoles_en_pool, taches, engine.SYRINGES)
+        print(f"  pool de {nb_processus} : {t_pool:8.1f}  accélération={t_seq / t_pool:4.2f}"
+              f"  identique={obtenus == attendus}")
+    dilution_parallel.arreter()
+    if (os.cpu_count() or 1) == 1:
+        print("  un seul cœur : accélération non mesurable ici")
+
+if __name__ == "__main__":
+    bench_moteurs()
+    bench_memoire()
+    bench_faisceau()
+    bench_numba()
+    bench_affichage()
+    bench_lot()
+    bench_parallele()
@@ -0,0 +1,267 @@
+# charge_dilution.py
+# Test de charge : N sessions simultanées, comme autant d'utilisateurs d'une
+# même instance Streamlit (un processus, un thread par session).
+#
+#   python charge_dilution.py --sessions 1,2,4,8,16 --requetes 50
+#   python charge_dilution.py --sessions 8 --duree 60 --journal protocoles.log
+#   python charge_dilution.py --sessions 4 --requetes 5 --cible application
+#
+# Chaque session enchaîne des prescriptions tirées d'un mélange réaliste (ou du
+# journal de pharmacovigilance), avec sa propre session de recalcul comme dans
+# l'application. Pour chaque nombre de sessions : débit (protocoles/s), latences
+# p50/p99, temps CPU (en cœurs occupés : au-delà de 1, le GIL n'est pas le
+# goulot) et mémoire résidente maximale pendant le palier (échantillonnée dans
+# /proc/self/statm ; hors Linux, pic depuis le lancement du processus).
+# --cible application passe par l'interface elle-même (streamlit.testing), avec
+# son propre moteur et son cache : --moteur et --cache y sont refusés. Le journal
+# de pharmacovigilance et le cache de l'application (DOSAGE_JOURNAL, DOSAGE_CACHE)
+# sont alors des fichiers temporaires, neufs à chaque palier : les prescriptions
+# de charge n'atteignent pas les vrais fichiers, et un palier ne profite pas du
+# cache rempli par le précédent.
+import argparse
+import contextlib
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+import dilution_engine as engine
+
+try:
+    import resource
+except ImportError:  # Windows : mémoire non mesurée.
+    resource = None
+
+# Flacons courants (mg/mL) et leur poids dans le mélange.
+CONCENTRATIONS = ((1.0, 3), (2.0, 2), (5.0, 3), (10.0, 4), (20.0, 2), (40.0, 2), (50.0, 2), (100.0, 3),
+                  (200.0, 1), (500.0, 1))
+PART_CONTINU = 0.4
+HEURES = (12, 24, 24, 24, 48)
+DEBITS = (0.05, 0.1, 0.1, 0.2, 0.5)
+
+# ---------------------- PRESCRIPTIONS ----------------------
+def tirer_prescription(rng):
+    """(mode, dose_mg, concentration, options) : doses en échelle logarithmique entre 0,1 et 50 mg."""
+    concentrations, poids = zip(*CONCENTRATIONS)
+    concentration = rng.choices(concentrations, weights=poids)[0]
+    dose_mg = round(10 ** rng.uniform(-1, 1.7), 1)
+    if rng.random() < PART_CONTINU:
+        return "Continu", dose_mg, concentration, {"nb_hours": rng.choice(HEURES), "debit_mlh": rng.choice(DEBITS)}
+    return "Discontinu", dose_mg, concentration, {}
+
+def prescriptions_du_journal(journal, nombre=500):
+    """Prescriptions fréquentes du journal, répétées selon leur nombre d'occurrences."""
+    import dilution_cache
+    melange = []
+    for mode, dose_mg, concentration, parametres, _, occurrences in dilution_cache.prescriptions_frequentes(
+            journal, nombre):
+        if concentration > 0:
+            options = dict(parametres) if mode == "Continu" else {}
+            melange.extend([(mode, dose_mg, concentration, options)] * occurrences)
+    return melange
+
+# ---------------------- CIBLES ----------------------
+def cible_moteur(moteur="index", cache=None):
+    """Une requête de session appelle le moteur, comme la tâche de fond de l'application."""
+    def preparer():
+        return {"session": engine.nouvelle_session()} if moteur == "session" else {"moteur": moteur}
+
+    def executer(etat, mode, dose_mg, concentration, options):
+        options = dict(options, **etat)
+        if cache is not None:
+            import dilution_cache
+            return dilution_cache.generer(cache, mode, dose_mg, concentration, **options)
+        if mode == "Continu":
+            return engine.generate_dilution_steps_continu(dose_mg, concentration, **options)
+        return engine.generate_dilution_steps_discontinu(dose_mg, concentration, **options)
+    return preparer, executer
+
+def cible_application(script="code_correction.py", delai_max=60):
+    """Une requête de session rejoue l'interface : saisie des champs puis clic sur « Générer »."""
+    from streamlit.testing.v1 import AppTest
+
+    def preparer():
+        return {"app": AppTest.from_file(script, default_timeout=delai_max).run()}
+
+    def executer(etat, mode, dose_mg, concentration, options):
+        app = etat["app"]
+        app.radio[0].set_value(mode)
+        app.number_input[0].set_value(dose_mg)
+        app.number_input[1].set_value(concentration)
+        app.run()
+        bouton = next(b for b in app.button if b.label.startswith("🧪"))
+        bouton.click().run()
+        if app.exception:
+            raise RuntimeError(app.exception[0].value)
+        return [element.value for element in app.success]
+    return preparer, executer
+
+@contextlib.contextmanager
+def fichiers_temporaires(variables=("DOSAGE_JOURNAL", "DOSAGE_CACHE")):
+    """Pointe les variables d'environnement sur des fichiers d'un dossier temporaire, puis les rétablit."""
+    anciennes = {nom: os.environ.get(nom) for nom in variables}
+    with tempfile.TemporaryDirectory(prefix="charge_dilution_") as dossier:
+        try:
+            for nom in variables:
+                os.environ[nom] = os.path.join(dossier, nom.lower())
+            yield dossier
+        finally:
+            for nom, valeur in anciennes.items():
+                if valeur is None:
+                    os.environ.pop(nom, None)
+                else:
+                    os.environ[nom] = valeur
+
+# ---------------------- CHARGE ----------------------
+PERIODE_RSS = 0.01
+
+def _temps_cpu():
+    temps = os.times()
+    return temps.user + temps.system
+
+def _rss():
+    """Mémoire résidente actuelle (octets), ou None si /proc/self/statm est absent."""
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+def _rss_max_processus():
+    if resource is None:
+        return 0
+    # ru_maxrss : kilo-octets sous Linux, octets sous macOS.
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == "darwin" else 1024)
+
+def _suivre_rss(arret, pic):
+    """Relève la mémoire résidente toutes les PERIODE_RSS s jusqu'à arret ; garde le maximum dans pic[0]."""
+    while True:
+        rss = _rss()
+        if rss is None:
+            return
+        pic[0] = max(pic[0], rss)
+        if arret.wait(PERIODE_RSS):
+            return
+
+def charger(nb_sessions, preparer, executer, melange=None, requetes=20, duree=None, pause=0.0, graine=0):
+    """Lance nb_sessions sessions simultanées ; renvoie le rapport du palier (dict)."""
+    latences = [[] for _ in range(nb_sessions)]
+    erreurs = [0] * nb_sessions
+    depart = threading.Barrier(nb_sessions + 1)
+
+    def session(numero):
+        rng = random.Random(graine * 1000 + numero)
+        try:
+            etat = preparer()
+        except BaseException:
+            depart.abort()
+            raise
+        depart.wait()
+        fin = None if duree is None else time.perf_counter() + duree
+        n = 0
+        while (n < requetes) if fin is None else (time.perf_counter() < fin):
+            mode, dose_mg, concentration, options = rng.choice(melange) if melange else tirer_prescription(rng)
+            debut = time.perf_counter()
+            try:
+                executer(etat, mode, dose_mg, concentration, options)
+            except Exception:
+                erreurs[numero] += 1
+            latences[numero].append(time.perf_counter() - debut)
+            n += 1
+            if pause:
+                time.sleep(rng.expovariate(1 / pause))
+
+    threads = [threading.Thread(target=session, args=(numero,), name=f"charge-{numero}") for numero in range(nb_sessions)]
+    for thread in threads:
+        thread.start()
+    pic_rss, arret_rss = [0], threading.Event()
+    suivi_rss = threading.Thread(target=_suivre_rss, args=(arret_rss, pic_rss), name="charge-rss", daemon=True)
+    depart.wait()
+    suivi_rss.start()
+    cpu_debut = _temps_cpu()
+    debut = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    ecoule = time.perf_counter() - debut
+    cpu_fin = _temps_cpu()
+    arret_rss.set()
+    suivi_rss.join()
+    rss = pic_rss[0] if _rss() is not None else _rss_max_processus()
+
+    toutes = np.array([latence for latences_session in latences for latence in latences_session])
+    return {
+        "sessions": nb_sessions,
+        "requetes": int(toutes.size),
+        "erreurs": sum(erreurs),
+        "duree_s": ecoule,
+        "debit_par_s": toutes.size / ecoule if ecoule else 0.0,
+        "p50_ms": float(np.percentile(toutes, 50) * 1000) if toutes.size else None,
+        "p99_ms": float(np.percentile(toutes, 99) * 1000) if toutes.size else None,
+        "max_ms": float(toutes.max() * 1000) if toutes.size else None,
+        "coeurs_cpu": (cpu_fin - cpu_debut) / ecoule if ecoule else 0.0,
+        "rss_max_mo": rss / 2 ** 20,
+    }
+
+def _ms(valeur):
+    # Palier sans requête terminée : pas de latence.
+    return f"{'—':>8}" if valeur is None else f"{valeur:>8.1f}"
+
+def resumer(rapports, sortie=print):
+    sortie(f"{'sessions':>8} {'requêtes':>8} {'erreurs':>7} {'débit/s':>8} {'p50 ms':>8} {'p99 ms':>8} "
+           f"{'max ms':>8} {'cœurs':>6} {'RSS Mo':>7}")
+    for r in rapports:
+        sortie(f"{r['sessions']:>8} {r['requetes']:>8} {r['erreurs']:>7} {r['debit_par_s']:>8.1f} "
+               f"{_ms(r['p50_ms'])} {_ms(r['p99_ms'])} {_ms(r['max_ms'])} {r['coeurs_cpu']:>6.2f} "
+               f"{r['rss_max_mo']:>7.0f}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Test de charge : sessions simultanées sur une instance.")
+    parser.add_argument("--sessions", default="1,2,4,8", help="nombres de sessions simultanées (paliers)")
+    parser.add_argument("--requetes", type=int, default=20, help="requêtes par session")
+    parser.add_argument("--duree", type=float, default=None, help="durée de chaque palier (s), au lieu de --requetes")
+    parser.add_argument("--pause", type=float, default=0.0, help="temps de réflexion moyen entre deux requêtes (s)")
+    parser.add_argument("--cible", default="moteur", choices=["moteur", "application"])
+    parser.add_argument("--moteur", default=None, choices=sorted(engine.MOTEURS_DISCONTINU) + ["session"],
+                        help="moteur de la cible moteur (session par défaut)")
+    parser.add_argument("--cache", default=None, help="cache persistant à traverser (voir dilution_cache.py)")
+    parser.add_argument("--journal", default=None, help="tirer les prescriptions du journal de pharmacovigilance")
+    parser.add_argument("--graine", type=int, default=0)
+    parser.add_argument("--json", action="store_true", help="rapport en JSON")
+    args = parser.parse_args(argv)
+    if args.cible == "application" and (args.moteur is not None or args.cache):
+        parser.error("--moteur et --cache ne s'appliquent qu'à --cible moteur : l'application a les siens.")
+
+    engine.construire_index()
+    if args.cible == "application":
+        try:
+            preparer, executer = cible_application()
+        except ImportError:
+            print("--cible application nécessite streamlit (streamlit.testing).", file=sys.stderr)
+            return 2
+    else:
+        cache = None
+        if args.cache:
+            import dilution_cache
+            cache = dilution_cache.ouvrir(args.cache)
+        preparer, executer = cible_moteur(args.moteur or "session", cache)
+    melange = prescriptions_du_journal(args.journal) if args.journal else None
+
+    rapports = []
+    for n in args.sessions.split(","):
+        with fichiers_temporaires() if args.cible == "application" else contextlib.nullcontext():
+            rapports.append(charger(int(n), preparer, executer, melange, args.requetes, args.duree, args.pause,
+                                    args.graine))
+    if args.json:
+        json.dump(rapports, sys.stdout, ensure_ascii=False, indent=2)
+        sys.stdout.write("\n")
+    else:
+        resumer(rapports)
+    return 1 if any(r["erreurs"] for r in rapports) else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,258 +1,38 @@
 # app_dilution.py
 import streamlit as st
-import numpy as np
-import math
-from fpdf import FPDF
-import tempfile
-
-# ----------------------------- PARAMÈTRES -----------------------------
-SYRINGES = {
-    2: 0.1,
-    5: 0.2,
-    10: 0.2,
-    20: 1.0,
-    50: 1.0,
-    60: 1.0
-}
-
-ANOVA = 109
-SIGMA_MES = 0.7
-SIGMA_RATIO = 7.9
-
-# ----------------------------- FONCTIONS UTILES -----------------------------
-def arrondir_volume(volume, graduation):
-    return round(round(volume / graduation) * graduation, 2)
-
-def est_mesurable(volume, graduation):
-    return abs(volume - arrondir_volume(volume, graduation)) <= 0.01
-
-def calculer_moyenne_precision(dose, nb_mes, ratio_ser):
-    return (dose / 100) * (ANOVA + nb_mes * SIGMA_MES + (ratio_ser / 100) * SIGMA_RATIO)
-
-def calculer_ecart_type(dose, nb_mes, ratio_ser):
-    numerateur = abs((-26.15 * math.log(ratio_ser)) + 95 + 2 * nb_mes) * (dose / 100)
-    return numerateur / (1.96 * 2)
-
-def calculer_IC(moyenne, et):
-    borne_inf = moyenne - 1.96 * et
-    borne_sup = moyenne + 1.96 * et
-    return (round(borne_inf, 2), round(borne_sup, 2))
-
-# ---------------------- MODE DISCONTINU (LOGIQUE MODIFIÉE) ----------------------
-def generate_dilution_steps_discontinu(dose_mg, concentration_init):
-    current_concentration = concentration_init
-    steps = []
-    cible_min = dose_mg - 1.0
-    cible_max = dose_mg + 1.0
-    is_first_step = True
-    etape_compteur = 1
-
-    for etape in range(5):
-        meilleures_options = []
-        for syringe_volume, graduation in SYRINGES.items():
-            vol_prelevables = np.arange(graduation, syringe_volume + 0.01, graduation)
-            for volume_prelevé in vol_prelevables:
-                if volume_prelevé < 2 * graduation:
-                    continue
-                if not est_mesurable(volume_prelevé, graduation):
-                    continue
-                if (volume_prelevé / syringe_volume) * 100 < 30:
-                    continue
-
-                max_ajout = syringe_volume - volume_prelevé
-                for vol_ajouté in np.arange(0, max_ajout + 0.01, graduation):
-                    volume_total = round(volume_prelevé + vol_ajouté, 2)
-                    if volume_total > syringe_volume:
-                        continue
-                    if not est_mesurable(volume_total, graduation):
-                        continue
-                    ratio = round((volume_total / syringe_volume) * 100, 2)
-                    if ratio < 30:
-                        continue
-
-                    new_concentration = round(current_concentration * (volume_prelevé / volume_total), 2)
-
-                    for volume_injecte in np.arange(graduation, syringe_volume + 0.01, graduation):
-                        volume_injecte = arrondir_volume(volume_injecte, graduation)
-                        if volume_injecte > syringe_volume:
-                            continue
-
-                        dose = round(new_concentration * volume_injecte, 2)
-                        if dose > dose_mg + 1.5:
-                            continue
-
-                        moyenne_precision = calculer_moyenne_precision(dose, etape_compteur, ratio)
-                        ecart_type = calculer_ecart_type(dose, etape_compteur, ratio)
-                        ic_inf, ic_sup = calculer_IC(moyenne_precision, ecart_type)
-
-                        option = {
-                            "étape": etape_compteur,
-                            "seringue": syringe_volume,
-                            "volume prélevé": volume_prelevé,
-                            "volume ajouté": round(vol_ajouté, 2),
-                            "volume total": volume_total,
-                            "ratio": ratio,
-                            "concentration finale": new_concentration,
-                            "dose obtenue": dose,
-                            "volume injecté": volume_injecte,
-                            "moyenne_precision": moyenne_precision,
-                            "ecart_type": ecart_type,
-                            "IC": (ic_inf, ic_sup)
-                        }
-
-                        
-
-                        meilleures_options.append(option)
-
-        meilleures_options = sorted(meilleures_options, key=lambda x: (abs(x['dose obtenue'] - dose_mg), x['moyenne_precision']))
-
-        if not meilleures_options:
-            break
-
-        meilleure = meilleures_options[0]
-
-        if is_first_step and meilleure['volume ajouté'] != 0.0:
-            etape_virtuelle = {
-                "type": "virtuelle",
-                "étape": 1,
-                "seringue": meilleure['seringue'],
-                "volume prélevé": meilleure['volume prélevé'],
-                "volume ajouté": 0.0,
-                "ratio": round((meilleure['volume prélevé'] / meilleure['seringue']) * 100, 2),
-                "concentration": concentration_init,
-                
-            }
-            steps.append(etape_virtuelle)
-            meilleure['étape'] = 2
-            etape_compteur += 1
-
-        meilleure["type"] = "réelle"
-        steps.append(meilleure)
-        etape_compteur += 1
-        is_first_step = False
-
-        if cible_min <= meilleure['dose obtenue'] <= cible_max:
-            break
-
-        current_concentration = meilleure['concentration finale']
-
-    if steps:
-        for step in reversed(steps):
-            if step.get("type") == "réelle":
-                derniere = step
-                break
-        steps.append({
-            "type": "metriques",
-            "moyenne_precision": derniere['moyenne_precision'],
-            "ecart_type": derniere['ecart_type'],
-            "IC": derniere['IC']
-        })
-
-    return steps
-
-
-# ---------------------- MODE CONTINU (LOGIQUE MODIFIÉE) ----------------------
-def generate_dilution_steps_continu(dose_mg, concentration_init, nb_hours=24, debit_mlh=0.1):
-    current_concentration = concentration_init
-    steps = []
-    cible_min = dose_mg - 1.0
-    cible_max = dose_mg + 1.0
-    volume_injecte = round(debit_mlh * nb_hours, 2)
-    affichage_etapes = []
-    derniere_etape = None
-
-    for etape in range(5):
-        meilleures_options = []
-        for syringe_volume, graduation in SYRINGES.items():
-            vol_prelevables = np.arange(graduation, syringe_volume + 0.01, graduation)
-            for volume_prelevé in vol_prelevables:
-                if volume_prelevé < 2 * graduation:
-                    continue
-                if not est_mesurable(volume_prelevé, graduation):
-                    continue
-                if (volume_prelevé / syringe_volume) * 100 < 30:
-                    continue
-                if steps and volume_prelevé > steps[-1]['volume total']:
-                    continue
-
-                max_ajout = syringe_volume - volume_prelevé
-                for vol_ajouté in np.arange(0, max_ajout + 0.01, graduation):
-                    volume_total = round(volume_prelevé + vol_ajouté, 2)
-                    if volume_total > syringe_volume:
-                        continue
-                    if not est_mesurable(volume_total, graduation):
-                        continue
-                    if (volume_total / syringe_volume) * 100 < 30:
-                        continue
-                    if etape >= 1 and volume_total < volume_injecte:
-                        continue
-                    if etape >= 1 and syringe_volume < 5:
-                        continue
-
-                    new_concentration = round(current_concentration * (volume_prelevé / volume_total), 2)
-                    dose = round(new_concentration * volume_injecte, 2)
-                    ratio_ser = round((volume_total / syringe_volume) * 100, 2)
-                    moyenne_precision = calculer_moyenne_precision(dose, etape + 1, ratio_ser)
-                    ecart_type = calculer_ecart_type(dose, etape + 1, ratio_ser)
-                    ic_inf, ic_sup = calculer_IC(moyenne_precision, ecart_type)
-
-                    option = {
-                        "étape": etape + 1,
-                        "seringue": syringe_volume,
-                        "volume prélevé": volume_prelevé,
-                        "volume ajouté": round(vol_ajouté, 2),
-                        "volume total": volume_total,
-                        "ratio": ratio_ser,
-                        "concentration": new_concentration,
-                        "dose": dose,
-                        "moyenne_precision": moyenne_precision,
-                        "ecart_type": ecart_type,
-                        "IC": (ic_inf, ic_sup)
-                    }
-
-                    meilleures_options.append(option)
-
-        meilleures_options = sorted(meilleures_options, key=lambda x: (abs(x['dose'] - dose_mg), x['moyenne_precision']))
-
-        if not meilleures_options:
-            break
-
-        meilleure = meilleures_options[0]
-
-        if meilleure['volume ajouté'] != 0:
-            ratio_virtuel = round((meilleure['volume prélevé'] / meilleure['seringue']) * 100, 2)
-            concentration_virtuelle = (meilleure['volume total'] * meilleure['concentration']) / meilleure['volume prélevé']
-            concentration_virtuelle = round(concentration_virtuelle + 1e-3, 2)
-            dose_obtenue = round(concentration_virtuelle * volume_injecte, 2)
-            etape_virtuelle = {
-                "type": "virtuelle",
-                "seringue": meilleure['seringue'],
-                "volume prélevé": meilleure['volume prélevé'],
-                "ratio": ratio_virtuel,
-                "concentration": concentration_virtuelle,
-                "dose": dose_obtenue
-            }
-            affichage_etapes.append(etape_virtuelle)
-
-        meilleure["type"] = "réelle"
-        steps.append(meilleure)
-        affichage_etapes.append(meilleure)
-        derniere_etape = meilleure
-
-        if cible_min <= meilleure['dose'] <= cible_max:
-            break
-
-        current_concentration = meilleure['concentration']
-
-    if derniere_etape:
-        affichage_etapes.append({
-            "type": "metriques",
-            "moyenne_precision": derniere_etape['moyenne_precision'],
-            "ecart_type": derniere_etape['ecart_type'],
-            "IC": derniere_etape['IC']
-        })
-
-    return affichage_etapes
+import os
+
+import dilution_cache
+import dilution_metriques
+from dilution_affichage import afficher_comparaison, afficher_protocole
+from dilution_engine import nouvelle_session
+from dilution_regles import charger_regles
+from dilution_taches import (annuler, attendre, est_terminee, lancer_calcul, lancer_comparaison, lancer_couverture,
+                             lancer_sensibilite)
+
+# Journal de pharmacovigilance (voir dilution_audit.py)
+JOURNAL_PROTOCOLES = os.environ.get("DOSAGE_JOURNAL", "protocoles.log")
+
+# Règles de préparation du site (voir dilution_regles.py) : fichier JSON et nom du site.
+FICHIER_REGLES = os.environ.get("DOSAGE_REGLES")
+SITE = os.environ.get("DOSAGE_SITE")
+
+# Cache persistant des protocoles (voir dilution_cache.py), conservé entre deux
+# redémarrages et préchauffé en fond avec les prescriptions fréquentes du journal,
+# sous les règles du site (celles d'un médicament non renseigné).
+CACHE_PROTOCOLES = dilution_cache.ouvrir(os.environ.get("DOSAGE_CACHE", "protocoles_cache.sqlite"))
+dilution_cache.prechauffer_en_fond(CACHE_PROTOCOLES, JOURNAL_PROTOCOLES,
+                                   regles=charger_regles(FICHIER_REGLES, None, SITE) if FICHIER_REGLES else None)
+
+# Délai maximal d'une recherche en secondes (ex. 0.2 au lit du patient) ; recherche complète si absent.
+DELAI_RECHERCHE = float(os.environ["DOSAGE_DELAI"]) if os.environ.get("DOSAGE_DELAI") else None
+
+# Métriques OpenMetrics (voir dilution_metriques.py) : point d'accès local et/ou
+# fichier réécrit périodiquement. Démarrés une seule fois par processus.
+if os.environ.get("DOSAGE_METRIQUES_PORT"):
+    dilution_metriques.servir(int(os.environ["DOSAGE_METRIQUES_PORT"]))
+if os.environ.get("DOSAGE_METRIQUES"):
+    dilution_metriques.ecrire_periodiquement(os.environ["DOSAGE_METRIQUES"])
 
 # ---------------------- INTERFACE STREAMLIT ----------------------
 st.set_page_config(page_title="Calcul de dosage intelligent", page_icon="🧪")
@@ -261,60 +41,166 @@ st.title("💉 Application d'Optimisation des préparations médicamenteuses")
 mode = st.radio("Mode d'administration :", ["Continu", "Discontinu"])
 dose = st.number_input("Dose cible (en mg) :", min_value=0.0, step=0.1)
 concentration = st.number_input("Concentration initiale (en mg/mL) :", min_value=0.0, step=1.0)
+medicament = st.text_input("Médicament (règles du site) :") if FICHIER_REGLES else None
+
+with st.expander("🗺️ Doses atteignables pour cette concentration"):
+    st.caption("Doses cibles atteignables à ± 1 mg en 1, 2 ou 3 étapes de dilution (mode discontinu).")
+    tache_couverture = st.session_state.get("tache_couverture")
+    if tache_couverture is not None and tache_couverture["parametres"] != (concentration,):
+        tache_couverture = st.session_state["tache_couverture"] = None
+    if concentration == 0:
+        st.info("Saisissez une concentration initiale.")
+    elif st.button("Calculer la couverture"):
+        # Calcul en fond (quelques dixièmes de seconde au-delà de 500 mg/mL).
+        tache_couverture = st.session_state["tache_couverture"] = lancer_couverture(concentration)
+    if tache_couverture is not None:
+        if not est_terminee(tache_couverture):
+            with st.spinner("Calcul de la couverture…"):
+                attendre(tache_couverture)
+        if tache_couverture["erreur"] is not None:
+            st.exception(tache_couverture["erreur"])
+        else:
+            st.dataframe(
+                [{"Dose min (mg)": c["dose_min"], "Dose max (mg)": c["dose_max"], "Étapes minimales": c["nb_etapes"]}
+                 for c in tache_couverture["resultat"]],
+                hide_index=True,
+            )
+
+# Une table par protocole (4 éléments) au lieu d'une section par étape (~12 éléments chacune).
+compact = st.checkbox("Affichage compact du protocole", value=True)
+
+parametres = (mode, dose, concentration)
+tache = st.session_state.get("tache_dilution")
+
+# Toute modification des entrées rend le calcul en cours obsolète : on l'annule.
+if tache is not None and tache["parametres"] != parametres:
+    annuler(tache)
+    tache = st.session_state["tache_dilution"] = None
 
 if st.button("🧪 Générer le protocole de dilution"):
     if dose == 0 or concentration == 0:
         st.warning("Veuillez entrer une dose et une concentration valides.")
     else:
-        resultats = generate_dilution_steps_continu(dose, concentration) if mode == "Continu" else generate_dilution_steps_discontinu(dose, concentration)
-
-        if not resultats:
-            st.error("❌ Aucun protocole trouvé.")
+        if tache is not None:
+            annuler(tache)
+        if FICHIER_REGLES:
+            # Les règles de site restreignent l'index : moteur « index », sans session.
+            options = {"regles": charger_regles(FICHIER_REGLES, medicament or None, SITE)}
         else:
-            st.success(f"✅ Protocole généré pour {dose} mg :")
-            for idx, step in enumerate(resultats, 1):
-                if step.get("type") == "metriques":
-                    st.markdown("### 📊 Métriques finales")
-                    st.write(f"**Précision (moyenne)** : {step['moyenne_precision']:.2f}")
-                    st.write(f"**Écart-type** : {step['ecart_type']:.2f}")
-                    st.write(f"**Intervalle de confiance (95%)** : [{step['IC'][0]}, {step['IC'][1]}]")
-                else:
-                    with st.expander(f"🧪 Étape {idx}"):
-                        st.write(f"**Seringue utilisée** : {step['seringue']} mL")
-                        
-                        # Affichage conditionnel selon l'étape
-                        label_volume = "Volume gardé" if idx >= 2 else "Volume prélevé"
-                        st.write(f"**{label_volume}** : {step['volume prélevé']:.2f} mL")
-
-                        if step.get('type') == 'réelle':
-                            st.write(f"**Volume ajouté** : {step['volume ajouté']:.2f} mL")
-                            st.write(f"**Volume total** : {step['volume total']:.2f} mL")
-                            
-                        if step.get('type') == 'virtuelle':
-                            st.write(f"**Volume ajouté** : 0.0 mL")
-                            st.write(f"**Volume total** : {step['volume prélevé']:.2f} mL")
-                            
-                        st.write(f"**Ratio seringue rempli** : {step['ratio']}%")
-                        st.write(f"**Concentration obtenue** : {step.get('concentration finale', step.get('concentration', 'N/A'))} mg/mL")
-
-                        if not (mode == "Discontinu" and step.get('type') == 'virtuelle'):
-                            st.write(f"**Dose obtenue** : {step.get('dose obtenue', step.get('dose', 'N/A'))} mg")
-
-
-
-                        
-                        if 'volume injecté' in step:
-                            st.write(f"**Volume injecté** : {step['volume injecté']:.2f} mL")
-                        if 'remarque' in step:
-                            st.info(step['remarque'])
+            # Les tables de candidats de la requête précédente sont réutilisées si seule la dose ou le mode change.
+            options = {"session": st.session_state.setdefault("session_dilution", nouvelle_session())}
+        # Mêmes règles de site pour la sensibilité (jamais la session : voir plus bas).
+        st.session_state["regles_dilution"] = options.get("regles")
+        tache = st.session_state["tache_dilution"] = lancer_calcul(mode, dose, concentration, journal=JOURNAL_PROTOCOLES,
+                                                                 cache=CACHE_PROTOCOLES, delai=DELAI_RECHERCHE,
+                                                                 **options)
+
+if tache is not None:
+    if not est_terminee(tache):
+        barre = st.progress(0.0, text="Recherche du protocole…")
+        # Les étapes déjà choisies sont affichées pendant la recherche des suivantes.
+        apercu = st.empty()
+        affichees = 0
+        while not attendre(tache, 0.1):
+            infos = tache["progression"]
+            seringue = f"seringue {infos['seringue']} mL" if infos["seringue"] else "toutes seringues"
+            barre.progress(infos["fraction"], text=f"Étape {infos['étape']} — {seringue} — {infos['candidats']} candidats évalués")
+            etapes = list(tache["etapes"])
+            if len(etapes) > affichees:
+                afficher_protocole(apercu.container(), etapes, mode, compact=compact)
+                affichees = len(etapes)
+        barre.empty()
+        apercu.empty()
+
+    resultats = tache["resultat"]
+    if tache["erreur"] is not None:
+        st.exception(tache["erreur"])
+    elif not resultats:
+        st.error("❌ Aucun protocole trouvé.")
+    else:
+        st.success(f"✅ Protocole généré pour {dose} mg :")
+        afficher_protocole(st, resultats, mode, compact=compact)
 
-        
+    
 
-            if mode == "Discontinu":
-                for step in reversed(resultats):
-                    if step.get("type") != "metriques":
-                        st.subheader(f"💉 Volume final à injecter : {step['volume injecté']} mL")
-                        break
+        if mode == "Discontinu":
+            for step in reversed(resultats):
+                if step.get("type") != "metriques":
+                    st.subheader(f"💉 Volume final à injecter : {step['volume injecté']} mL")
+                    break
 
+        else:
+            st.subheader("💧 Mode continu avec une vitesse de perfusion de 0.1 mL/h")
+
+        with st.expander("📉 Sensibilité à la concentration réelle du flacon"):
+            st.caption("Doses obtenues par ce protocole si la concentration du flacon s'écarte de l'étiquette (± 5 %).")
+            rechercher = st.checkbox("Relancer aussi la recherche pour chaque concentration")
+            # Calculée en fond, une fois par protocole et par choix de la case : pas à chaque réexécution.
+            # La recherche relancée passe par le moteur « index », hors de la session de l'utilisateur.
+            parametres_sensibilite = (tache["debut"], rechercher)
+            tache_sensibilite = st.session_state.get("tache_sensibilite")
+            if tache_sensibilite is None or tache_sensibilite["parametres"] != parametres_sensibilite:
+                tache_sensibilite = st.session_state["tache_sensibilite"] = lancer_sensibilite(
+                    parametres_sensibilite, mode, dose, concentration, etapes=resultats, rechercher=rechercher,
+                    delai=DELAI_RECHERCHE, regles=st.session_state.get("regles_dilution"))
+            if not est_terminee(tache_sensibilite):
+                with st.spinner("Analyse de sensibilité…"):
+                    attendre(tache_sensibilite)
+            if tache_sensibilite["erreur"] is not None:
+                st.exception(tache_sensibilite["erreur"])
+                st.stop()
+            analyse = tache_sensibilite["resultat"]
+            lignes = []
+            for i, ecart in enumerate(analyse["ecarts"]):
+                ligne = {"Écart": f"{ecart:+.0%}", "Concentration (mg/mL)": round(analyse["concentrations"][i], 2),
+                         "Dose obtenue (mg)": analyse["doses"][i], "Dans la cible ± 1 mg": analyse["dans_cible"][i]}
+                if rechercher:
+                    ligne["Protocole recommandé modifié"] = analyse["plan_change"][i]
+                    ligne["Dose après nouvelle recherche (mg)"] = analyse["doses_recherche"][i]
+                lignes.append(ligne)
+            st.dataframe(lignes, hide_index=True)
+            if analyse["toujours_dans_cible"]:
+                st.success(f"Dose entre {analyse['dose_min']} et {analyse['dose_max']} mg : toujours dans la cible.")
             else:
-                st.subheader("💧 Mode continu avec une vitesse de perfusion de 0.1 mL/h")
+                st.warning(f"Dose entre {analyse['dose_min']} et {analyse['dose_max']} mg : sortie de la cible ± 1 mg.")
+
+# ---------------------- COMPARAISON CONTINU / DISCONTINU ----------------------
+# Les deux recherches tournent en même temps, chacune dans un processus : sur
+# plusieurs cœurs, la comparaison attend la plus lente des deux au lieu de leur somme.
+st.divider()
+comparaison = st.session_state.get("comparaison_dilution")
+if comparaison is not None and comparaison["parametres"] != (dose, concentration):
+    for tache_mode in comparaison["taches"].values():
+        annuler(tache_mode)
+    comparaison = st.session_state["comparaison_dilution"] = None
+
+if st.button("⚖️ Comparer continu et discontinu"):
+    if dose == 0 or concentration == 0:
+        st.warning("Veuillez entrer une dose et une concentration valides.")
+    else:
+        if comparaison is not None:
+            for tache_mode in comparaison["taches"].values():
+                annuler(tache_mode)
+        # Sans règles de site, chaque processus du pool garde ses propres sessions.
+        options = {"regles": charger_regles(FICHIER_REGLES, medicament or None, SITE)} if FICHIER_REGLES else {}
+        comparaison = st.session_state["comparaison_dilution"] = {
+            "parametres": (dose, concentration),
+            "taches": lancer_comparaison(dose, concentration, journal=JOURNAL_PROTOCOLES, cache=CACHE_PROTOCOLES,
+                                         delai=DELAI_RECHERCHE, **options),
+        }
+
+if comparaison is not None:
+    taches = comparaison["taches"]
+    if not all(est_terminee(tache_mode) for tache_mode in taches.values()):
+        with st.spinner("Recherche des protocoles continu et discontinu…"):
+            for tache_mode in taches.values():
+                attendre(tache_mode)
+    erreurs = [tache_mode["erreur"] for tache_mode in taches.values() if tache_mode["erreur"] is not None]
+    if erreurs:
+        st.exception(erreurs[0])
+    else:
+        fin = max(tache_mode["debut"] + (tache_mode["duree"] or 0.0) for tache_mode in taches.values())
+        debut = min(tache_mode["debut"] for tache_mode in taches.values())
+        st.caption(f"⏱️ Comparaison obtenue en {(fin - debut) * 1000:.0f} ms.")
+        afficher_comparaison(st, {m: t["resultat"] or [] for m, t in taches.items()},
+                             durees={m: t["duree"] for m, t in taches.items()}, compact=compact)
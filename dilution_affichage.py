@@ -0,0 +1,138 @@
+# dilution_affichage.py
+# Rendu d'un protocole dans Streamlit.
+#
+# Chaque appel st.* est un élément envoyé au navigateur à chaque réexécution :
+# le rendu détaillé (une section et une dizaine de st.write par étape) coûte une
+# soixantaine d'éléments pour 5 étapes. Le rendu compact construit une seule
+# table des étapes à partir des résultats, plus une ligne de métriques et une
+# table de détails repliée, soit 4 éléments quel que soit le nombre d'étapes.
+# ui est st ou un conteneur Streamlit (st.container(), st.sidebar...).
+#
+# afficher_comparaison place côte à côte les protocoles continu et discontinu
+# d'une même prescription, avec leurs métriques de précision.
+
+def _nombre(valeur):
+    # Scalaires numpy : nombres Python pour la sérialisation de la table.
+    return round(float(valeur), 2) if valeur is not None else None
+
+def lignes_etapes(resultats, mode):
+    """Une ligne par étape (réelle ou virtuelle) : volumes, concentration et dose."""
+    lignes = []
+    for idx, step in enumerate(resultats, 1):
+        if step.get("type") == "metriques":
+            continue
+        virtuelle = step.get("type") == "virtuelle"
+        dose = step.get("dose obtenue", step.get("dose"))
+        lignes.append({
+            "Étape": idx,
+            "Type": step.get("type"),
+            "Seringue (mL)": step["seringue"],
+            # Même colonne à chaque ligne : l'origine du volume est dans la ligne, pas dans le nom de colonne.
+            "Prélevé (mL)": _nombre(step["volume prélevé"]),
+            "Prélevé depuis": "flacon" if idx == 1 else f"étape {idx - 1} (volume gardé)",
+            "Ajouté (mL)": 0.0 if virtuelle else _nombre(step["volume ajouté"]),
+            "Total (mL)": _nombre(step["volume prélevé"] if virtuelle else step["volume total"]),
+            "Ratio (%)": _nombre(step["ratio"]),
+            "Concentration (mg/mL)": _nombre(step.get("concentration finale", step.get("concentration"))),
+            "Dose (mg)": None if mode == "Discontinu" and virtuelle else _nombre(dose),
+            "Injecté (mL)": _nombre(step.get("volume injecté")),
+        })
+    return lignes
+
+def lignes_details(resultats):
+    """Précision, écart-type, IC et remarques des étapes réelles."""
+    return [{
+        "Étape": idx,
+        "Précision (moyenne)": _nombre(step["moyenne_precision"]),
+        "Écart-type": _nombre(step["ecart_type"]),
+        "IC 95 %": f"[{step['IC'][0]}, {step['IC'][1]}]",
+        "Remarque": step.get("remarque", ""),
+    } for idx, step in enumerate(resultats, 1) if step.get("type") == "réelle"]
+
+def texte_metriques(step):
+    texte = (f"**📊 Précision (moyenne)** : {step['moyenne_precision']:.2f} · **Écart-type** : "
+             f"{step['ecart_type']:.2f} · **IC 95 %** : [{step['IC'][0]}, {step['IC'][1]}]")
+    if step.get("statut") == "meilleur_dans_delai":
+        texte += "  \n⏱️ Meilleur protocole trouvé dans le délai imparti (recherche interrompue)."
+    return texte
+
+def resume(resultats, mode):
+    """Dose obtenue, nombre d'étapes réelles et métriques finales d'un protocole (None si vide)."""
+    reelles = [step for step in resultats if step.get("type") == "réelle"]
+    if not reelles:
+        return None
+    finales = resultats[-1]
+    return {
+        "dose": _nombre(reelles[-1]["dose" if mode == "Continu" else "dose obtenue"]),
+        "etapes": len(reelles),
+        "moyenne_precision": _nombre(finales["moyenne_precision"]),
+        "ecart_type": _nombre(finales["ecart_type"]),
+        "IC": finales["IC"],
+    }
+
+# ---------------------- RENDUS ----------------------
+def afficher_compact(ui, resultats, mode):
+    ui.dataframe(lignes_etapes(resultats, mode), hide_index=True)
+    for step in resultats:
+        if step.get("type") == "metriques":
+            ui.markdown(texte_metriques(step))
+    with ui.expander("Détails des étapes"):
+        ui.dataframe(lignes_details(resultats), hide_index=True)
+
+def afficher_detaille(ui, resultats, mode):
+    """Rendu d'origine : une section dépliable par étape."""
+    for idx, step in enumerate(resultats, 1):
+        if step.get("type") == "metriques":
+            ui.markdown("### 📊 Métriques finales")
+            ui.write(f"**Précision (moyenne)** : {step['moyenne_precision']:.2f}")
+            ui.write(f"**Écart-type** : {step['ecart_type']:.2f}")
+            ui.write(f"**Intervalle de confiance (95%)** : [{step['IC'][0]}, {step['IC'][1]}]")
+            if step.get("statut") == "meilleur_dans_delai":
+                ui.info("⏱️ Meilleur protocole trouvé dans le délai imparti (recherche interrompue).")
+            continue
+        with ui.expander(f"🧪 Étape {idx}"):
+            ui.write(f"**Seringue utilisée** : {step['seringue']} mL")
+
+            # Affichage conditionnel selon l'étape
+            label_volume = "Volume gardé" if idx >= 2 else "Volume prélevé"
+            ui.write(f"**{label_volume}** : {step['volume prélevé']:.2f} mL")
+
+            if step.get('type') == 'réelle':
+                ui.write(f"**Volume ajouté** : {step['volume ajouté']:.2f} mL")
+                ui.write(f"**Volume total** : {step['volume total']:.2f} mL")
+
+            if step.get('type') == 'virtuelle':
+                ui.write(f"**Volume ajouté** : 0.0 mL")
+                ui.write(f"**Volume total** : {step['volume prélevé']:.2f} mL")
+
+            ui.write(f"**Ratio seringue rempli** : {step['ratio']}%")
+            ui.write(f"**Concentration obtenue** : {step.get('concentration finale', step.get('concentration', 'N/A'))} mg/mL")
+
+            if not (mode == "Discontinu" and step.get('type') == 'virtuelle'):
+                ui.write(f"**Dose obtenue** : {step.get('dose obtenue', step.get('dose', 'N/A'))} mg")
+
+            if 'volume injecté' in step:
+                ui.write(f"**Volume injecté** : {step['volume injecté']:.2f} mL")
+            if 'remarque' in step:
+                ui.info(step['remarque'])
+
+def afficher_protocole(ui, resultats, mode, compact=True):
+    (afficher_compact if compact else afficher_detaille)(ui, resultats, mode)
+
+def afficher_comparaison(ui, protocoles, durees=None, compact=True):
+    """protocoles : {mode: résultats} ; durees : {mode: secondes}, affichées sous chaque protocole."""
+    for colonne, (mode, resultats) in zip(ui.columns(len(protocoles)), protocoles.items()):
+        colonne.subheader(mode)
+        synthese = resume(resultats, mode)
+        if synthese is None:
+            colonne.error("❌ Aucun protocole trouvé.")
+            continue
+        gauche, droite = colonne.columns(2)
+        gauche.metric("Dose obtenue (mg)", synthese["dose"])
+        droite.metric("Étapes", synthese["etapes"])
+        gauche.metric("Précision (moyenne)", synthese["moyenne_precision"])
+        droite.metric("Écart-type", synthese["ecart_type"])
+        colonne.caption(f"IC 95 % : [{synthese['IC'][0]}, {synthese['IC'][1]}]")
+        if durees and durees.get(mode) is not None:
+            colonne.caption(f"Recherche : {durees[mode] * 1000:.0f} ms")
+        afficher_protocole(colonne, resultats, mode, compact=compact)
@@ -0,0 +1,144 @@
+# dilution_audit.py
+# Journal de pharmacovigilance des protocoles générés.
+#
+# Deux fichiers en ajout seul :
+#   <chemin>      enregistrements binaires : en-tête (magie, longueur) + JSON UTF-8
+#   <chemin>.idx  index à enregistrements fixes (date, concentration, dose, mode,
+#                 position et longueur dans le journal)
+# L'écriture coûte un encodage JSON et deux append. La lecture projette l'index
+# en mémoire (np.memmap) : une requête sur une année de protocoles se résout par
+# dichotomie sur la date puis un masque vectoriel, et seuls les enregistrements
+# retenus sont décodés depuis le journal, lui aussi projeté en mémoire (mmap).
+import json
+import mmap
+import os
+import struct
+import threading
+import time
+from datetime import date, datetime
+
+import numpy as np
+
+import dilution_engine as engine
+
+MAGIE = b"DLOG"
+EN_TETE = struct.Struct("<4sI")
+
+DTYPE_INDEX = np.dtype([
+    ("horodatage", "<f8"),
+    ("concentration", "<f8"),
+    ("dose", "<f8"),
+    ("position", "<u8"),
+    ("longueur", "<u4"),
+    ("mode", "u1"),
+])
+
+MODES = {"Continu": 0, "Discontinu": 1}
+
+try:
+    import fcntl
+except ImportError:  # Windows : le verrou de processus suffit pour une instance unique.
+    fcntl = None
+
+_VERROU = threading.Lock()
+
+def _json_defaut(valeur):
+    if hasattr(valeur, "item"):
+        return valeur.item()
+    raise TypeError(f"type non sérialisable : {type(valeur).__name__}")
+
+def _en_secondes(moment):
+    if moment is None or isinstance(moment, (int, float)):
+        return moment
+    if isinstance(moment, datetime):
+        return moment.timestamp()
+    if isinstance(moment, date):
+        return datetime(moment.year, moment.month, moment.day).timestamp()
+    raise TypeError(f"date non reconnue : {moment!r}")
+
+# ---------------------- ÉCRITURE ----------------------
+def enregistrer(chemin, mode, dose_mg, concentration_init, resultats, parametres=None, moteur="index",
+                horodatage=None):
+    """Ajoute un protocole au journal (entrées, étapes choisies, métriques, version du moteur)."""
+    with _VERROU, open(chemin, "ab") as journal, open(chemin + ".idx", "ab") as index:
+        if fcntl is not None:
+            fcntl.flock(journal.fileno(), fcntl.LOCK_EX)
+        try:
+            # Horodatage pris sous verrou : l'index reste trié par date.
+            horodatage = time.time() if horodatage is None else horodatage
+            charge = json.dumps({
+                "horodatage": horodatage,
+                "mode": mode,
+                "dose_mg": dose_mg,
+                "concentration": concentration_init,
+                "parametres": parametres or {},
+                "moteur": moteur,
+                "version": engine.VERSION_MOTEUR,
+                "etapes": resultats,
+            }, ensure_ascii=False, default=_json_defaut).encode("utf-8")
+            position = journal.seek(0, os.SEEK_END)
+            journal.write(EN_TETE.pack(MAGIE, len(charge)) + charge)
+            journal.flush()
+            ligne = np.array([(horodatage, concentration_init, dose_mg, position + EN_TETE.size, len(charge),
+                               MODES.get(mode, 255))], dtype=DTYPE_INDEX)
+            index.write(ligne.tobytes())
+            index.flush()
+        finally:
+            if fcntl is not None:
+                fcntl.flock(journal.fileno(), fcntl.LOCK_UN)
+
+# ---------------------- LECTURE ----------------------
+def ouvrir(chemin):
+    """Projette le journal et son index en mémoire ; à refermer avec fermer()."""
+    lecteur = {"index": np.zeros(0, dtype=DTYPE_INDEX), "fichier": None, "donnees": None}
+    if not os.path.exists(chemin + ".idx"):
+        return lecteur
+    # Une ligne d'index partiellement écrite (écriture concurrente) est ignorée.
+    nb = os.path.getsize(chemin + ".idx") // DTYPE_INDEX.itemsize
+    if nb:
+        lecteur["index"] = np.memmap(chemin + ".idx", dtype=DTYPE_INDEX, mode="r", shape=(nb,))
+        lecteur["fichier"] = open(chemin, "rb")
+        lecteur["donnees"] = mmap.mmap(lecteur["fichier"].fileno(), 0, access=mmap.ACCESS_READ)
+    return lecteur
+
+def fermer(lecteur):
+    if lecteur["donnees"] is not None:
+        lecteur["donnees"].close()
+        lecteur["fichier"].close()
+    lecteur["index"] = np.zeros(0, dtype=DTYPE_INDEX)
+    lecteur["fichier"] = lecteur["donnees"] = None
+
+def rechercher(lecteur, debut=None, fin=None, concentration=None, dose_min=None, dose_max=None, mode=None):
+    """Numéros des protocoles correspondant aux critères (bornes incluses).
+
+    debut / fin : datetime, date ou secondes epoch ; concentration : valeur exacte
+    ou couple (min, max) ; mode : "Continu" ou "Discontinu".
+    """
+    index = lecteur["index"]
+    horodatages = index["horodatage"]
+    lo = 0 if debut is None else int(np.searchsorted(horodatages, _en_secondes(debut), side="left"))
+    hi = len(index) if fin is None else int(np.searchsorted(horodatages, _en_secondes(fin), side="right"))
+    tranche = index[lo:hi]
+
+    masque = np.ones(len(tranche), dtype=bool)
+    if concentration is not None:
+        if isinstance(concentration, tuple):
+            masque &= (tranche["concentration"] >= concentration[0]) & (tranche["concentration"] <= concentration[1])
+        else:
+            masque &= tranche["concentration"] == concentration
+    if dose_min is not None:
+        masque &= tranche["dose"] >= dose_min
+    if dose_max is not None:
+        masque &= tranche["dose"] <= dose_max
+    if mode is not None:
+        masque &= tranche["mode"] == MODES[mode]
+    return np.flatnonzero(masque) + lo
+
+def lire(lecteur, numeros):
+    """Décode les protocoles aux numéros donnés."""
+    index, donnees = lecteur["index"], lecteur["donnees"]
+    protocoles = []
+    for numero in numeros:
+        position, longueur = int(index[numero]["position"]), int(index[numero]["longueur"])
+        protocoles.append(json.loads(donnees[position:position + longueur].decode("utf-8")))
+    return protocoles
@@ -0,0 +1,287 @@
+# dilution_cache.py
+# Cache persistant des protocoles générés, dans un fichier SQLite local.
+#
+# Un redémarrage du serveur Streamlit vide les caches en mémoire (index,
+# sessions) : le cache sur disque garde les protocoles d'une exécution à
+# l'autre. La clé est l'empreinte des entrées normalisées (mode, dose,
+# concentration, volume injecté en continu, moteur, classement, faisceau,
+# règles), de la version du moteur et de l'inventaire des seringues ; un
+# protocole interrompu par le délai de réponse n'est jamais enregistré.
+#
+# Le fichier est en mode WAL : les sessions lisent pendant qu'une autre écrit.
+# Au-delà de taille_max octets de protocoles, les moins récemment servis sont
+# évincés. prechauffer() calcule d'avance les prescriptions les plus fréquentes
+# du journal de pharmacovigilance (dilution_audit).
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import Counter
+
+import dilution_audit
+import dilution_engine as engine
+import dilution_metriques as metriques
+import dilution_regles
+
+TAILLE_MAX = 64 * 1024 * 1024
+
+SCHEMA = """
+BEGIN IMMEDIATE;
+CREATE TABLE IF NOT EXISTS protocoles (
+    cle TEXT PRIMARY KEY,
+    mode TEXT NOT NULL,
+    dose REAL NOT NULL,
+    concentration REAL NOT NULL,
+    resultat TEXT NOT NULL,
+    taille INTEGER NOT NULL,
+    cree REAL NOT NULL,
+    utilise REAL NOT NULL,
+    acces INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS protocoles_utilise ON protocoles (utilise);
+-- Taille totale des protocoles, tenue à jour par déclencheurs : evincer() la lit
+-- sans parcourir la table à chaque écriture.
+CREATE TABLE IF NOT EXISTS totaux (id INTEGER PRIMARY KEY CHECK (id = 0), taille INTEGER NOT NULL);
+CREATE TRIGGER IF NOT EXISTS protocoles_ajout AFTER INSERT ON protocoles
+BEGIN UPDATE totaux SET taille = taille + NEW.taille WHERE id = 0; END;
+CREATE TRIGGER IF NOT EXISTS protocoles_suppression AFTER DELETE ON protocoles
+BEGIN UPDATE totaux SET taille = taille - OLD.taille WHERE id = 0; END;
+CREATE TRIGGER IF NOT EXISTS protocoles_modification AFTER UPDATE OF taille ON protocoles
+BEGIN UPDATE totaux SET taille = taille + NEW.taille - OLD.taille WHERE id = 0; END;
+-- Fichier créé avant le compteur : une seule somme, à la première ouverture.
+INSERT OR IGNORE INTO totaux (id, taille) SELECT 0, COALESCE(SUM(taille), 0) FROM protocoles;
+COMMIT;
+"""
+
+_LOCAL = threading.local()
+_CACHES = {}
+_PRECHAUFFAGES = {}
+
+# ---------------------- CONNEXION ----------------------
+def ouvrir(chemin, taille_max=TAILLE_MAX):
+    """Décrit le cache de chemin (créé au besoin, une fois par processus) ; connexions ouvertes par thread."""
+    cache = _CACHES.get(chemin)
+    if cache is None:
+        cache = {"chemin": chemin, "taille_max": taille_max}
+        _connexion(cache).executescript(SCHEMA)
+        _CACHES[chemin] = cache
+    cache["taille_max"] = taille_max
+    return cache
+
+def _connexion(cache):
+    # Une connexion sqlite3 ne se partage pas entre threads (tâches de dilution_taches).
+    connexions = getattr(_LOCAL, "connexions", None)
+    if connexions is None:
+        connexions = _LOCAL.connexions = {}
+    connexion = connexions.get(cache["chemin"])
+    if connexion is None:
+        connexion = sqlite3.connect(cache["chemin"], timeout=5.0, isolation_level=None)
+        connexion.execute("PRAGMA journal_mode=WAL")
+        connexion.execute("PRAGMA synchronous=NORMAL")
+        connexions[cache["chemin"]] = connexion
+    return connexion
+
+# ---------------------- CLÉ ----------------------
+def empreinte_seringues(syringes=engine.SYRINGES):
+    inventaire = json.dumps(sorted((float(v), float(g)) for v, g in syringes.items()))
+    return hashlib.sha256(inventaire.encode("utf-8")).hexdigest()[:16]
+
+def _regles_normalisees(regles):
+    """Règles telles que compilées (valeurs par défaut explicites, ordre indifférent), ou None."""
+    if not regles:
+        return None
+    normalisees = []
+    for regle in dilution_regles.verifier(regles):
+        regle = dict(regle, etape_min=regle.get("etape_min", 1))
+        if "champ_ref" in regle:
+            regle["facteur"] = float(regle.get("facteur", 1))
+        else:
+            regle["valeur"] = float(regle["valeur"])
+        normalisees.append(regle)
+    return sorted(normalisees, key=lambda regle: json.dumps(regle, sort_keys=True))
+
+def cle(mode, dose_mg, concentration_init, nb_hours=24, debit_mlh=0.1, syringes=engine.SYRINGES, moteur="index",
+        faisceau=1, classement="precision", regles=None):
+    """Empreinte des entrées normalisées : deux prescriptions de même clé ont le même protocole."""
+    entrees = {
+        "mode": mode,
+        "dose": float(dose_mg),
+        "concentration": float(concentration_init),
+        # Seul le volume injecté compte : 24 h à 0.1 mL/h et 12 h à 0.2 mL/h se confondent.
+        "volume_injecte": round(debit_mlh * nb_hours, 2) if mode == "Continu" else None,
+        "moteur": moteur,
+        "faisceau": faisceau,
+        "classement": classement,
+        "regles": _regles_normalisees(regles),
+        "version": engine.VERSION_MOTEUR,
+        "seringues": empreinte_seringues(syringes),
+    }
+    return hashlib.sha256(json.dumps(entrees, sort_keys=True).encode("utf-8")).hexdigest()
+
+# ---------------------- LECTURE ET ÉCRITURE ----------------------
+def _decoder(texte):
+    resultat = json.loads(texte)
+    for step in resultat:
+        if "IC" in step:
+            step["IC"] = tuple(step["IC"])
+    return resultat
+
+def lire(cache, cle_protocole):
+    """Protocole enregistré sous cle_protocole, ou None ; marque l'entrée comme récemment servie."""
+    connexion = _connexion(cache)
+    ligne = connexion.execute("SELECT resultat FROM protocoles WHERE cle = ?", (cle_protocole,)).fetchone()
+    if ligne is None:
+        return None
+    connexion.execute("UPDATE protocoles SET utilise = ?, acces = acces + 1 WHERE cle = ?",
+                      (time.time(), cle_protocole))
+    return _decoder(ligne[0])
+
+def ecrire(cache, cle_protocole, mode, dose_mg, concentration_init, resultat):
+    texte = json.dumps(resultat, ensure_ascii=False, default=dilution_audit._json_defaut)
+    maintenant = time.time()
+    connexion = _connexion(cache)
+    # Pas de INSERT OR REPLACE : le remplacement supprimerait la ligne sans passer par le déclencheur.
+    connexion.execute(
+        "INSERT INTO protocoles (cle, mode, dose, concentration, resultat, taille, cree, utilise) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?) "
+        "ON CONFLICT (cle) DO UPDATE SET mode = excluded.mode, dose = excluded.dose, "
+        "concentration = excluded.concentration, resultat = excluded.resultat, taille = excluded.taille, "
+        "cree = excluded.cree, utilise = excluded.utilise, acces = 0",
+        (cle_protocole, mode, float(dose_mg), float(concentration_init), texte, len(texte.encode("utf-8")),
+         maintenant, maintenant))
+    evincer(cache)
+
+def evincer(cache):
+    """Supprime les protocoles les moins récemment servis tant que la taille dépasse taille_max."""
+    connexion = _connexion(cache)
+    total = connexion.execute("SELECT taille FROM totaux WHERE id = 0").fetchone()[0]
+    if total <= cache["taille_max"]:
+        return 0
+    # On descend à 90 % de la limite pour ne pas évincer à chaque écriture.
+    a_liberer = total - 0.9 * cache["taille_max"]
+    cles = []
+    for cle_protocole, taille in connexion.execute("SELECT cle, taille FROM protocoles ORDER BY utilise"):
+        if a_liberer <= 0:
+            break
+        cles.append((cle_protocole,))
+        a_liberer -= taille
+    connexion.execute("BEGIN IMMEDIATE")
+    try:
+        connexion.executemany("DELETE FROM protocoles WHERE cle = ?", cles)
+        connexion.execute("COMMIT")
+    except BaseException:
+        connexion.execute("ROLLBACK")
+        raise
+    return len(cles)
+
+def statistiques(cache):
+    nombre, taille, acces = _connexion(cache).execute(
+        "SELECT COUNT(*), COALESCE(SUM(taille), 0), COALESCE(SUM(acces), 0) FROM protocoles").fetchone()
+    return {"protocoles": nombre, "octets": taille, "acces": acces, "taille_max": cache["taille_max"]}
+
+# ---------------------- GÉNÉRATION ----------------------
+def _sans_statut(resultat):
+    # Le statut dépend du délai demandé, pas du protocole : il n'est pas enregistré.
+    return [{k: v for k, v in step.items() if k != "statut"} if step.get("type") == "metriques" else step
+            for step in resultat]
+
+def iterer(cache, mode, dose_mg, concentration_init, **options):
+    """iterer_dilution_steps_* servi par le cache ; mêmes options (session, progression, delai...).
+
+    Un protocole absent est calculé étape par étape et enregistré une fois complet.
+    """
+    cle_options = {k: v for k, v in options.items()
+                   if k in ("nb_hours", "debit_mlh", "syringes", "moteur", "faisceau", "classement", "regles")}
+    if mode != "Continu":
+        cle_options.pop("nb_hours", None)
+        cle_options.pop("debit_mlh", None)
+    cle_protocole = cle(mode, dose_mg, concentration_init, **cle_options)
+    resultat = lire(cache, cle_protocole)
+    metriques.observer_cache_disque(resultat is not None)
+    if resultat is not None:
+        if options.get("delai") is not None and resultat:
+            resultat[-1]["statut"] = "optimal"
+        yield from resultat
+        return
+
+    if mode == "Continu":
+        etapes = engine.iterer_dilution_steps_continu(dose_mg, concentration_init, **options)
+    else:
+        etapes = engine.iterer_dilution_steps_discontinu(dose_mg, concentration_init, **options)
+    resultat = []
+    for step in etapes:
+        resultat.append(step)
+        yield step
+    if not resultat or resultat[-1].get("statut") != "meilleur_dans_delai":
+        ecrire(cache, cle_protocole, mode, dose_mg, concentration_init, _sans_statut(resultat))
+
+def generer(cache, mode, dose_mg, concentration_init, **options):
+    """generate_dilution_steps_* servi par le cache (voir iterer)."""
+    return list(iterer(cache, mode, dose_mg, concentration_init, **options))
+
+# ---------------------- PRÉCHAUFFAGE ----------------------
+def prescriptions_frequentes(journal, nombre=100, depuis=None):
+    """[(mode, dose, concentration, paramètres, moteur, occurrences)] les plus demandées dans le journal."""
+    lecteur = dilution_audit.ouvrir(journal)
+    try:
+        numeros = dilution_audit.rechercher(lecteur, debut=depuis)
+        index = lecteur["index"]
+        comptes = Counter()
+        derniers = {}
+        for numero, ligne in zip(numeros, index[numeros].tolist()):
+            # ligne : (horodatage, concentration, dose, position, longueur, mode)
+            triplet = (ligne[5], ligne[2], ligne[1])
+            comptes[triplet] += 1
+            derniers[triplet] = numero
+        frequentes = []
+        for triplet, occurrences in comptes.most_common(nombre):
+            # Paramètres et moteur de la demande la plus récente.
+            protocole = dilution_audit.lire(lecteur, [derniers[triplet]])[0]
+            frequentes.append((protocole["mode"], protocole["dose_mg"], protocole["concentration"],
+                               protocole["parametres"], protocole["moteur"], occurrences))
+        return frequentes
+    finally:
+        dilution_audit.fermer(lecteur)
+
+def prechauffer(cache, journal, nombre=100, depuis=None, regles=None):
+    """Calcule d'avance les prescriptions les plus fréquentes du journal ; renvoie le nombre calculé.
+
+    regles : règles de site des requêtes à servir (moteur « index »), dans la clé comme dans le calcul.
+    """
+    import dilution_parallel
+    connexion = _connexion(cache)
+    requetes, cles = [], []
+    for mode, dose_mg, concentration_init, parametres, moteur, _ in prescriptions_frequentes(journal, nombre, depuis):
+        if concentration_init <= 0 or moteur not in engine.MOTEURS_DISCONTINU:
+            continue
+        if regles:
+            # Les règles de site ne sont appliquées que par le moteur « index ».
+            moteur = "index"
+        options = dict(parametres) if mode == "Continu" else {}
+        options.update(moteur=moteur, regles=regles or None)
+        cle_protocole = cle(mode, dose_mg, concentration_init, **options)
+        if connexion.execute("SELECT 1 FROM protocoles WHERE cle = ?", (cle_protocole,)).fetchone() is not None:
+            continue
+        requetes.append((mode, dose_mg, concentration_init, options))
+        cles.append(cle_protocole)
+    # Prescriptions indépendantes : réparties sur le pool de processus (plusieurs cœurs).
+    for (mode, dose_mg, concentration_init, _), cle_protocole, resultat in zip(
+            requetes, cles, dilution_parallel.generer_protocoles(requetes)):
+        ecrire(cache, cle_protocole, mode, dose_mg, concentration_init, resultat)
+    return len(requetes)
+
+def prechauffer_en_fond(cache, journal, nombre=100, depuis=None, regles=None):
+    """prechauffer() dans un thread, une seule fois par cache et par processus."""
+    if cache["chemin"] in _PRECHAUFFAGES:
+        return _PRECHAUFFAGES[cache["chemin"]]
+
+    def executer():
+        try:
+            prechauffer(cache, journal, nombre, depuis, regles)
+        except (OSError, sqlite3.Error):
+            pass
+    thread = threading.Thread(target=executer, name="prechauffage-cache", daemon=True)
+    _PRECHAUFFAGES[cache["chemin"]] = thread
+    thread.start()
+    return thread
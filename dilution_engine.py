@@ -0,0 +1,1821 @@
+# dilution_engine.py
+# Moteur de recherche des protocoles de dilution, sans dépendance à Streamlit.
+import functools
+import heapq
+import math
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+import dilution_metriques as metriques
+
+# ----------------------------- PARAMÈTRES -----------------------------
+SYRINGES = {
+    2: 0.1,
+    5: 0.2,
+    10: 0.2,
+    20: 1.0,
+    50: 1.0,
+    60: 1.0
+}
+
+VERSION_MOTEUR = "1.0"
+
+ANOVA = 109
+SIGMA_MES = 0.7
+SIGMA_RATIO = 7.9
+
+# ----------------------------- FONCTIONS UTILES -----------------------------
+def arrondir_volume(volume, graduation):
+    return round(round(volume / graduation) * graduation, 2)
+
+def est_mesurable(volume, graduation):
+    return abs(volume - arrondir_volume(volume, graduation)) <= 0.01
+
+def calculer_moyenne_precision(dose, nb_mes, ratio_ser):
+    return (dose / 100) * (ANOVA + nb_mes * SIGMA_MES + (ratio_ser / 100) * SIGMA_RATIO)
+
+def calculer_ecart_type(dose, nb_mes, ratio_ser):
+    numerateur = abs((-26.15 * math.log(ratio_ser)) + 95 + 2 * nb_mes) * (dose / 100)
+    return numerateur / (1.96 * 2)
+
+def calculer_IC(moyenne, et):
+    borne_inf = moyenne - 1.96 * et
+    borne_sup = moyenne + 1.96 * et
+    return (round(borne_inf, 2), round(borne_sup, 2))
+
+# ----------------------------- INDEX DES FACTEURS -----------------------------
+# Pour une seringue, la dose obtenue vaut concentration × (prélevé / total) × injecté.
+# Le facteur (prélevé / total) × injecté ne dépend pas de la concentration : on le
+# calcule une seule fois, trié, avec des pointeurs vers les volumes correspondants.
+# Une étape se réduit alors à une recherche dichotomique suivie d'un balayage
+# d'un petit voisinage, réévalué avec les arrondis exacts de la boucle d'origine.
+
+_INDEX_CACHE = {}
+
+def _construire_index_seringue(syringe_volume, graduation):
+    prelevés, ajoutés, totaux, ratios, ratio_continu_ok = [], [], [], [], []
+
+    vol_prelevables = np.arange(graduation, syringe_volume + 0.01, graduation)
+    for volume_prelevé in vol_prelevables:
+        if volume_prelevé < 2 * graduation:
+            continue
+        if not est_mesurable(volume_prelevé, graduation):
+            continue
+        if (volume_prelevé / syringe_volume) * 100 < 30:
+            continue
+
+        max_ajout = syringe_volume - volume_prelevé
+        for vol_ajouté in np.arange(0, max_ajout + 0.01, graduation):
+            volume_total = round(volume_prelevé + vol_ajouté, 2)
+            if volume_total > syringe_volume:
+                continue
+            if not est_mesurable(volume_total, graduation):
+                continue
+            # Le mode discontinu compare le ratio arrondi, le mode continu le ratio brut.
+            ratio = round((volume_total / syringe_volume) * 100, 2)
+            if ratio < 30:
+                continue
+
+            prelevés.append(volume_prelevé)
+            ajoutés.append(vol_ajouté)
+            totaux.append(volume_total)
+            ratios.append(ratio)
+            ratio_continu_ok.append((volume_total / syringe_volume) * 100 >= 30)
+
+    injectés = []
+    for volume_injecte in np.arange(graduation, syringe_volume + 0.01, graduation):
+        volume_injecte = arrondir_volume(volume_injecte, graduation)
+        if volume_injecte > syringe_volume:
+            continue
+        injectés.append(volume_injecte)
+
+    prelevés = np.array(prelevés, dtype=float)
+    totaux = np.array(totaux, dtype=float)
+    quotients = prelevés / totaux
+    injectés_arr = np.array(injectés, dtype=float)
+
+    # Facteurs du mode discontinu : couple (prélevé, ajouté) × volume injecté,
+    # le pointeur k = couple * nb_injectés + injecté reproduit l'ordre des boucles.
+    facteurs = np.outer(quotients, injectés_arr).ravel()
+    pointeurs = np.argsort(facteurs, kind="stable")
+
+    continu_ok = np.array(ratio_continu_ok, dtype=bool)
+    couples_continu = np.flatnonzero(continu_ok)
+    ordre_continu = couples_continu[np.argsort(quotients[couples_continu], kind="stable")]
+
+    return {
+        "seringue": syringe_volume,
+        "graduation": graduation,
+        "volume prélevé": prelevés,
+        "volume ajouté": np.array(ajoutés, dtype=float),
+        "volume total": totaux,
+        "ratio": np.array(ratios, dtype=float),
+        "quotients": quotients,
+        "injectés": injectés,
+        "injectés_arr": injectés_arr,
+        "facteurs": facteurs[pointeurs],
+        "pointeurs": pointeurs,
+        "quotients_continu": quotients[ordre_continu],
+        "pointeurs_continu": ordre_continu,
+    }
+
+def construire_index(syringes=SYRINGES):
+    """Construit (une seule fois par inventaire) l'index trié des facteurs de dilution."""
+    cle = tuple(syringes.items())
+    index = _INDEX_CACHE.get(cle)
+    if index is None:
+        index = [_construire_index_seringue(s, g) for s, g in syringes.items()]
+        _INDEX_CACHE[cle] = index
+    return index
+
+# Tableaux d'une entrée d'index (les autres champs s'en déduisent).
+CHAMPS_INDEX = (
+    "volume prélevé", "volume ajouté", "volume total", "ratio", "quotients",
+    "injectés_arr", "facteurs", "pointeurs", "quotients_continu", "pointeurs_continu",
+)
+
+# Version de la disposition des tableaux dans le fichier précompilé.
+FORMAT_INDEX = 2
+
+# Champs enregistrés : les facteurs triés se recalculent (produit des quotients et
+# des volumes injectés, réordonné par les pointeurs) plus vite qu'ils ne se lisent.
+CHAMPS_ENREGISTRES = tuple(nom for nom in CHAMPS_INDEX if nom != "facteurs")
+
+def sauvegarder_index(chemin, syringes=SYRINGES):
+    """Écrit l'index précompilé de syringes dans un fichier .npy.
+
+    Tableaux .npy à la suite dans un seul fichier : format, version, inventaire,
+    tailles (seringue × champ) puis un tableau par champ, seringues bout à bout.
+    Le chargement compte au démarrage de dosage.py : pas d'archive .npz, dont la
+    lecture importe zipfile et coûte une entrée par tableau.
+    """
+    index = construire_index(syringes)
+    tableaux = [
+        np.array(FORMAT_INDEX),
+        np.array(VERSION_MOTEUR),
+        np.array(list(syringes.items()), dtype=float),
+        np.array([[len(entree[nom]) for nom in CHAMPS_ENREGISTRES] for entree in index], dtype=np.int64),
+    ]
+    for nom in CHAMPS_ENREGISTRES:
+        valeurs = np.concatenate([entree[nom] for entree in index])
+        # Pointeurs sur 32 bits dans le fichier (moins de 2**31 candidats par seringue).
+        tableaux.append(valeurs.astype(np.int32) if nom.startswith("pointeurs") else valeurs)
+    with open(chemin, "wb") as fichier:
+        for tableau in tableaux:
+            np.save(fichier, tableau)
+
+def charger_index(chemin, syringes=SYRINGES):
+    """Charge un index précompilé s'il correspond à syringes, au format et à la version du moteur ; None sinon."""
+    cle = tuple(syringes.items())
+    if cle in _INDEX_CACHE:
+        return _INDEX_CACHE[cle]
+    try:
+        with open(chemin, "rb") as fichier:
+            # Fichier d'une autre version du moteur ou d'un autre format (archive .npz antérieure) : à reconstruire.
+            format_fichier = np.load(fichier, allow_pickle=False)
+            if not isinstance(format_fichier, np.ndarray) or format_fichier.shape or int(format_fichier) != FORMAT_INDEX:
+                return None
+            if str(np.load(fichier, allow_pickle=False)) != VERSION_MOTEUR:
+                return None
+            inventaire = [tuple(ligne) for ligne in np.load(fichier, allow_pickle=False).tolist()]
+            if inventaire != [(float(s), float(g)) for s, g in cle]:
+                return None
+            tailles = np.load(fichier, allow_pickle=False)
+            index = [{"seringue": syringe_volume, "graduation": graduation} for syringe_volume, graduation in cle]
+            for j, nom in enumerate(CHAMPS_ENREGISTRES):
+                valeurs = np.load(fichier, allow_pickle=False)
+                if nom.startswith("pointeurs"):
+                    valeurs = valeurs.astype(np.intp)
+                for entree, morceau in zip(index, np.split(valeurs, np.cumsum(tailles[:-1, j]))):
+                    entree[nom] = morceau
+    except (OSError, ValueError, EOFError):
+        return None
+    for entree in index:
+        entree["facteurs"] = np.outer(entree["quotients"], entree["injectés_arr"]).ravel()[entree["pointeurs"]]
+        entree["injectés"] = entree["injectés_arr"].tolist()
+    _INDEX_CACHE[cle] = index
+    return index
+
+def _fenetre(valeurs_triees, centre, demi_largeur, echelle):
+    """Bornes [lo, hi) des valeurs v telles que |v × echelle - centre| <= demi_largeur."""
+    if echelle <= 0 or not math.isfinite(demi_largeur):
+        return 0, len(valeurs_triees)
+    lo = np.searchsorted(valeurs_triees, (centre - demi_largeur) / echelle, side="left")
+    hi = np.searchsorted(valeurs_triees, (centre + demi_largeur) / echelle, side="right")
+    return int(lo), int(hi)
+
+def _marge_arrondi(volume_max):
+    # round(C × q, 2) × injecté puis round(..., 2) s'écarte de C × q × injecté
+    # d'au plus 0.005 × injecté + 0.005 ; on garde une marge confortable.
+    return 0.01 * (volume_max + 1)
+
+# ---------------------- SÉLECTION PAR INDEX ----------------------
+# Chaque seringue est traitée indépendamment (borne locale puis meilleur local) ;
+# la fusion des meilleurs locaux par min() reproduit le tri stable d'origine :
+# (écart à la cible, moyenne_precision, ordre de la seringue, ordre des boucles).
+# Avec une échéance (recherche à délai borné), les seringues sont parcourues de la
+# plus prometteuse à la moins prometteuse et le meilleur choix trouvé est gardé
+# lorsque le délai expire. Avec des règles de site (dilution_regles), l'index est
+# restreint aux candidats qu'elles admettent.
+
+def _evaluer_discontinu(entree, pointeurs, current_concentration, dose_mg, nb_mes, etats=None):
+    """(erreurs, moyennes, pointeurs) des candidats valides parmi pointeurs.
+
+    Pour plusieurs recherches à la fois (_meilleurs_lot), current_concentration et
+    nb_mes sont donnés par candidat et etats (recherche de chaque candidat) est
+    filtré et renvoyé en quatrième position.
+    """
+    nb_inj = len(entree["injectés"])
+    couples, injections = np.divmod(pointeurs, nb_inj)
+    concentrations = np.round(current_concentration * entree["quotients"][couples], 2)
+    doses = np.round(concentrations * entree["injectés_arr"][injections], 2)
+    valides = doses <= dose_mg + 1.5
+    pointeurs = pointeurs[valides]
+    doses = doses[valides]
+    ratios = entree["ratio"][couples[valides]]
+    if etats is not None:
+        nb_mes = nb_mes[valides]
+    erreurs = np.abs(doses - dose_mg)
+    moyennes = (doses / 100) * (ANOVA + nb_mes * SIGMA_MES + (ratios / 100) * SIGMA_RATIO)
+    if etats is not None:
+        return erreurs, moyennes, pointeurs, etats[valides]
+    return erreurs, moyennes, pointeurs
+
+def _borne_discontinu(entree, dose_mg, current_concentration, nb_mes):
+    """Erreur des voisins immédiats de la cible : borne supérieure de l'erreur optimale."""
+    if current_concentration <= 0:
+        return math.inf
+    pos = int(np.searchsorted(entree["facteurs"], dose_mg / current_concentration))
+    voisins = entree["pointeurs"][max(pos - 1, 0):pos + 1]
+    erreurs, _, _ = _evaluer_discontinu(entree, voisins, current_concentration, dose_mg, nb_mes)
+    return float(erreurs.min()) if len(erreurs) else math.inf
+
+def _meilleur_discontinu_seringue(entree, ordre_seringue, dose_mg, current_concentration, nb_mes, borne):
+    """(clé de tri du meilleur candidat de la seringue ou None, nombre de candidats évalués)."""
+    marge = _marge_arrondi(entree["injectés"][-1] if entree["injectés"] else 0)
+    lo, _ = _fenetre(entree["facteurs"], dose_mg, borne + marge, current_concentration)
+    _, hi = _fenetre(entree["facteurs"], dose_mg, min(borne, 1.5) + marge, current_concentration)
+    if lo >= hi:
+        return None, 0
+    erreurs, moyennes, pointeurs = _evaluer_discontinu(
+        entree, entree["pointeurs"][lo:hi], current_concentration, dose_mg, nb_mes)
+    if not len(erreurs):
+        return None, hi - lo
+    i = np.lexsort((pointeurs, moyennes, erreurs))[0]
+    return (float(erreurs[i]), float(moyennes[i]), ordre_seringue, int(pointeurs[i])), hi - lo
+
+def _option_discontinu(entree, k, current_concentration, nb_mes):
+    couple, injection = divmod(k, len(entree["injectés"]))
+    volume_prelevé = entree["volume prélevé"][couple]
+    volume_total = entree["volume total"][couple]
+    ratio = entree["ratio"][couple]
+    volume_injecte = entree["injectés"][injection]
+
+    new_concentration = round(current_concentration * (volume_prelevé / volume_total), 2)
+    dose = round(new_concentration * volume_injecte, 2)
+    moyenne_precision = calculer_moyenne_precision(dose, nb_mes, ratio)
+    ecart_type = calculer_ecart_type(dose, nb_mes, ratio)
+    ic_inf, ic_sup = calculer_IC(moyenne_precision, ecart_type)
+
+    return {
+        "étape": nb_mes,
+        "seringue": entree["seringue"],
+        "volume prélevé": volume_prelevé,
+        "volume ajouté": round(entree["volume ajouté"][couple], 2),
+        "volume total": volume_total,
+        "ratio": ratio,
+        "concentration finale": new_concentration,
+        "dose obtenue": dose,
+        "volume injecté": volume_injecte,
+        "moyenne_precision": moyenne_precision,
+        "ecart_type": ecart_type,
+        "IC": (ic_inf, ic_sup)
+    }
+
+def _ordre_seringues(bornes, echeance):
+    """Ordre de parcours des seringues : celles dont les graduations approchent le mieux la cible d'abord
+    si une échéance est fixée, sinon l'ordre de l'inventaire."""
+    if echeance is None:
+        return range(len(bornes))
+    return sorted(range(len(bornes)), key=bornes.__getitem__)
+
+def _echeance_atteinte(echeance, cles):
+    # Une option valide au moins est gardée avant d'interrompre.
+    if echeance is None or not cles or time.perf_counter() < echeance["fin"]:
+        return False
+    echeance["interrompu"] = True
+    return True
+
+def _index_regles(syringes, regles, mode, etape, volume_injecte=None):
+    if regles is None:
+        return construire_index(syringes)
+    import dilution_regles
+    return dilution_regles.index_restreint(regles, syringes, mode, etape, volume_injecte)
+
+def _choisir_discontinu(syringes, dose_mg, current_concentration, nb_mes, suivi=None, echeance=None, regles=None):
+    index = _index_regles(syringes, regles, "Discontinu", nb_mes)
+    bornes = [_borne_discontinu(entree, dose_mg, current_concentration, nb_mes) for entree in index]
+    borne = min(bornes, default=math.inf)
+    cles = []
+    for ordre_seringue in _ordre_seringues(bornes, echeance):
+        entree = index[ordre_seringue]
+        cle, nb = _meilleur_discontinu_seringue(entree, ordre_seringue, dose_mg, current_concentration, nb_mes,
+                                                borne)
+        if suivi is not None:
+            suivi(ordre_seringue, entree["seringue"], nb)
+        if cle is not None:
+            cles.append(cle)
+        if _echeance_atteinte(echeance, cles):
+            break
+
+    if not cles:
+        return None
+
+    _, _, ordre_seringue, k = min(cles)
+    return _option_discontinu(index[ordre_seringue], k, current_concentration, nb_mes)
+
+def _evaluer_continu(entree, couples, current_concentration, dose_mg, etape, volume_injecte, volume_max_prelevé,
+                     etats=None):
+    """(erreurs, moyennes, couples) des candidats valides ; etats : voir _evaluer_discontinu
+    (current_concentration et volume_max_prelevé alors donnés par candidat)."""
+    valides = np.ones(len(couples), dtype=bool)
+    if volume_max_prelevé is not None:
+        valides &= entree["volume prélevé"][couples] <= volume_max_prelevé
+    if etape >= 1:
+        valides &= entree["volume total"][couples] >= volume_injecte
+        if entree["seringue"] < 5:
+            valides[:] = False
+    couples = couples[valides]
+    if etats is not None:
+        current_concentration = current_concentration[valides]
+    concentrations = np.round(current_concentration * entree["quotients"][couples], 2)
+    doses = np.round(concentrations * volume_injecte, 2)
+    ratios = entree["ratio"][couples]
+    erreurs = np.abs(doses - dose_mg)
+    moyennes = (doses / 100) * (ANOVA + (etape + 1) * SIGMA_MES + (ratios / 100) * SIGMA_RATIO)
+    if etats is not None:
+        return erreurs, moyennes, couples, etats[valides]
+    return erreurs, moyennes, couples
+
+def _borne_continu(entree, dose_mg, current_concentration, etape, volume_injecte, volume_max_prelevé):
+    echelle = current_concentration * volume_injecte
+    if echelle <= 0:
+        return math.inf
+    pos = int(np.searchsorted(entree["quotients_continu"], dose_mg / echelle))
+    voisins = entree["pointeurs_continu"][max(pos - 1, 0):pos + 1]
+    erreurs, _, _ = _evaluer_continu(entree, voisins, current_concentration, dose_mg, etape,
+                                     volume_injecte, volume_max_prelevé)
+    return float(erreurs.min()) if len(erreurs) else math.inf
+
+def _meilleur_continu_seringue(entree, ordre_seringue, dose_mg, current_concentration, etape, volume_injecte,
+                               volume_max_prelevé, borne):
+    echelle = current_concentration * volume_injecte
+    lo, hi = _fenetre(entree["quotients_continu"], dose_mg, borne + _marge_arrondi(volume_injecte), echelle)
+    if lo >= hi:
+        return None, 0
+    erreurs, moyennes, couples = _evaluer_continu(
+        entree, entree["pointeurs_continu"][lo:hi], current_concentration, dose_mg, etape,
+        volume_injecte, volume_max_prelevé)
+    if not len(erreurs):
+        return None, hi - lo
+    i = np.lexsort((couples, moyennes, erreurs))[0]
+    return (float(erreurs[i]), float(moyennes[i]), ordre_seringue, int(couples[i])), hi - lo
+
+def _option_continu(entree, couple, current_concentration, etape, volume_injecte):
+    volume_prelevé = entree["volume prélevé"][couple]
+    volume_total = entree["volume total"][couple]
+    ratio_ser = entree["ratio"][couple]
+
+    new_concentration = round(current_concentration * (volume_prelevé / volume_total), 2)
+    dose = round(new_concentration * volume_injecte, 2)
+    moyenne_precision = calculer_moyenne_precision(dose, etape + 1, ratio_ser)
+    ecart_type = calculer_ecart_type(dose, etape + 1, ratio_ser)
+    ic_inf, ic_sup = calculer_IC(moyenne_precision, ecart_type)
+
+    return {
+        "étape": etape + 1,
+        "seringue": entree["seringue"],
+        "volume prélevé": volume_prelevé,
+        "volume ajouté": round(entree["volume ajouté"][couple], 2),
+        "volume total": volume_total,
+        "ratio": ratio_ser,
+        "concentration": new_concentration,
+        "dose": dose,
+        "moyenne_precision": moyenne_precision,
+        "ecart_type": ecart_type,
+        "IC": (ic_inf, ic_sup)
+    }
+
+def _choisir_continu(syringes, dose_mg, current_concentration, etape, volume_injecte, volume_max_prelevé,
+                     suivi=None, echeance=None, regles=None):
+    index = _index_regles(syringes, regles, "Continu", etape + 1, volume_injecte)
+    contexte = (dose_mg, current_concentration, etape, volume_injecte, volume_max_prelevé)
+    bornes = [_borne_continu(entree, *contexte) for entree in index]
+    borne = min(bornes, default=math.inf)
+    cles = []
+    for ordre_seringue in _ordre_seringues(bornes, echeance):
+        entree = index[ordre_seringue]
+        cle, nb = _meilleur_continu_seringue(entree, ordre_seringue, *contexte, borne)
+        if suivi is not None:
+            suivi(ordre_seringue, entree["seringue"], nb)
+        if cle is not None:
+            cles.append(cle)
+        if _echeance_atteinte(echeance, cles):
+            break
+
+    if not cles:
+        return None
+
+    _, _, ordre_seringue, couple = min(cles)
+    return _option_continu(index[ordre_seringue], couple, current_concentration, etape, volume_injecte)
+
+# ---------------------- PIPELINE EN FLUX ----------------------
+# Variante sans index ni liste intermédiaire : chaque étage est un générateur
+# (seringue → prélevé → ajouté → injecté → filtre → score) et seule la sélection
+# courante (meilleur ou top-k) est conservée. La mémoire par étape reste constante
+# quelle que soit la taille de la seringue ou sa graduation.
+
+def graduations(debut, fin, pas):
+    """Équivalent paresseux de np.arange(debut, fin, pas), valeur pour valeur."""
+    nb = max(int(math.ceil((fin - debut) / pas)), 0)
+    delta = (debut + pas) - debut
+    for i in range(nb):
+        yield np.float64(debut + i * delta)
+
+def _flux_prelevés(syringes):
+    for syringe_volume, graduation in syringes.items():
+        for volume_prelevé in graduations(graduation, syringe_volume + 0.01, graduation):
+            if volume_prelevé < 2 * graduation:
+                continue
+            if not est_mesurable(volume_prelevé, graduation):
+                continue
+            if (volume_prelevé / syringe_volume) * 100 < 30:
+                continue
+            yield syringe_volume, graduation, volume_prelevé
+
+def _flux_ajoutés(prelevés):
+    for syringe_volume, graduation, volume_prelevé in prelevés:
+        max_ajout = syringe_volume - volume_prelevé
+        for vol_ajouté in graduations(0, max_ajout + 0.01, graduation):
+            volume_total = round(volume_prelevé + vol_ajouté, 2)
+            if volume_total > syringe_volume:
+                continue
+            if not est_mesurable(volume_total, graduation):
+                continue
+            yield syringe_volume, graduation, volume_prelevé, vol_ajouté, volume_total
+
+def _flux_injectés(couples):
+    for syringe_volume, graduation, volume_prelevé, vol_ajouté, volume_total in couples:
+        for volume_injecte in graduations(graduation, syringe_volume + 0.01, graduation):
+            volume_injecte = arrondir_volume(volume_injecte, graduation)
+            if volume_injecte > syringe_volume:
+                continue
+            yield syringe_volume, volume_prelevé, vol_ajouté, volume_total, volume_injecte
+
+def iterer_options_discontinu(dose_mg, current_concentration, nb_mes, syringes=SYRINGES):
+    """Génère, sans les stocker, les options admissibles d'une étape du mode discontinu."""
+    couples = (
+        c for c in _flux_ajoutés(_flux_prelevés(syringes))
+        if round((c[4] / c[0]) * 100, 2) >= 30
+    )
+    for syringe_volume, volume_prelevé, vol_ajouté, volume_total, volume_injecte in _flux_injectés(couples):
+        ratio = round((volume_total / syringe_volume) * 100, 2)
+        new_concentration = round(current_concentration * (volume_prelevé / volume_total), 2)
+        dose = round(new_concentration * volume_injecte, 2)
+        if dose > dose_mg + 1.5:
+            continue
+
+        moyenne_precision = calculer_moyenne_precision(dose, nb_mes, ratio)
+        ecart_type = calculer_ecart_type(dose, nb_mes, ratio)
+        ic_inf, ic_sup = calculer_IC(moyenne_precision, ecart_type)
+
+        yield {
+            "étape": nb_mes,
+            "seringue": syringe_volume,
+            "volume prélevé": volume_prelevé,
+            "volume ajouté": round(vol_ajouté, 2),
+            "volume total": volume_total,
+            "ratio": ratio,
+            "concentration finale": new_concentration,
+            "dose obtenue": dose,
+            "volume injecté": volume_injecte,
+            "moyenne_precision": moyenne_precision,
+            "ecart_type": ecart_type,
+            "IC": (ic_inf, ic_sup)
+        }
+
+def iterer_options_continu(dose_mg, current_concentration, etape, volume_injecte, volume_max_prelevé=None,
+                           syringes=SYRINGES):
+    """Génère, sans les stocker, les options admissibles d'une étape du mode continu."""
+    for syringe_volume, graduation, volume_prelevé, vol_ajouté, volume_total in _flux_ajoutés(_flux_prelevés(syringes)):
+        if volume_max_prelevé is not None and volume_prelevé > volume_max_prelevé:
+            continue
+        if (volume_total / syringe_volume) * 100 < 30:
+            continue
+        if etape >= 1 and volume_total < volume_injecte:
+            continue
+        if etape >= 1 and syringe_volume < 5:
+            continue
+
+        new_concentration = round(current_concentration * (volume_prelevé / volume_total), 2)
+        dose = round(new_concentration * volume_injecte, 2)
+        ratio_ser = round((volume_total / syringe_volume) * 100, 2)
+        moyenne_precision = calculer_moyenne_precision(dose, etape + 1, ratio_ser)
+        ecart_type = calculer_ecart_type(dose, etape + 1, ratio_ser)
+        ic_inf, ic_sup = calculer_IC(moyenne_precision, ecart_type)
+
+        yield {
+            "étape": etape + 1,
+            "seringue": syringe_volume,
+            "volume prélevé": volume_prelevé,
+            "volume ajouté": round(vol_ajouté, 2),
+            "volume total": volume_total,
+            "ratio": ratio_ser,
+            "concentration": new_concentration,
+            "dose": dose,
+            "moyenne_precision": moyenne_precision,
+            "ecart_type": ecart_type,
+            "IC": (ic_inf, ic_sup)
+        }
+
+def selectionner(options, cle, k=1):
+    """Les k meilleures options selon cle, dans l'ordre d'un tri stable, en mémoire O(k)."""
+    if k == 1:
+        meilleure = min(options, key=cle, default=None)
+        return [] if meilleure is None else [meilleure]
+    return heapq.nsmallest(k, options, key=cle)
+
+def _compter(options, syringes, suivi):
+    """Relaie les options en signalant à suivi le nombre évalué pour chaque seringue."""
+    if suivi is None:
+        yield from options
+        return
+    ordres = {syringe_volume: i for i, syringe_volume in enumerate(syringes)}
+    courante, nb = None, 0
+    for option in options:
+        if option["seringue"] != courante:
+            if courante is not None:
+                suivi(ordres[courante], courante, nb)
+            courante, nb = option["seringue"], 0
+        nb += 1
+        yield option
+    if courante is not None:
+        suivi(ordres[courante], courante, nb)
+
+def _choisir_flux_discontinu(syringes, dose_mg, current_concentration, nb_mes, suivi=None):
+    options = _compter(iterer_options_discontinu(dose_mg, current_concentration, nb_mes, syringes), syringes, suivi)
+    meilleures = selectionner(options, lambda x: (abs(x['dose obtenue'] - dose_mg), x['moyenne_precision']))
+    return meilleures[0] if meilleures else None
+
+def _choisir_flux_continu(syringes, dose_mg, current_concentration, etape, volume_injecte, volume_max_prelevé,
+                          suivi=None):
+    options = _compter(iterer_options_continu(dose_mg, current_concentration, etape, volume_injecte,
+                                              volume_max_prelevé, syringes), syringes, suivi)
+    meilleures = selectionner(options, lambda x: (abs(x['dose'] - dose_mg), x['moyenne_precision']))
+    return meilleures[0] if meilleures else None
+
+def _choisir_parallele_discontinu(*args, **kwargs):
+    import dilution_parallel
+    return dilution_parallel.choisir_discontinu(*args, **kwargs)
+
+def _choisir_parallele_continu(*args, **kwargs):
+    import dilution_parallel
+    return dilution_parallel.choisir_continu(*args, **kwargs)
+
+def _choisir_numba_discontinu(*args, **kwargs):
+    import dilution_numba
+    return dilution_numba.choisir_discontinu(*args, **kwargs)
+
+def _choisir_numba_continu(*args, **kwargs):
+    import dilution_numba
+    return dilution_numba.choisir_continu(*args, **kwargs)
+
+MOTEURS_DISCONTINU = {
+    "index": _choisir_discontinu,
+    "flux": _choisir_flux_discontinu,
+    "parallele": _choisir_parallele_discontinu,
+    "numba": _choisir_numba_discontinu,
+}
+
+MOTEURS_CONTINU = {
+    "index": _choisir_continu,
+    "flux": _choisir_flux_continu,
+    "parallele": _choisir_parallele_continu,
+    "numba": _choisir_numba_continu,
+}
+
+# ---------------------- RECALCUL INCRÉMENTAL (SESSION) ----------------------
+# Pour une concentration et une étape données, les doses atteignables et leur
+# moyenne_precision ne dépendent pas de la dose cible. La session garde ces
+# tables, triées par (dose, moyenne_precision, ordre des boucles), pour les
+# requêtes précédentes. Une dose modifiée ne fait que reclasser : seuls le
+# plafond dose_mg + 1.5 et la fenêtre cible sont réévalués, par dichotomie.
+
+def nouvelle_session(taille_max=12):
+    """État de recalcul incrémental d'une session (à garder dans st.session_state)."""
+    return {"tables": OrderedDict(), "taille_max": taille_max, "succes": 0, "echecs": 0}
+
+def _table_session(session, cle, construire):
+    tables = session["tables"]
+    table = tables.get(cle)
+    if table is None:
+        session["echecs"] += 1
+        table = construire()
+        tables[cle] = table
+        while len(tables) > session["taille_max"]:
+            tables.popitem(last=False)
+    else:
+        session["succes"] += 1
+        tables.move_to_end(cle)
+    return table
+
+def _grouper(*colonnes):
+    """Classes des lignes identiques de colonnes : (indices d'un représentant par classe, classe de chaque ligne).
+
+    Comme np.unique(..., axis=0), classes dans l'ordre lexicographique, en plus rapide.
+    """
+    ordre = np.lexsort(colonnes[::-1])
+    nouvelles = np.zeros(len(ordre), dtype=bool)
+    nouvelles[:1] = True
+    for colonne in colonnes:
+        nouvelles[1:] |= np.diff(colonne[ordre]) != 0
+    appartenance = np.empty(len(ordre), dtype=np.intp)
+    appartenance[ordre] = np.cumsum(nouvelles) - 1
+    return ordre[nouvelles], appartenance
+
+def _assembler_table(seringues, equivalences):
+    """Table de session à partir, pour chaque seringue, de (classes, doses, membres, termes).
+
+    Une classe regroupe les couples (prélevé, ajouté) de même concentration
+    obtenue (et, en continu, de même volume total) : ses doses ne dépendent que
+    de cette concentration et ne sont calculées qu'une fois par volume injecté.
+    Seuls les membres des classes en tête sont ensuite développés, pour le terme
+    de précision qui dépend du ratio de chacun.
+    """
+    doses, classes, injections, fins, membres, termes = [], [], [], [], [], []
+    nb_classes = nb_membres = 0
+    for appartenance, doses_classes, base, terme in seringues:
+        ordre = np.argsort(appartenance, kind="stable")
+        fins.append(nb_membres + np.cumsum(np.bincount(appartenance, minlength=len(doses_classes))))
+        nb_membres += len(appartenance)
+        membres.append(base[ordre])
+        termes.append(terme[ordre])
+        n, nb_inj = doses_classes.shape
+        doses.append(doses_classes.ravel())
+        classes.append(np.repeat(np.arange(n) + nb_classes, nb_inj))
+        injections.append(np.tile(np.arange(nb_inj), n))
+        nb_classes += n
+    # L'ordre entre doses égales est indifférent : elles sont toujours développées ensemble.
+    doses = np.concatenate(doses)
+    ordre = np.argsort(doses)
+    return {
+        "doses": doses[ordre],
+        "classes": np.concatenate(classes)[ordre],
+        "injections": np.concatenate(injections)[ordre],
+        "debuts": np.concatenate([np.zeros(1, dtype=np.intp)] + fins),
+        "membres": np.concatenate(membres),
+        "termes": np.concatenate(termes),
+        "equivalences": np.concatenate(equivalences),
+    }
+
+def _table_discontinu(index, current_concentration, nb_mes):
+    seringues, equivalences = [], []
+    decalage = 0
+    for entree in index:
+        nb_inj = len(entree["injectés"])
+        concentrations = np.round(current_concentration * entree["quotients"], 2)
+        uniques, appartenance = np.unique(concentrations, return_inverse=True)
+        doses = np.round(uniques[:, None] * entree["injectés_arr"][None, :], 2)
+        termes = ANOVA + nb_mes * SIGMA_MES + (entree["ratio"] / 100) * SIGMA_RATIO
+        base = decalage + np.arange(len(concentrations)) * nb_inj
+        seringues.append((appartenance, doses, base, termes))
+        equivalences.append(np.column_stack((uniques, np.zeros(len(uniques)))))
+        decalage += len(concentrations) * nb_inj
+    return _assembler_table(seringues, equivalences)
+
+def _table_continu(index, current_concentration, etape, volume_injecte, volume_max_prelevé):
+    ids, quotients, totaux, ratios = [], [], [], []
+    decalage = 0
+    for entree in index:
+        nb_couples = len(entree["quotients"])
+        valides = np.zeros(nb_couples, dtype=bool)
+        valides[entree["pointeurs_continu"]] = True
+        if volume_max_prelevé is not None:
+            valides &= entree["volume prélevé"] <= volume_max_prelevé
+        if etape >= 1:
+            valides &= entree["volume total"] >= volume_injecte
+            if entree["seringue"] < 5:
+                valides[:] = False
+        couples = np.flatnonzero(valides)
+        ids.append(couples + decalage)
+        quotients.append(entree["quotients"][couples])
+        totaux.append(entree["volume total"][couples])
+        ratios.append(entree["ratio"][couples])
+        decalage += nb_couples
+
+    # Le volume injecté est le même pour toutes les seringues : les classes
+    # peuvent réunir des couples de seringues différentes. L'état suivant dépend
+    # aussi du volume total (plafond du prélèvement).
+    concentrations = np.round(current_concentration * np.concatenate(quotients), 2)
+    totaux = np.concatenate(totaux)
+    representants, appartenance = _grouper(concentrations, totaux)
+    uniques = np.column_stack((concentrations[representants], totaux[representants]))
+    doses = np.round(uniques[:, :1] * volume_injecte, 2)
+    termes = ANOVA + (etape + 1) * SIGMA_MES + (np.concatenate(ratios) / 100) * SIGMA_RATIO
+    return _assembler_table([(appartenance, doses, np.concatenate(ids), termes)], [uniques])
+
+def _developper(table, entrees, dose_mg):
+    """(écarts, moyennes, identifiants, rang de l'entrée) de chaque membre des entrées données."""
+    classes = table["classes"][entrees]
+    debuts = table["debuts"][classes]
+    longueurs = table["debuts"][classes + 1] - debuts
+    rangs = np.repeat(np.arange(len(entrees)), longueurs)
+    positions = np.arange(longueurs.sum()) - np.repeat(np.cumsum(longueurs) - longueurs, longueurs) + debuts[rangs]
+    doses = table["doses"][entrees][rangs]
+    ids = table["membres"][positions] + table["injections"][entrees][rangs]
+    moyennes = (doses / 100) * table["termes"][positions]
+    return np.abs(doses - dose_mg), moyennes, ids, rangs
+
+# Règles de classement des candidats d'une table : l'énumération (la table) est
+# commune, seule la règle change. Chaque règle reçoit, pour les membres des doses
+# voisines de la cible, les écarts signés dose - cible, les moyenne_precision et
+# les identifiants (ordre des boucles), et renvoie les clés de np.lexsort (la
+# dernière est la principale). Le meilleur candidat de chacune de ces règles se
+# trouve toujours parmi les deux doses voisines de la cible.
+def _classement_precision(ecarts, moyennes, ids):
+    """Écart à la cible, puis moyenne_precision (code_correction.py)."""
+    return ids, moyennes, np.abs(ecarts)
+
+def _classement_ecart(ecarts, moyennes, ids):
+    """Écart à la cible seul, premier candidat des boucles à égalité (Dosage_edition.py, discontinu)."""
+    return ids, np.abs(ecarts)
+
+def _classement_surdosage(ecarts, moyennes, ids):
+    """Dose au moins égale à la cible d'abord, puis écart (Dosage_edition.py, continu)."""
+    return ids, np.abs(ecarts), ecarts < 0
+
+CLASSEMENTS = {
+    "precision": _classement_precision,
+    "ecart": _classement_ecart,
+    "surdosage": _classement_surdosage,
+}
+
+def _reclasser(table, dose_mg, plafond, classement="precision"):
+    """Identifiant du meilleur candidat pour dose_mg parmi les doses <= plafond, ou None."""
+    doses = table["doses"]
+    limite = int(np.searchsorted(doses, plafond, side="right"))
+    if limite == 0:
+        return None
+    # Les deux doses voisines de la cible ; seuls leurs membres sont développés.
+    pos = int(np.searchsorted(doses[:limite], dose_mg, side="left"))
+    plages = []
+    if pos < limite:
+        plages.append(np.arange(pos, int(np.searchsorted(doses, doses[pos], side="right"))))
+    if pos > 0:
+        plages.append(np.arange(int(np.searchsorted(doses, doses[pos - 1], side="left")), pos))
+    entrees = np.concatenate(plages)
+    erreurs, moyennes, ids, rangs = _developper(table, entrees, dose_mg)
+    if classement == "precision":
+        return int(ids[np.lexsort((ids, moyennes, erreurs))[0]])
+    ecarts = doses[entrees][rangs] - dose_mg
+    return int(ids[np.lexsort(CLASSEMENTS[classement](ecarts, moyennes, ids))[0]])
+
+def _reclasser_lot(table, cibles, plafonds):
+    """_reclasser pour un tableau de doses cibles : identifiants (-1 si aucun candidat).
+
+    Le meilleur membre d'une dose (moyenne_precision, puis ordre) ne dépend pas
+    de la cible : les doses voisines de toutes les cibles sont développées en une
+    fois, puis chaque cible compare ses deux voisines (écart, moyenne, ordre).
+    """
+    doses = table["doses"]
+    limites = np.searchsorted(doses, plafonds, side="right")
+    positions = np.minimum(np.searchsorted(doses, cibles, side="left"), limites)
+    droite = positions < limites
+    gauche = positions > 0
+    voisines = np.concatenate((doses[positions[droite]], doses[positions[gauche] - 1]))
+    identifiants = np.full(len(cibles), -1, dtype=np.intp)
+    if not len(voisines):
+        return identifiants
+
+    valeurs = np.unique(voisines)
+    debuts = np.searchsorted(doses, valeurs, side="left")
+    fins = np.searchsorted(doses, valeurs, side="right")
+    entrees = np.concatenate([np.arange(d, f) for d, f in zip(debuts, fins)])
+    _, moyennes, ids, rangs = _developper(table, entrees, 0.0)
+    groupes = np.searchsorted(valeurs, doses[entrees][rangs])
+    ordre = np.lexsort((ids, moyennes, groupes))
+    _, premiers = np.unique(groupes[ordre], return_index=True)
+    meilleures_moyennes = moyennes[ordre[premiers]]
+    meilleurs_ids = ids[ordre[premiers]]
+
+    # Clés (écart, moyenne, identifiant) des deux voisines de chaque cible ; inf si absente.
+    cles = []
+    for existe, decalage in ((droite, 0), (gauche, -1)):
+        ecart = np.full(len(cibles), np.inf)
+        moyenne = np.full(len(cibles), np.inf)
+        ident = np.full(len(cibles), np.iinfo(np.intp).max, dtype=np.intp)
+        groupe = np.searchsorted(valeurs, doses[positions[existe] + decalage])
+        ecart[existe] = np.abs(valeurs[groupe] - cibles[existe])
+        moyenne[existe] = meilleures_moyennes[groupe]
+        ident[existe] = meilleurs_ids[groupe]
+        cles.append((ecart, moyenne, ident))
+    (ed, md, idd), (eg, mg, idg) = cles
+    prend_droite = (ed < eg) | ((ed == eg) & ((md < mg) | ((md == mg) & (idd < idg))))
+    identifiants[:] = np.where(prend_droite, idd, idg)
+    identifiants[~(droite | gauche)] = -1
+    return identifiants
+
+def _localiser(index, identifiant, taille):
+    for entree in index:
+        n = taille(entree)
+        if identifiant < n:
+            return entree, identifiant
+        identifiant -= n
+    raise IndexError(identifiant)
+
+def _choisir_session_discontinu(session, syringes, dose_mg, current_concentration, nb_mes, suivi=None,
+                                classement="precision"):
+    index = construire_index(syringes)
+    table = _table_session(
+        session, ("Discontinu", tuple(syringes.items()), current_concentration, nb_mes),
+        lambda: _table_discontinu(index, current_concentration, nb_mes))
+    if suivi is not None:
+        suivi(len(index) - 1, None, len(table["doses"]))
+    identifiant = _reclasser(table, dose_mg, dose_mg + 1.5, classement)
+    if identifiant is None:
+        return None
+    entree, k = _localiser(index, identifiant, lambda e: len(e["quotients"]) * len(e["injectés"]))
+    return _option_discontinu(entree, k, current_concentration, nb_mes)
+
+def _choisir_session_continu(session, syringes, dose_mg, current_concentration, etape, volume_injecte,
+                             volume_max_prelevé, suivi=None, classement="precision"):
+    index = construire_index(syringes)
+    table = _table_session(
+        session, ("Continu", tuple(syringes.items()), current_concentration, etape, volume_injecte,
+                  volume_max_prelevé),
+        lambda: _table_continu(index, current_concentration, etape, volume_injecte, volume_max_prelevé))
+    if suivi is not None:
+        suivi(len(index) - 1, None, len(table["doses"]))
+    identifiant = _reclasser(table, dose_mg, math.inf, classement)
+    if identifiant is None:
+        return None
+    entree, couple = _localiser(index, identifiant, lambda e: len(e["quotients"]))
+    return _option_continu(entree, couple, current_concentration, etape, volume_injecte)
+
+# ---------------------- RECHERCHE EN FAISCEAU ----------------------
+# La recherche gloutonne ne garde qu'un état (la concentration courante) par
+# étape. Le faisceau en garde les largeur meilleurs, classés comme les options
+# gloutonnes (écart à la cible, moyenne_precision, ordre), une seule option par
+# état équivalent (même concentration obtenue, et même volume total en continu).
+# Un plan est terminé dès que sa dose tombe dans la cible ; le meilleur plan est
+# celui de plus petit écart, puis de moins d'étapes, puis de moindre
+# moyenne_precision (à défaut, le meilleur chemin partiel). Un état déjà atteint
+# n'est pas réexploré, et un état est abandonné quand même une dose idéale ne
+# pourrait battre le meilleur plan connu : les concentrations ne font que
+# diminuer, donc la dose reste sous concentration × plus grand volume injectable.
+# Le plan glouton (moteur « index ») entre d'emblée parmi les plans : le faisceau
+# ne rend jamais pire que faisceau=1, et la borne élague dès la première étape.
+# faisceau=1 garde la recherche gloutonne des moteurs.
+
+def _candidats(table, dose_mg, plafond, largeur):
+    """Les largeur meilleures options d'une table, une par état suivant : [(écart, moyenne, identifiant)].
+
+    La fenêtre autour de la cible est élargie jusqu'à contenir largeur états
+    distincts (ou toute la table). Seules les entrées à l'écart minimal de leur
+    état, pour les états en tête, sont développées en membres.
+    """
+    doses = table["doses"]
+    limite = int(np.searchsorted(doses, plafond, side="right"))
+    rayon = 0.5
+    while True:
+        lo = int(np.searchsorted(doses[:limite], dose_mg - rayon, side="left"))
+        hi = int(np.searchsorted(doses[:limite], dose_mg + rayon, side="right"))
+        erreurs = np.abs(doses[lo:hi] - dose_mg)
+        _, etats = _grouper(*table["equivalences"][table["classes"][lo:hi]].T)
+        meilleures = np.full(etats.max() + 1 if len(etats) else 0, np.inf)
+        np.minimum.at(meilleures, etats, erreurs)
+        if len(meilleures) >= largeur or (lo == 0 and hi == limite):
+            break
+        rayon *= 4
+    if not len(meilleures):
+        return []
+
+    seuil = np.sort(meilleures)[min(largeur, len(meilleures)) - 1]
+    entrees = np.flatnonzero((erreurs == meilleures[etats]) & (meilleures[etats] <= seuil))
+    ecarts, moyennes, ids, rangs = _developper(table, entrees + lo, dose_mg)
+    ordre = np.lexsort((ids, moyennes, ecarts))
+    _, premiers = np.unique(etats[entrees][rangs][ordre], return_index=True)
+    retenus = ordre[np.sort(premiers)[:largeur]]
+    return [(float(ecarts[i]), float(moyennes[i]), int(ids[i])) for i in retenus]
+
+def _rejouer(chemin):
+    """Fonction de choix qui renvoie, étape après étape, les options d'un plan déjà calculé."""
+    options = iter(chemin)
+
+    def choisir(*args, suivi=None):
+        return next(options, None)
+    return choisir
+
+def _faisceau(etats_initiaux, etendre, dose_mg, volume_max_injectable, largeur, progression, echeance=None,
+              glouton=(), cle_dose="dose"):
+    """Recherche en faisceau générique sur au plus 5 étapes ; renvoie le chemin retenu.
+
+    Un état est (chemin, concentration, contexte) ; etendre(état, étape, rang)
+    renvoie les extensions [(clé, suivant, clé d'équivalence, dose obtenue)], où
+    suivant() construit l'état suivant (seulement pour les extensions retenues).
+    glouton : étapes réelles du plan glouton, gardé sauf si un plan le bat strictement.
+    À l'échéance, la recherche s'arrête entre deux étapes sur le meilleur chemin connu.
+    """
+    faisceau = etats_initiaux
+    plans, partiels = [], []
+    if glouton:
+        dose = glouton[-1][cle_dose]
+        qualite = (round(abs(dose - dose_mg), 2), len(glouton), glouton[-1]["moyenne_precision"], math.inf)
+        (plans if dose_mg - 1.0 <= dose <= dose_mg + 1.0 else partiels).append((qualite, tuple(glouton)))
+    explores = set()
+    for etape in range(5):
+        if _echeance_atteinte(echeance, plans or partiels):
+            break
+        suivi = _suivi_etape(progression, etape, 1)
+        extensions = []
+        for rang, etat in enumerate(faisceau):
+            extensions.extend(etendre(etat, etape, rang))
+        if suivi is not None:
+            suivi(0, None, len(extensions))
+        if not extensions:
+            break
+        extensions.sort(key=lambda x: x[0])
+
+        # Un état déjà atteint (à cette étape ou avant) ne peut que coûter plus d'étapes.
+        faisceau, retenus = [], 0
+        for cle, suivant, equivalence, dose in extensions:
+            if equivalence in explores:
+                continue
+            # Un état écarté faute de place reste atteignable aux étapes suivantes.
+            retenus += 1
+            if retenus > largeur:
+                break
+            explores.add(equivalence)
+            etat = suivant()
+            # Écart arrondi au centième des doses : un bruit d'arrondi ne vaut pas une étape de plus.
+            qualite = (round(cle[0], 2), etape + 1, cle[1], len(plans) + len(partiels))
+            if dose_mg - 1.0 <= dose <= dose_mg + 1.0:
+                plans.append((qualite, etat[0]))
+            else:
+                partiels.append((qualite, etat[0]))
+                faisceau.append(etat)
+
+        if plans:
+            meilleur = min(plans)[0]
+            # Borne optimiste : écart minimal qu'un état pourrait encore atteindre. Les doses sont
+            # arrondies au centième, comme l'écart des plans : arrondir la borne la resserre sans la fausser.
+            faisceau = [etat for etat in faisceau
+                        if (round(max(dose_mg - round(etat[1] * volume_max_injectable, 2), 0.0), 2), etape + 2)
+                        < meilleur[:2]]
+        if not faisceau:
+            break
+
+    # Sans plan dans la cible, le meilleur chemin partiel.
+    return min(plans or partiels, default=(None, ()))[1]
+
+def _reelles(steps):
+    """Étapes réelles d'un protocole, sans leur type : un chemin que _rejouer peut rendre."""
+    return [{cle: valeur for cle, valeur in step.items() if cle != "type"}
+            for step in steps if step.get("type") == "réelle"]
+
+def _faisceau_discontinu(session, syringes, dose_mg, concentration_init, largeur, progression, echeance=None):
+    index = construire_index(syringes)
+    taille = lambda e: len(e["quotients"]) * len(e["injectés"])
+
+    def etendre(etat, etape, rang):
+        chemin, concentration, etape_compteur = etat
+        table = _table_session(
+            session, ("Discontinu", tuple(syringes.items()), concentration, etape_compteur),
+            lambda: _table_discontinu(index, concentration, etape_compteur))
+        extensions = []
+        for erreur, moyenne, identifiant in _candidats(table, dose_mg, dose_mg + 1.5, largeur):
+            entree, k = _localiser(index, identifiant, taille)
+            couple, injection = divmod(k, len(entree["injectés"]))
+            # Concentration et dose calculées comme dans _option_discontinu.
+            finale = round(concentration * (entree["volume prélevé"][couple] / entree["volume total"][couple]), 2)
+            extensions.append(((erreur, moyenne, rang, identifiant),
+                               functools.partial(suivant, chemin, entree, k, concentration, etape_compteur),
+                               finale, round(finale * entree["injectés"][injection], 2)))
+        return extensions
+
+    def suivant(chemin, entree, k, concentration, etape_compteur):
+        option = _option_discontinu(entree, k, concentration, etape_compteur)
+        virtuelle = not chemin and option["volume ajouté"] != 0.0
+        return chemin + (option,), option["concentration finale"], etape_compteur + 1 + virtuelle
+
+    glouton = _reelles(_derouler_discontinu(functools.partial(_choisir_discontinu, echeance=echeance), syringes,
+                                            dose_mg, concentration_init))
+    return _faisceau([((), concentration_init, 1)], etendre, dose_mg, max(syringes), largeur, progression,
+                     echeance, glouton, "dose obtenue")
+
+def _faisceau_continu(session, syringes, dose_mg, concentration_init, volume_injecte, largeur, progression,
+                      echeance=None):
+    index = construire_index(syringes)
+    taille = lambda e: len(e["quotients"])
+
+    def etendre(etat, etape, rang):
+        chemin, concentration, volume_max_prelevé = etat
+        table = _table_session(
+            session, ("Continu", tuple(syringes.items()), concentration, etape, volume_injecte, volume_max_prelevé),
+            lambda: _table_continu(index, concentration, etape, volume_injecte, volume_max_prelevé))
+        extensions = []
+        for erreur, moyenne, identifiant in _candidats(table, dose_mg, math.inf, largeur):
+            entree, couple = _localiser(index, identifiant, taille)
+            # Concentration et dose calculées comme dans _option_continu.
+            volume_total = entree["volume total"][couple]
+            finale = round(concentration * (entree["volume prélevé"][couple] / volume_total), 2)
+            extensions.append(((erreur, moyenne, rang, identifiant),
+                               functools.partial(suivant, chemin, entree, couple, concentration, etape),
+                               (finale, volume_total), round(finale * volume_injecte, 2)))
+        return extensions
+
+    def suivant(chemin, entree, couple, concentration, etape):
+        option = _option_continu(entree, couple, concentration, etape, volume_injecte)
+        return chemin + (option,), option["concentration"], option["volume total"]
+
+    glouton = _reelles(_derouler_continu(functools.partial(_choisir_continu, echeance=echeance), syringes,
+                                         dose_mg, concentration_init, volume_injecte))
+    return _faisceau([((), concentration_init, None)], etendre, dose_mg, volume_injecte, largeur, progression,
+                     echeance, glouton, "dose")
+
+# ---------------------- COUVERTURE DES DOSES ----------------------
+# Doses cibles atteignables à ± tolerance mg en 1, 2 ou 3 étapes de dilution
+# (mode discontinu, inventaire syringes). Les concentrations intermédiaires
+# possibles sont propagées étape par étape sur une grille au centième (l'arrondi
+# du moteur) ; chaque étape couple la dernière dilution et le volume injecté
+# d'une même seringue. Les doses atteintes sont marquées sur une grille au
+# centième de mg, puis élargies de ± tolerance pour donner les intervalles.
+
+def _marquer_produits(valeurs, facteurs, taille, colonnes=None, taille_bloc=1 << 21):
+    """Grilles (au centième) des round(v × f, 2) ; une grille par groupe de colonnes de facteurs."""
+    groupes = colonnes if colonnes is not None else [np.arange(len(facteurs))]
+    grilles = [np.zeros(taille, dtype=bool) for _ in groupes]
+    pas = max(1, taille_bloc // max(len(facteurs), 1))
+    for i in range(0, len(valeurs), pas):
+        centiemes = np.rint(np.round(np.outer(valeurs[i:i + pas], facteurs), 2) * 100).astype(np.int64)
+        for grille, cols in zip(grilles, groupes):
+            grille[centiemes[:, cols].ravel()] = True
+    return grilles
+
+def _intervalles(masque):
+    """Débuts et fins (inclus) des suites de True de masque."""
+    bords = np.diff(np.concatenate(([0], masque.astype(np.int8), [0])))
+    return np.flatnonzero(bords == 1), np.flatnonzero(bords == -1) - 1
+
+def _fusionner(debuts, fins):
+    ordre = np.argsort(debuts, kind="stable")
+    debuts, fins = debuts[ordre], np.maximum.accumulate(fins[ordre])
+    nouveaux = np.concatenate(([True], debuts[1:] > fins[:-1]))
+    return debuts[nouveaux], np.concatenate((fins[np.flatnonzero(nouveaux)[1:] - 1], fins[-1:]))
+
+def _diluees_utiles(entree, debuts, fins):
+    """Intervalles fusionnés (bas, haut) des concentrations diluées (mg/mL) dont une dose
+    injectée par la seringue entree tombe dans [debuts, fins] (centièmes de mg, inclus).
+
+    Les marges d'arrondi élargissent les intervalles : aucune dilution utile n'est écartée.
+    """
+    injectes = entree["injectés_arr"]
+    bas = ((debuts[None, :] / 100 - 0.006) / injectes[:, None]).ravel() - 0.006
+    haut = ((fins[None, :] / 100 + 0.006) / injectes[:, None]).ravel() + 0.006
+    return _fusionner(bas, haut)
+
+def _dilutions_utiles(concentrations, entree, taille_c, bas, haut):
+    """Grille des round(v × q, 2) de la seringue entree, limitée aux v dont la dilution
+    tombe dans un intervalle [bas, haut] ; produits calculés comme dans _marquer_produits."""
+    grille = np.zeros(taille_c, dtype=bool)
+    for q in np.unique(entree["quotients"]):
+        premiers = np.searchsorted(concentrations, bas / q * (1 - 1e-9), side="left")
+        derniers = np.searchsorted(concentrations, haut / q * (1 + 1e-9), side="right")
+        longueurs = derniers - premiers
+        if not longueurs.sum():
+            continue
+        positions = np.repeat(premiers - np.concatenate(([0], np.cumsum(longueurs)[:-1])), longueurs)
+        valeurs = concentrations[positions + np.arange(longueurs.sum())]
+        grille[np.rint(np.round(valeurs * q, 2) * 100).astype(np.int64)] = True
+    return grille
+
+def couverture_doses(concentration_init, nb_etapes_max=3, tolerance=1.0, syringes=SYRINGES):
+    """Carte des doses cibles atteignables pour une concentration de départ.
+
+    Renvoie une liste d'intervalles {"dose_min", "dose_max", "nb_etapes"} (mg, bornes
+    incluses) donnant, pour chaque plage de doses cibles, le nombre minimal d'étapes
+    permettant d'obtenir une dose à ± tolerance mg.
+    """
+    index = construire_index(syringes)
+    quotients, inverse = np.unique(np.concatenate([entree["quotients"] for entree in index]),
+                                   return_inverse=True)
+    colonnes, debut = [], 0
+    for entree in index:
+        colonnes.append(np.unique(inverse[debut:debut + len(entree["quotients"])]))
+        debut += len(entree["quotients"])
+
+    taille_c = int(np.rint(max(concentration_init, 0) * 100)) + 2
+    volume_max = max((entree["injectés"][-1] for entree in index if entree["injectés"]), default=0)
+    taille_d = int(np.ceil(taille_c * volume_max)) + 2
+    tolerance_centiemes = int(round(tolerance * 100))
+
+    concentrations = np.array([concentration_init], dtype=float)
+    atteintes = np.zeros(taille_d, dtype=bool)
+    nb_etapes_min = np.zeros(taille_d + 2 * tolerance_centiemes + 1, dtype=np.int8)
+    for etape in range(1, nb_etapes_max + 1):
+        utiles = None
+        if etape == nb_etapes_max and etape > 1:
+            # Dernière étape : les concentrations ne sont plus propagées, seules comptent
+            # les doses proches d'une cible encore non couverte. La recherche par intervalles
+            # n'est retenue que si elle coûte moins que le produit complet.
+            debuts, fins = _intervalles(nb_etapes_min[1:taille_d + tolerance_centiemes] == 0)
+            if len(debuts):
+                debuts, fins = _fusionner(debuts + 1 - tolerance_centiemes, fins + 1 + tolerance_centiemes)
+                utiles = [_diluees_utiles(entree, debuts, fins) for entree in index]
+                recherches = sum(len(bas) * len(np.unique(entree["quotients"]))
+                                 for entree, (bas, _) in zip(index, utiles))
+                if recherches >= len(concentrations) * len(quotients):
+                    utiles = None
+            else:
+                utiles = [(np.empty(0), np.empty(0))] * len(index)
+        if utiles is not None:
+            par_seringue = [_dilutions_utiles(concentrations, entree, taille_c, bas, haut)
+                            for entree, (bas, haut) in zip(index, utiles)]
+        else:
+            par_seringue = _marquer_produits(concentrations, quotients, taille_c, colonnes)
+        for entree, grille in zip(index, par_seringue):
+            diluees = np.flatnonzero(grille) / 100
+            atteintes |= _marquer_produits(diluees, entree["injectés_arr"], taille_d)[0]
+        if etape < nb_etapes_max:
+            concentrations = np.flatnonzero(np.logical_or.reduce(par_seringue)) / 100
+
+        # Cible t couverte s'il existe une dose atteinte d avec |d - t| <= tolérance.
+        cumul = np.concatenate(([0], np.cumsum(np.concatenate(
+            (np.zeros(tolerance_centiemes, dtype=bool), atteintes, np.zeros(tolerance_centiemes + 1, dtype=bool))))))
+        largeur = 2 * tolerance_centiemes + 1
+        couvertes = (cumul[largeur:] - cumul[:-largeur]) > 0
+        nouvelles = couvertes & (nb_etapes_min[:len(couvertes)] == 0)
+        nb_etapes_min[:len(couvertes)][nouvelles] = etape
+
+    # Cibles de t = 0.01 mg à la dose maximale atteinte + tolérance, regroupées par plages.
+    nb_etapes_min = nb_etapes_min[1:taille_d + tolerance_centiemes]
+    ruptures = np.flatnonzero(np.diff(nb_etapes_min)) + 1
+    debuts = np.concatenate(([0], ruptures))
+    fins = np.concatenate((ruptures, [len(nb_etapes_min)]))
+    return [{"dose_min": int(d + 1) / 100, "dose_max": int(f) / 100, "nb_etapes": int(nb_etapes_min[d])}
+            for d, f in zip(debuts, fins) if nb_etapes_min[d]]
+
+# ---------------------- ANALYSE DE SENSIBILITÉ ----------------------
+# La concentration réelle du flacon s'écarte de l'étiquette de quelques pour cent.
+# Le protocole choisi est rejoué en un seul passage vectoriel sur toutes les
+# concentrations perturbées (mêmes arrondis au centième que les étapes), et la
+# recherche peut être relancée pour voir si le protocole recommandé change.
+# La recherche relancée est celle du moteur « index », menée de front pour toutes
+# les concentrations : à chaque étape, une seule passe vectorielle par seringue
+# (bornes, fenêtres et meilleurs candidats de toutes les recherches), puis chaque
+# plan est rejoué par _derouler_* comme ceux de la recherche en faisceau.
+ECARTS_SENSIBILITE = np.round(np.arange(-0.05, 0.05 + 1e-9, 0.01), 2)
+
+def _meilleurs_lot(index, dose_mg, echelles, triees, pointeurs, marge, plafond, evaluer):
+    """_choisir_discontinu / _choisir_continu pour plusieurs recherches (une échelle > 0 chacune).
+
+    triees, pointeurs : noms des valeurs triées de l'index et de leurs pointeurs ;
+    marge(entree) : marge d'arrondi de la fenêtre ; plafond : demi-largeur maximale
+    au-dessus de la cible ; evaluer(entree, pointeurs, etats) : _evaluer_* par candidat.
+    Renvoie, par recherche, (ordre de la seringue, pointeur) du meilleur candidat, ou None.
+    """
+    etats = np.arange(len(echelles))
+    bornes = np.full(len(echelles), np.inf)
+    for entree in index:
+        valeurs = entree[triees]
+        if len(valeurs):
+            pos = np.searchsorted(valeurs, dose_mg / echelles)
+            voisins = np.concatenate((np.maximum(pos - 1, 0), np.minimum(pos, len(valeurs) - 1)))
+            erreurs, _, _, etats_voisins = evaluer(entree, entree[pointeurs][voisins], np.tile(etats, 2))
+            np.minimum.at(bornes, etats_voisins, erreurs)
+
+    meilleures = [None] * len(echelles)
+    for ordre_seringue, entree in enumerate(index):
+        m = marge(entree)
+        lo = np.searchsorted(entree[triees], (dose_mg - (bornes + m)) / echelles, side="left")
+        hi = np.searchsorted(entree[triees], (dose_mg + (np.minimum(bornes, plafond) + m)) / echelles, side="right")
+        longueurs = np.maximum(hi - lo, 0)
+        total = int(longueurs.sum())
+        if not total:
+            continue
+        # Fenêtres de toutes les recherches bout à bout.
+        debuts = np.cumsum(longueurs) - longueurs
+        positions = np.arange(total) - np.repeat(debuts - lo, longueurs)
+        erreurs, moyennes, ptrs, etats_candidats = evaluer(entree, entree[pointeurs][positions],
+                                                           np.repeat(etats, longueurs))
+        # Seuls les candidats à l'écart minimal de leur recherche sont triés.
+        minimums = np.full(len(echelles), np.inf)
+        np.minimum.at(minimums, etats_candidats, erreurs)
+        gardes = np.flatnonzero(erreurs == minimums[etats_candidats])
+        erreurs, moyennes, ptrs, etats_candidats = (erreurs[gardes], moyennes[gardes], ptrs[gardes],
+                                                    etats_candidats[gardes])
+        tri = np.lexsort((ptrs, moyennes, erreurs, etats_candidats))
+        for i in tri[np.flatnonzero(np.diff(etats_candidats[tri], prepend=-1))]:
+            cle = (float(erreurs[i]), float(moyennes[i]), ordre_seringue, int(ptrs[i]))
+            etat = etats_candidats[i]
+            if meilleures[etat] is None or cle < meilleures[etat]:
+                meilleures[etat] = cle
+    return [None if cle is None else (cle[2], cle[3]) for cle in meilleures]
+
+def _plans_discontinu_lot(syringes, dose_mg, concentrations_init, regles=None, echeance=None):
+    """Choix successifs de la recherche « index » (_iterer_discontinu) pour chaque concentration, de front."""
+    recherches = [{"concentration": c, "nb_mes": 1, "chemin": []} for c in concentrations_init]
+    actives = list(recherches)
+    for etape in range(5):
+        if not actives or (etape and _echeance_atteinte(echeance, actives)):
+            break
+        choix = {}
+        for nb_mes in sorted({r["nb_mes"] for r in actives}):
+            index = _index_regles(syringes, regles, "Discontinu", nb_mes)
+            groupe = [r for r in actives if r["nb_mes"] == nb_mes]
+            lot = [r for r in groupe if r["concentration"] > 0]
+            concentrations = np.array([r["concentration"] for r in lot], dtype=float)
+            evaluer = lambda entree, ptrs, etats: _evaluer_discontinu(
+                entree, ptrs, concentrations[etats], dose_mg, np.full(len(etats), nb_mes), etats)
+            marge = lambda entree: _marge_arrondi(entree["injectés"][-1] if entree["injectés"] else 0)
+            meilleurs = _meilleurs_lot(index, dose_mg, concentrations, "facteurs", "pointeurs", marge, 1.5,
+                                       evaluer) if lot else []
+            for r, meilleur in zip(lot, meilleurs):
+                choix[id(r)] = None if meilleur is None else _option_discontinu(
+                    index[meilleur[0]], meilleur[1], r["concentration"], nb_mes)
+            for r in groupe:
+                if r["concentration"] <= 0:
+                    choix[id(r)] = _choisir_discontinu(syringes, dose_mg, r["concentration"], nb_mes, regles=regles)
+        suivantes = []
+        for r in actives:
+            option = choix[id(r)]
+            if option is None:
+                continue
+            # Une première étape diluée est précédée de son étape virtuelle (voir _iterer_discontinu).
+            r["nb_mes"] += 2 if not r["chemin"] and option["volume ajouté"] != 0.0 else 1
+            r["chemin"].append(option)
+            if not dose_mg - 1.0 <= option["dose obtenue"] <= dose_mg + 1.0:
+                r["concentration"] = option["concentration finale"]
+                suivantes.append(r)
+        actives = suivantes
+    return [r["chemin"] for r in recherches]
+
+def _plans_continu_lot(syringes, dose_mg, concentrations_init, volume_injecte, regles=None, echeance=None):
+    """Choix successifs de la recherche « index » (_iterer_continu) pour chaque concentration, de front."""
+    recherches = [{"concentration": c, "volume_max": None, "chemin": []} for c in concentrations_init]
+    actives = list(recherches)
+    for etape in range(5):
+        if not actives or (etape and _echeance_atteinte(echeance, actives)):
+            break
+        index = _index_regles(syringes, regles, "Continu", etape + 1, volume_injecte)
+        lot = [r for r in actives if r["concentration"] * volume_injecte > 0]
+        concentrations = np.array([r["concentration"] for r in lot], dtype=float)
+        volumes_max = None if etape == 0 else np.array([r["volume_max"] for r in lot], dtype=float)
+        evaluer = lambda entree, ptrs, etats: _evaluer_continu(
+            entree, ptrs, concentrations[etats], dose_mg, etape, volume_injecte,
+            None if volumes_max is None else volumes_max[etats], etats)
+        meilleurs = _meilleurs_lot(index, dose_mg, concentrations * volume_injecte, "quotients_continu",
+                                   "pointeurs_continu", lambda entree: _marge_arrondi(volume_injecte), math.inf,
+                                   evaluer) if lot else []
+        choix = {id(r): None if meilleur is None else _option_continu(
+            index[meilleur[0]], meilleur[1], r["concentration"], etape, volume_injecte)
+            for r, meilleur in zip(lot, meilleurs)}
+        for r in actives:
+            if id(r) not in choix:
+                choix[id(r)] = _choisir_continu(syringes, dose_mg, r["concentration"], etape, volume_injecte,
+                                                r["volume_max"], regles=regles)
+        suivantes = []
+        for r in actives:
+            option = choix[id(r)]
+            if option is None:
+                continue
+            r["chemin"].append(option)
+            if not dose_mg - 1.0 <= option["dose"] <= dose_mg + 1.0:
+                r["concentration"], r["volume_max"] = option["concentration"], option["volume total"]
+                suivantes.append(r)
+        actives = suivantes
+    return [r["chemin"] for r in recherches]
+
+def _plan(etapes):
+    return [(s["seringue"], s["volume prélevé"], s["volume ajouté"], s.get("volume injecté"))
+            for s in etapes if s.get("type") == "réelle"]
+
+def rejouer_protocole(etapes, concentrations_init, volume_injecte=None):
+    """Doses obtenues par le protocole etapes pour chaque concentration de départ.
+
+    volume_injecte : volume perfusé en mode continu ; en mode discontinu, le volume
+    injecté de la dernière étape.
+    """
+    reelles = [s for s in etapes if s.get("type") == "réelle"]
+    concentrations = np.asarray(concentrations_init, dtype=float)
+    if not reelles:
+        return np.full(concentrations.shape, np.nan)
+    for s in reelles:
+        concentrations = np.round(concentrations * (s["volume prélevé"] / s["volume total"]), 2)
+    if volume_injecte is None:
+        volume_injecte = reelles[-1]["volume injecté"]
+    return np.round(concentrations * volume_injecte, 2)
+
+def analyser_sensibilite(mode, dose_mg, concentration_init, etapes=None, ecarts=ECARTS_SENSIBILITE,
+                         rechercher=False, nb_hours=24, debit_mlh=0.1, syringes=SYRINGES, regles=None,
+                         classement="precision", delai=None):
+    """Sensibilité du protocole à une erreur relative sur la concentration du flacon.
+
+    ecarts : erreurs relatives (-0.05 pour une concentration réelle 5 % sous
+    l'étiquette). etapes : protocole à évaluer, généré s'il est omis. Si
+    rechercher est vrai, la recherche est relancée pour chaque concentration
+    perturbée distincte, avec les mêmes règles de site et règle de classement
+    que le protocole ; delai borne l'ensemble de ces recherches, pas chacune.
+    Renvoie un dict : "concentrations", "doses", "dans_cible" (une valeur par
+    écart), "dose_min", "dose_max", "toujours_dans_cible" et, si rechercher,
+    "plan_change" et "doses_recherche".
+    """
+    continu = mode == "Continu"
+    volume_injecte = round(debit_mlh * nb_hours, 2) if continu else None
+    echeance = _echeance(delai)
+
+    def generer(concentration, **options):
+        if continu:
+            return generate_dilution_steps_continu(dose_mg, concentration, nb_hours=nb_hours, debit_mlh=debit_mlh,
+                                                   syringes=syringes, regles=regles, classement=classement,
+                                                   **options)
+        return generate_dilution_steps_discontinu(dose_mg, concentration, syringes=syringes, regles=regles,
+                                                  classement=classement, **options)
+
+    if etapes is None:
+        etapes = generer(concentration_init, delai=delai)
+    ecarts = np.asarray(ecarts, dtype=float)
+    concentrations = concentration_init * (1 + ecarts)
+    doses = rejouer_protocole(etapes, concentrations, volume_injecte)
+    dans_cible = np.abs(doses - dose_mg) <= 1.0
+    analyse = {
+        "ecarts": ecarts.tolist(),
+        "concentrations": concentrations.tolist(),
+        "doses": doses.tolist(),
+        "dans_cible": dans_cible.tolist(),
+        "dose_min": float(np.nanmin(doses)) if np.isfinite(doses).any() else None,
+        "dose_max": float(np.nanmax(doses)) if np.isfinite(doses).any() else None,
+        "toujours_dans_cible": bool(dans_cible.all()),
+    }
+    if rechercher:
+        plan = _plan(etapes)
+        cle_dose = "dose" if continu else "dose obtenue"
+        distinctes = list(dict.fromkeys(concentrations.tolist()))
+        if classement != "precision":
+            # Autre règle de classement : une recherche par concentration (chacune sa session, pas celle
+            # de l'utilisateur, que les concentrations perturbées encombreraient), sous un même délai.
+            fin = None if delai is None else time.perf_counter() + delai
+            protocoles = {c: generer(c, delai=None if fin is None else max(fin - time.perf_counter(), 0.0))
+                          for c in distinctes}
+        elif continu:
+            chemins = _plans_continu_lot(syringes, dose_mg, distinctes, volume_injecte, regles, echeance)
+            protocoles = {c: _derouler_continu(_rejouer(chemin), syringes, dose_mg, c, volume_injecte)
+                          for c, chemin in zip(distinctes, chemins)}
+        else:
+            chemins = _plans_discontinu_lot(syringes, dose_mg, distinctes, regles, echeance)
+            protocoles = {c: _derouler_discontinu(_rejouer(chemin), syringes, dose_mg, c)
+                          for c, chemin in zip(distinctes, chemins)}
+        reelles = {c: [s for s in p if s.get("type") == "réelle"] for c, p in protocoles.items()}
+        analyse["plan_change"] = [_plan(protocoles[c]) != plan for c in concentrations.tolist()]
+        analyse["doses_recherche"] = [float(reelles[c][-1][cle_dose]) if reelles[c] else None
+                                      for c in concentrations.tolist()]
+    return analyse
+
+# ---------------------- PROGRESSION ET ANNULATION ----------------------
+class CalculAnnule(Exception):
+    """Levée par un rappel de progression pour interrompre une recherche en cours."""
+
+def _suivi_etape(progression, etape, nb_seringues):
+    """Adapte le rappel progression(infos) au suivi par seringue des moteurs."""
+    if progression is None:
+        return None
+    total = [0]
+
+    def suivi(ordre_seringue, seringue, nb_candidats):
+        total[0] += nb_candidats
+        progression({
+            "étape": etape + 1,
+            "seringue": seringue,
+            "candidats": total[0],
+            "fraction": min((etape + (ordre_seringue + 1) / nb_seringues) / 5, 1.0),
+        })
+    return suivi
+
+# ---------------------- DÉLAI DE RÉPONSE ----------------------
+# delai (secondes) borne la durée d'une génération : passé l'échéance, le meilleur
+# choix trouvé est gardé (au sein d'une étape pour le moteur « index », sinon
+# entre deux étapes ; entre deux étages pour la recherche en faisceau) et le protocole est marqué "meilleur_dans_delai" au lieu de
+# "optimal" dans son étape "metriques". delai=None : recherche complète.
+def _echeance(delai):
+    if delai is None:
+        return None
+    return {"fin": time.perf_counter() + delai, "interrompu": False}
+
+def _sans_delai(echeance):
+    # Plan déjà calculé dans le délai (faisceau) : rejoué en entier, le statut est conservé.
+    return None if echeance is None else dict(echeance, fin=math.inf)
+
+def _statut(metriques_finales, echeance):
+    if echeance is not None:
+        metriques_finales["statut"] = "meilleur_dans_delai" if echeance["interrompu"] else "optimal"
+
+# ---------------------- MÉTRIQUES ----------------------
+def _mesurer(mode, moteur_fixe=None, etape_par_etape=False):
+    """Enregistre durée, candidats évalués, issue et cache de chaque génération (dilution_metriques).
+
+    etape_par_etape : la fonction est génératrice (iterer_dilution_steps_*) ; elle est
+    mesurée de la création du générateur à sa dernière étape, et s'il est abandonné
+    avant, l'issue est "annule". (Le drapeau évite d'importer inspect au démarrage.)
+    """
+    def decorateur(generer):
+        def mesure(kwargs, progression):
+            session = kwargs.get("session")
+            if moteur_fixe is not None:
+                moteur = moteur_fixe
+            elif kwargs.get("faisceau", 1) > 1:
+                moteur = "faisceau"
+            elif session is not None or kwargs.get("classement", "precision") != "precision":
+                moteur = "session"
+            else:
+                moteur = kwargs.get("moteur", "index")
+            # Dernier cumul de candidats signalé pour chaque étape.
+            candidats = {}
+
+            def relais(infos):
+                candidats[infos["étape"]] = infos["candidats"]
+                if progression is not None:
+                    progression(infos)
+
+            cache = (session["succes"], session["echecs"]) if session is not None else None
+            debut = time.perf_counter()
+
+            def observer(issue):
+                metriques.observer_protocole(mode, moteur, time.perf_counter() - debut, sum(candidats.values()), issue)
+                if cache is not None:
+                    metriques.observer_cache(session["succes"] - cache[0], session["echecs"] - cache[1])
+            return relais, observer
+
+        if etape_par_etape:
+            @functools.wraps(generer)
+            def iterer_mesure(*args, progression=None, **kwargs):
+                relais, observer = mesure(kwargs, progression)
+                issue = "erreur"
+                try:
+                    issue = "aucun"
+                    for step in generer(*args, progression=relais, **kwargs):
+                        issue = "ok"
+                        yield step
+                except (CalculAnnule, GeneratorExit):
+                    issue = "annule"
+                    raise
+                except BaseException:
+                    issue = "erreur"
+                    raise
+                finally:
+                    observer(issue)
+            return iterer_mesure
+
+        @functools.wraps(generer)
+        def generer_mesure(*args, progression=None, **kwargs):
+            relais, observer = mesure(kwargs, progression)
+            issue = "erreur"
+            try:
+                resultat = generer(*args, progression=relais, **kwargs)
+                issue = "ok" if resultat and (moteur_fixe != "lot" or any(resultat)) else "aucun"
+                return resultat
+            except CalculAnnule:
+                issue = "annule"
+                raise
+            finally:
+                observer(issue)
+        return generer_mesure
+    return decorateur
+
+# ---------------------- MODE DISCONTINU ----------------------
+def _preparer_discontinu(syringes, dose_mg, concentration_init, moteur, session, progression, faisceau, delai,
+                         classement, regles):
+    """(choisir, echeance) d'une génération en mode discontinu."""
+    echeance = _echeance(delai)
+    if faisceau > 1:
+        choisir = _rejouer(_faisceau_discontinu(session or nouvelle_session(), syringes, dose_mg,
+                                                concentration_init, faisceau, progression, echeance))
+        echeance = _sans_delai(echeance)
+    elif session is not None or classement != "precision":
+        choisir = functools.partial(_choisir_session_discontinu, session or nouvelle_session(),
+                                    classement=classement)
+    else:
+        choisir = MOTEURS_DISCONTINU[moteur]
+    if choisir is _choisir_discontinu and (echeance is not None or regles is not None):
+        choisir = functools.partial(_choisir_discontinu, echeance=echeance, regles=regles)
+    elif regles is not None:
+        raise ValueError("Les règles de site ne sont appliquées que par le moteur « index ».")
+    return choisir, echeance
+
+@_mesurer("Discontinu")
+def generate_dilution_steps_discontinu(dose_mg, concentration_init, syringes=SYRINGES, moteur="index",
+                                       session=None, progression=None, faisceau=1, delai=None,
+                                       classement="precision", regles=None):
+    choisir, echeance = _preparer_discontinu(syringes, dose_mg, concentration_init, moteur, session, progression,
+                                             faisceau, delai, classement, regles)
+    return _derouler_discontinu(choisir, syringes, dose_mg, concentration_init, progression, echeance)
+
+@_mesurer("Discontinu", etape_par_etape=True)
+def iterer_dilution_steps_discontinu(dose_mg, concentration_init, syringes=SYRINGES, moteur="index",
+                                     session=None, progression=None, faisceau=1, delai=None,
+                                     classement="precision", regles=None):
+    """generate_dilution_steps_discontinu étape par étape : chaque étape est rendue dès qu'elle est choisie."""
+    choisir, echeance = _preparer_discontinu(syringes, dose_mg, concentration_init, moteur, session, progression,
+                                             faisceau, delai, classement, regles)
+    yield from _iterer_discontinu(choisir, syringes, dose_mg, concentration_init, progression, echeance)
+
+def _derouler_discontinu(choisir, syringes, dose_mg, concentration_init, progression=None, echeance=None):
+    return list(_iterer_discontinu(choisir, syringes, dose_mg, concentration_init, progression, echeance))
+
+def _iterer_discontinu(choisir, syringes, dose_mg, concentration_init, progression=None, echeance=None):
+    """Étapes du protocole, rendues au fur et à mesure des choix de
+    choisir(syringes, dose_mg, concentration, nb_mes, suivi), puis les métriques."""
+    current_concentration = concentration_init
+    steps = []
+    cible_min = dose_mg - 1.0
+    cible_max = dose_mg + 1.0
+    is_first_step = True
+    etape_compteur = 1
+
+    for etape in range(5):
+        if steps and _echeance_atteinte(echeance, steps):
+            break
+        meilleure = choisir(syringes, dose_mg, current_concentration, etape_compteur,
+                            suivi=_suivi_etape(progression, etape, len(syringes)))
+
+        if meilleure is None:
+            break
+
+        if is_first_step and meilleure['volume ajouté'] != 0.0:
+            etape_virtuelle = {
+                "type": "virtuelle",
+                "étape": 1,
+                "seringue": meilleure['seringue'],
+                "volume prélevé": meilleure['volume prélevé'],
+                "volume ajouté": 0.0,
+                "ratio": round((meilleure['volume prélevé'] / meilleure['seringue']) * 100, 2),
+                "concentration": concentration_init,
+            }
+            steps.append(etape_virtuelle)
+            yield etape_virtuelle
+            meilleure['étape'] = 2
+            etape_compteur += 1
+
+        meilleure["type"] = "réelle"
+        steps.append(meilleure)
+        yield meilleure
+        etape_compteur += 1
+        is_first_step = False
+
+        if cible_min <= meilleure['dose obtenue'] <= cible_max:
+            break
+
+        current_concentration = meilleure['concentration finale']
+
+    if steps:
+        for step in reversed(steps):
+            if step.get("type") == "réelle":
+                derniere = step
+                break
+        metriques_finales = {
+            "type": "metriques",
+            "moyenne_precision": derniere['moyenne_precision'],
+            "ecart_type": derniere['ecart_type'],
+            "IC": derniere['IC']
+        }
+        _statut(metriques_finales, echeance)
+        yield metriques_finales
+
+# ---------------------- MODE CONTINU ----------------------
+def _preparer_continu(syringes, dose_mg, concentration_init, volume_injecte, moteur, session, progression, faisceau,
+                      delai, classement, regles):
+    """(choisir, echeance) d'une génération en mode continu."""
+    echeance = _echeance(delai)
+    if faisceau > 1:
+        choisir = _rejouer(_faisceau_continu(session or nouvelle_session(), syringes, dose_mg, concentration_init,
+                                             volume_injecte, faisceau, progression, echeance))
+        echeance = _sans_delai(echeance)
+    elif session is not None or classement != "precision":
+        choisir = functools.partial(_choisir_session_continu, session or nouvelle_session(),
+                                    classement=classement)
+    else:
+        choisir = MOTEURS_CONTINU[moteur]
+    if choisir is _choisir_continu and (echeance is not None or regles is not None):
+        choisir = functools.partial(_choisir_continu, echeance=echeance, regles=regles)
+    elif regles is not None:
+        raise ValueError("Les règles de site ne sont appliquées que par le moteur « index ».")
+    return choisir, echeance
+
+@_mesurer("Continu")
+def generate_dilution_steps_continu(dose_mg, concentration_init, nb_hours=24, debit_mlh=0.1, syringes=SYRINGES,
+                                    moteur="index", session=None, progression=None, faisceau=1, delai=None,
+                                    classement="precision", regles=None):
+    volume_injecte = round(debit_mlh * nb_hours, 2)
+    choisir, echeance = _preparer_continu(syringes, dose_mg, concentration_init, volume_injecte, moteur, session,
+                                          progression, faisceau, delai, classement, regles)
+    return _derouler_continu(choisir, syringes, dose_mg, concentration_init, volume_injecte, progression, echeance)
+
+@_mesurer("Continu", etape_par_etape=True)
+def iterer_dilution_steps_continu(dose_mg, concentration_init, nb_hours=24, debit_mlh=0.1, syringes=SYRINGES,
+                                  moteur="index", session=None, progression=None, faisceau=1, delai=None,
+                                  classement="precision", regles=None):
+    """generate_dilution_steps_continu étape par étape : chaque étape est rendue dès qu'elle est choisie."""
+    volume_injecte = round(debit_mlh * nb_hours, 2)
+    choisir, echeance = _preparer_continu(syringes, dose_mg, concentration_init, volume_injecte, moteur, session,
+                                          progression, faisceau, delai, classement, regles)
+    yield from _iterer_continu(choisir, syringes, dose_mg, concentration_init, volume_injecte, progression,
+                               echeance)
+
+def _derouler_continu(choisir, syringes, dose_mg, concentration_init, volume_injecte, progression=None,
+                      echeance=None):
+    return list(_iterer_continu(choisir, syringes, dose_mg, concentration_init, volume_injecte, progression,
+                                echeance))
+
+def _iterer_continu(choisir, syringes, dose_mg, concentration_init, volume_injecte, progression=None,
+                    echeance=None):
+    """Étapes affichées du protocole, rendues au fur et à mesure des choix (voir _iterer_discontinu)."""
+    current_concentration = concentration_init
+    steps = []
+    cible_min = dose_mg - 1.0
+    cible_max = dose_mg + 1.0
+    derniere_etape = None
+
+    for etape in range(5):
+        if steps and _echeance_atteinte(echeance, steps):
+            break
+        volume_max_prelevé = steps[-1]['volume total'] if steps else None
+        meilleure = choisir(syringes, dose_mg, current_concentration, etape,
+                            volume_injecte, volume_max_prelevé,
+                            suivi=_suivi_etape(progression, etape, len(syringes)))
+
+        if meilleure is None:
+            break
+
+        if meilleure['volume ajouté'] != 0:
+            ratio_virtuel = round((meilleure['volume prélevé'] / meilleure['seringue']) * 100, 2)
+            concentration_virtuelle = (meilleure['volume total'] * meilleure['concentration']) / meilleure['volume prélevé']
+            concentration_virtuelle = round(concentration_virtuelle + 1e-3, 2)
+            dose_obtenue = round(concentration_virtuelle * volume_injecte, 2)
+            etape_virtuelle = {
+                "type": "virtuelle",
+                "seringue": meilleure['seringue'],
+                "volume prélevé": meilleure['volume prélevé'],
+                "ratio": ratio_virtuel,
+                "concentration": concentration_virtuelle,
+                "dose": dose_obtenue
+            }
+            yield etape_virtuelle
+
+        meilleure["type"] = "réelle"
+        steps.append(meilleure)
+        yield meilleure
+        derniere_etape = meilleure
+
+        if cible_min <= meilleure['dose'] <= cible_max:
+            break
+
+        current_concentration = meilleure['concentration']
+
+    if derniere_etape:
+        metriques_finales = {
+            "type": "metriques",
+            "moyenne_precision": derniere_etape['moyenne_precision'],
+            "ecart_type": derniere_etape['ecart_type'],
+            "IC": derniere_etape['IC']
+        }
+        _statut(metriques_finales, echeance)
+        yield metriques_finales
+
+# ---------------------- PLUSIEURS DOSES CIBLES ----------------------
+# Pour une table de titration, les cibles partagent l'énumération : à chaque
+# étape, les cibles sont regroupées par état (concentration courante...), chaque
+# table de session est construite une fois et _reclasser_lot choisit pour toutes
+# les cibles de l'état à la fois. Les choix de chaque cible sont ensuite rejoués
+# par le déroulé habituel : protocoles identiques à des appels séparés.
+
+# Un état partagé par peu de cibles ne justifie pas la construction d'une table :
+# ces cibles sont servies une à une par le moteur « index ».
+CIBLES_MIN_TABLE = 8
+
+def _lot(cibles, etat_initial, table, plafonds, option, direct, suivant, dose, progression):
+    """Choix successifs (plans) de chaque cible.
+
+    table(état, étape) : table de session ; option(état, étape, identifiant) et
+    direct(état, étape, cible) : option choisie (ou None) ; suivant(état, option,
+    plan) : état suivant ; dose(option) : dose obtenue.
+    """
+    chemins = [[] for _ in cibles]
+    etats = {etat_initial: np.arange(len(cibles))}
+    for etape in range(5):
+        suivants = {}
+        suivi = _suivi_etape(progression, etape, len(etats))
+        for rang, (etat, numeros) in enumerate(etats.items()):
+            if len(numeros) < CIBLES_MIN_TABLE:
+                choix_etat = [direct(etat, etape, float(cibles[numero])) for numero in numeros]
+                if suivi is not None:
+                    suivi(rang, None, 0)
+            else:
+                t = table(etat, etape)
+                if suivi is not None:
+                    suivi(rang, None, len(t["doses"]))
+                choix_etat = [None if identifiant < 0 else option(etat, etape, int(identifiant))
+                              for identifiant in _reclasser_lot(t, cibles[numeros], plafonds[numeros])]
+            for numero, choix in zip(numeros, choix_etat):
+                if choix is None:
+                    continue
+                chemins[numero].append(choix)
+                if not cibles[numero] - 1.0 <= dose(choix) <= cibles[numero] + 1.0:
+                    suivants.setdefault(suivant(etat, choix, chemins[numero]), []).append(numero)
+        etats = {etat: np.array(numeros) for etat, numeros in suivants.items()}
+        if not etats:
+            break
+    return chemins
+
+@_mesurer("Discontinu", moteur_fixe="lot")
+def generate_dilution_steps_discontinu_lot(doses_mg, concentration_init, syringes=SYRINGES, session=None,
+                                           progression=None):
+    """generate_dilution_steps_discontinu pour chaque dose de doses_mg : liste de protocoles."""
+    session = session if session is not None else nouvelle_session()
+    index = construire_index(syringes)
+    cibles = np.asarray(doses_mg, dtype=float)
+    taille = lambda e: len(e["quotients"]) * len(e["injectés"])
+
+    def table(etat, etape):
+        concentration, etape_compteur = etat
+        return _table_session(
+            session, ("Discontinu", tuple(syringes.items()), concentration, etape_compteur),
+            lambda: _table_discontinu(index, concentration, etape_compteur))
+
+    def option(etat, etape, identifiant):
+        entree, k = _localiser(index, identifiant, taille)
+        return _option_discontinu(entree, k, etat[0], etat[1])
+
+    def suivant(etat, choix, chemin):
+        virtuelle = len(chemin) == 1 and bool(choix["volume ajouté"] != 0.0)
+        return choix["concentration finale"], etat[1] + 1 + virtuelle
+
+    def direct(etat, etape, dose_mg):
+        return _choisir_discontinu(syringes, dose_mg, etat[0], etat[1])
+
+    chemins = _lot(cibles, (concentration_init, 1), table, cibles + 1.5, option, direct, suivant,
+                   lambda choix: choix["dose obtenue"], progression)
+    return [_derouler_discontinu(_rejouer(chemin), syringes, float(dose_mg), concentration_init)
+            for dose_mg, chemin in zip(cibles, chemins)]
+
+@_mesurer("Continu", moteur_fixe="lot")
+def generate_dilution_steps_continu_lot(doses_mg, concentration_init, nb_hours=24, debit_mlh=0.1, syringes=SYRINGES,
+                                        session=None, progression=None):
+    """generate_dilution_steps_continu pour chaque dose de doses_mg : liste de protocoles."""
+    session = session if session is not None else nouvelle_session()
+    index = construire_index(syringes)
+    cibles = np.asarray(doses_mg, dtype=float)
+    volume_injecte = round(debit_mlh * nb_hours, 2)
+    taille = lambda e: len(e["quotients"])
+
+    def table(etat, etape):
+        concentration, volume_max_prelevé = etat
+        return _table_session(
+            session, ("Continu", tuple(syringes.items()), concentration, etape, volume_injecte, volume_max_prelevé),
+            lambda: _table_continu(index, concentration, etape, volume_injecte, volume_max_prelevé))
+
+    def option(etat, etape, identifiant):
+        entree, couple = _localiser(index, identifiant, taille)
+        return _option_continu(entree, couple, etat[0], etape, volume_injecte)
+
+    def suivant(etat, choix, chemin):
+        return choix["concentration"], choix["volume total"]
+
+    def direct(etat, etape, dose_mg):
+        return _choisir_continu(syringes, dose_mg, etat[0], etape, volume_injecte, etat[1])
+
+    chemins = _lot(cibles, (concentration_init, None), table, np.full(len(cibles), np.inf), option, direct,
+                   suivant, lambda choix: choix["dose"], progression)
+    return [_derouler_continu(_rejouer(chemin), syringes, float(dose_mg), concentration_init, volume_injecte)
+            for dose_mg, chemin in zip(cibles, chemins)]
+
+# ---------------------- COMPARAISON DES CLASSEMENTS ----------------------
+def comparer_classements(mode, dose_mg, concentration_init, classements=tuple(CLASSEMENTS), nb_hours=24,
+                         debit_mlh=0.1, syringes=SYRINGES, session=None):
+    """Protocole obtenu avec chaque règle de classement : {nom: étapes}.
+
+    Toutes les règles partagent la session : les tables de candidats déjà
+    énumérées (au moins celle de la première étape) sont reclassées, pas
+    recalculées.
+    """
+    session = session if session is not None else nouvelle_session()
+    protocoles = {}
+    for classement in classements:
+        if mode == "Continu":
+            protocoles[classement] = generate_dilution_steps_continu(
+                dose_mg, concentration_init, nb_hours=nb_hours, debit_mlh=debit_mlh, syringes=syringes,
+                session=session, classement=classement)
+        else:
+            protocoles[classement] = generate_dilution_steps_discontinu(
+                dose_mg, concentration_init, syringes=syringes, session=session, classement=classement)
+    return protocoles
@@ -0,0 +1,212 @@
+# dilution_metriques.py
+# Métriques de la génération des protocoles, au format texte OpenMetrics
+# (Prometheus) : durées et nombres de candidats par mode et moteur, issues des
+# recherches (dont « Aucun protocole trouvé ») et succès du cache de session et
+# du cache persistant (dilution_cache).
+#
+# L'enregistrement ne prend aucun verrou : chaque thread écrit dans ses propres
+# compteurs, et seule l'exposition les additionne. Les compteurs d'un thread
+# terminé (une tâche de dilution_taches) sont versés dans une archive commune
+# dès qu'un nouveau thread s'enregistre, ou à l'exposition.
+# Exposition : exposer() (texte), ecrire(chemin), ecrire_periodiquement(chemin)
+# ou servir(port) pour un point d'accès HTTP local /metrics.
+import bisect
+import math
+import os
+import threading
+
+BORNES_DUREE = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, math.inf)
+BORNES_CANDIDATS = (100, 1_000, 10_000, 100_000, 1_000_000, 10_000_000, math.inf)
+
+# nom : (type, unité, aide, bornes)
+METRIQUES = {
+    "dilution_protocole_duree_seconds": ("histogram", "seconds", "Durée de génération d'un protocole.",
+                                         BORNES_DUREE),
+    "dilution_protocole_candidats": ("histogram", None, "Candidats évalués pour un protocole.", BORNES_CANDIDATS),
+    "dilution_protocoles": ("counter", None, "Protocoles demandés, par issue (ok, aucun, annule, erreur).", None),
+    "dilution_cache_requetes": ("counter", None, "Requêtes au cache de session, par résultat.", None),
+    "dilution_cache_disque_requetes": ("counter", None, "Requêtes au cache persistant des protocoles, par résultat.",
+                                       None),
+}
+
+TYPE_CONTENU = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+
+_LOCAL = threading.local()
+_VERROU = threading.Lock()   # enregistrement d'un nouveau thread et exposition uniquement
+_PARTS = []                  # (thread, compteurs) des threads ayant enregistré
+_ARCHIVE = {}
+_SERVEUR = None
+_ECRIVAINS = {}
+
+# ---------------------- ENREGISTREMENT ----------------------
+def _compteurs():
+    compteurs = getattr(_LOCAL, "compteurs", None)
+    if compteurs is None:
+        compteurs = _LOCAL.compteurs = {}
+        with _VERROU:
+            _verser_terminees()
+            _PARTS.append((threading.current_thread(), compteurs))
+    return compteurs
+
+def _verser_terminees():
+    # Sous _VERROU : un thread terminé n'écrit plus, ses compteurs rejoignent l'archive.
+    vivantes = []
+    for thread, compteurs in _PARTS:
+        if thread.is_alive():
+            vivantes.append((thread, compteurs))
+        else:
+            _cumuler(_ARCHIVE, compteurs)
+    _PARTS[:] = vivantes
+
+def _observer(compteurs, nom, etiquettes, valeur):
+    bornes = METRIQUES[nom][3]
+    serie = compteurs.get((nom, etiquettes))
+    if serie is None:
+        # [compte par tranche..., somme, nombre]
+        serie = compteurs[(nom, etiquettes)] = [0] * len(bornes) + [0.0, 0]
+    serie[bisect.bisect_left(bornes, valeur)] += 1
+    serie[-2] += valeur
+    serie[-1] += 1
+
+def _incrementer(compteurs, nom, etiquettes, valeur=1):
+    serie = compteurs.get((nom, etiquettes))
+    if serie is None:
+        serie = compteurs[(nom, etiquettes)] = [0]
+    serie[0] += valeur
+
+def observer_protocole(mode, moteur, duree, candidats, issue):
+    """Enregistre une génération de protocole ; issue : "ok", "aucun", "annule" ou "erreur"."""
+    compteurs = _compteurs()
+    etiquettes = (("mode", mode), ("moteur", moteur))
+    _incrementer(compteurs, "dilution_protocoles", etiquettes + (("issue", issue),))
+    if issue in ("ok", "aucun"):
+        _observer(compteurs, "dilution_protocole_duree_seconds", etiquettes, duree)
+        _observer(compteurs, "dilution_protocole_candidats", etiquettes, candidats)
+
+def observer_cache(succes, echecs):
+    compteurs = _compteurs()
+    if succes:
+        _incrementer(compteurs, "dilution_cache_requetes", (("resultat", "succes"),), succes)
+    if echecs:
+        _incrementer(compteurs, "dilution_cache_requetes", (("resultat", "echec"),), echecs)
+
+def observer_cache_disque(succes):
+    resultat = "succes" if succes else "echec"
+    _incrementer(_compteurs(), "dilution_cache_disque_requetes", (("resultat", resultat),))
+
+# ---------------------- EXPOSITION ----------------------
+def _cumuler(total, compteurs):
+    # dict.items() copié en une opération C : sûr pendant qu'un autre thread écrit.
+    for cle, serie in list(compteurs.items()):
+        cumul = total.setdefault(cle, [0] * len(serie))
+        for i, valeur in enumerate(list(serie)):
+            cumul[i] += valeur
+
+def instantane():
+    """Totaux de tous les threads : {(nom, étiquettes): série}."""
+    with _VERROU:
+        _verser_terminees()
+        total = {}
+        _cumuler(total, _ARCHIVE)
+        for _, compteurs in _PARTS:
+            _cumuler(total, compteurs)
+    return total
+
+def verser(totaux):
+    """Ajoute à l'archive des totaux relevés dans un autre processus ({(nom, étiquettes): série})."""
+    with _VERROU:
+        _cumuler(_ARCHIVE, totaux)
+
+def _echapper(valeur):
+    return str(valeur).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _etiquettes(etiquettes):
+    if not etiquettes:
+        return ""
+    return "{" + ",".join(f'{k}="{_echapper(v)}"' for k, v in etiquettes) + "}"
+
+def _nombre(valeur):
+    if valeur == math.inf:
+        return "+Inf"
+    return repr(float(valeur)) if isinstance(valeur, float) else str(valeur)
+
+def exposer():
+    """Texte OpenMetrics de toutes les métriques."""
+    total = instantane()
+    lignes = []
+    for nom, (type_, unite, aide, bornes) in METRIQUES.items():
+        lignes.append(f"# TYPE {nom} {type_}")
+        if unite:
+            lignes.append(f"# UNIT {nom} {unite}")
+        lignes.append(f"# HELP {nom} {aide}")
+        for (n, etiquettes), serie in sorted(total.items()):
+            if n != nom:
+                continue
+            if type_ == "counter":
+                lignes.append(f"{nom}_total{_etiquettes(etiquettes)} {serie[0]}")
+                continue
+            cumul = 0
+            for borne, compte in zip(bornes, serie):
+                cumul += compte
+                lignes.append(f"{nom}_bucket{_etiquettes(etiquettes + (('le', _nombre(borne)),))} {cumul}")
+            lignes.append(f"{nom}_sum{_etiquettes(etiquettes)} {_nombre(serie[-2])}")
+            lignes.append(f"{nom}_count{_etiquettes(etiquettes)} {serie[-1]}")
+
+    succes = total.get(("dilution_cache_requetes", (("resultat", "succes"),)), [0])[0]
+    echecs = total.get(("dilution_cache_requetes", (("resultat", "echec"),)), [0])[0]
+    lignes.append("# TYPE dilution_cache_ratio gauge")
+    lignes.append("# HELP dilution_cache_ratio Part des requêtes servies par le cache de session.")
+    lignes.append(f"dilution_cache_ratio {_nombre(succes / (succes + echecs) if succes + echecs else 0.0)}")
+    lignes.append("# EOF")
+    return "\n".join(lignes) + "\n"
+
+def ecrire(chemin):
+    """Écrit l'exposition dans chemin (remplacement atomique, pour un collecteur de fichiers)."""
+    temporaire = f"{chemin}.{os.getpid()}.tmp"
+    with open(temporaire, "w", encoding="utf-8") as fichier:
+        fichier.write(exposer())
+    os.replace(temporaire, chemin)
+
+def ecrire_periodiquement(chemin, intervalle=15.0):
+    """Réécrit chemin toutes les intervalle secondes (une seule fois par chemin et par processus)."""
+    if chemin in _ECRIVAINS:
+        return _ECRIVAINS[chemin]
+    arret = threading.Event()
+
+    def boucle():
+        while not arret.wait(intervalle):
+            try:
+                ecrire(chemin)
+            except OSError:
+                pass
+    ecrire(chemin)
+    threading.Thread(target=boucle, name="metriques-fichier", daemon=True).start()
+    _ECRIVAINS[chemin] = arret
+    return arret
+
+def servir(port=9464, hote="127.0.0.1"):
+    """Démarre (une fois par processus) un point d'accès HTTP local /metrics."""
+    global _SERVEUR
+    if _SERVEUR is not None:
+        return _SERVEUR
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Gestionnaire(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            corps = exposer().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", TYPE_CONTENU)
+            self.send_header("Content-Length", str(len(corps)))
+            self.end_headers()
+            self.wfile.write(corps)
+
+        def log_message(self, format, *args):
+            pass
+
+    _SERVEUR = ThreadingHTTPServer((hote, port), Gestionnaire)
+    _SERVEUR.daemon_threads = True
+    threading.Thread(target=_SERVEUR.serve_forever, name="metriques-http", daemon=True).start()
+    return _SERVEUR
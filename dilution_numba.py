@@ -0,0 +1,151 @@
+# dilution_numba.py
+# Moteur « numba » : énumération et score des candidats d'une seringue dans une
+# boucle compilée (numba.njit), sans masques ni tableaux intermédiaires.
+#
+# Chaque candidat est repéré par des entiers (couple prélevé/ajouté, graduation
+# injectée) sur des tableaux typés float64 de l'index ; les filtres (plafond de
+# dose, plafond de prélèvement, volume total suffisant) et le départage (écart,
+# moyenne_precision, ordre des boucles) sont évalués candidat par candidat, avec
+# les arrondis au centième de numpy (x × 100, rint, ÷ 100). Seul le meilleur
+# candidat de la seringue est conservé ; la fusion entre seringues reste celle du
+# moteur « index ».
+#
+# numba est facultatif : sans lui, le moteur « numba » se replie sur « index »,
+# qui donne le même protocole.
+import numpy as np
+
+import dilution_engine as engine
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+def disponible():
+    return numba is not None
+
+def _compiler(fonction):
+    if numba is None:
+        return fonction
+    return numba.njit(cache=True, nogil=True)(fonction)
+
+# ---------------------- NOYAUX ----------------------
+@_compiler
+def _arrondir(valeur):
+    return np.rint(valeur * 100.0) / 100.0
+
+@_compiler
+def _meilleur_discontinu(quotients, ratios, injectes, current_concentration, dose_mg, nb_mes, anova, sigma_mes,
+                         sigma_ratio):
+    """(écart, moyenne_precision, pointeur) du meilleur candidat ; pointeur -1 si aucun."""
+    plafond = dose_mg + 1.5
+    meilleur_ecart = np.inf
+    meilleure_moyenne = np.inf
+    meilleur = -1
+    nb_inj = injectes.shape[0]
+    for couple in range(quotients.shape[0]):
+        concentration = _arrondir(current_concentration * quotients[couple])
+        facteur_ratio = anova + nb_mes * sigma_mes + (ratios[couple] / 100.0) * sigma_ratio
+        for injection in range(nb_inj):
+            dose = _arrondir(concentration * injectes[injection])
+            if dose > plafond:
+                continue
+            ecart = abs(dose - dose_mg)
+            if ecart > meilleur_ecart:
+                continue
+            moyenne = (dose / 100.0) * facteur_ratio
+            if ecart < meilleur_ecart or moyenne < meilleure_moyenne:
+                meilleur_ecart = ecart
+                meilleure_moyenne = moyenne
+                meilleur = couple * nb_inj + injection
+    return meilleur_ecart, meilleure_moyenne, meilleur
+
+@_compiler
+def _meilleur_continu(quotients, ratios, prelevés, totaux, continu_ok, current_concentration, dose_mg, etape,
+                      volume_injecte, volume_max_prelevé, anova, sigma_mes, sigma_ratio):
+    meilleur_ecart = np.inf
+    meilleure_moyenne = np.inf
+    meilleur = -1
+    for couple in range(quotients.shape[0]):
+        if not continu_ok[couple] or prelevés[couple] > volume_max_prelevé:
+            continue
+        if etape >= 1 and totaux[couple] < volume_injecte:
+            continue
+        dose = _arrondir(_arrondir(current_concentration * quotients[couple]) * volume_injecte)
+        ecart = abs(dose - dose_mg)
+        if ecart > meilleur_ecart:
+            continue
+        moyenne = (dose / 100.0) * (anova + (etape + 1) * sigma_mes + (ratios[couple] / 100.0) * sigma_ratio)
+        if ecart < meilleur_ecart or moyenne < meilleure_moyenne:
+            meilleur_ecart = ecart
+            meilleure_moyenne = moyenne
+            meilleur = couple
+    return meilleur_ecart, meilleure_moyenne, meilleur
+
+# ---------------------- TABLEAUX TYPÉS ----------------------
+_STRUCTURE_CACHE = {}
+
+def _structure(syringes):
+    """Tableaux contigus float64 / booléens de chaque seringue, passés tels quels aux noyaux."""
+    cle = tuple(syringes.items())
+    if cle not in _STRUCTURE_CACHE:
+        structure = []
+        for entree in engine.construire_index(syringes):
+            continu_ok = np.zeros(len(entree["quotients"]), dtype=np.bool_)
+            continu_ok[entree["pointeurs_continu"]] = True
+            structure.append({
+                "entree": entree,
+                "quotients": np.ascontiguousarray(entree["quotients"], dtype=np.float64),
+                "ratios": np.ascontiguousarray(entree["ratio"], dtype=np.float64),
+                "injectes": np.ascontiguousarray(entree["injectés_arr"], dtype=np.float64),
+                "prelevés": np.ascontiguousarray(entree["volume prélevé"], dtype=np.float64),
+                "totaux": np.ascontiguousarray(entree["volume total"], dtype=np.float64),
+                "continu_ok": continu_ok,
+            })
+        _STRUCTURE_CACHE[cle] = structure
+    return _STRUCTURE_CACHE[cle]
+
+# ---------------------- SÉLECTION ----------------------
+def choisir_discontinu(syringes, dose_mg, current_concentration, nb_mes, suivi=None):
+    if numba is None:
+        return engine._choisir_discontinu(syringes, dose_mg, current_concentration, nb_mes, suivi=suivi)
+    structure = _structure(syringes)
+    cles = []
+    for ordre_seringue, s in enumerate(structure):
+        ecart, moyenne, k = _meilleur_discontinu(
+            s["quotients"], s["ratios"], s["injectes"], float(current_concentration), float(dose_mg),
+            float(nb_mes), engine.ANOVA, engine.SIGMA_MES, engine.SIGMA_RATIO)
+        if suivi is not None:
+            suivi(ordre_seringue, s["entree"]["seringue"], len(s["quotients"]) * len(s["injectes"]))
+        if k >= 0:
+            cles.append((ecart, moyenne, ordre_seringue, int(k)))
+    if not cles:
+        return None
+    _, _, ordre_seringue, k = min(cles)
+    return engine._option_discontinu(structure[ordre_seringue]["entree"], k, current_concentration, nb_mes)
+
+def choisir_continu(syringes, dose_mg, current_concentration, etape, volume_injecte, volume_max_prelevé,
+                    suivi=None):
+    if numba is None:
+        return engine._choisir_continu(syringes, dose_mg, current_concentration, etape, volume_injecte,
+                                       volume_max_prelevé, suivi=suivi)
+    structure = _structure(syringes)
+    plafond_prelevé = np.inf if volume_max_prelevé is None else float(volume_max_prelevé)
+    cles = []
+    for ordre_seringue, s in enumerate(structure):
+        if etape >= 1 and s["entree"]["seringue"] < 5:
+            ecart, moyenne, couple = np.inf, np.inf, -1
+        else:
+            ecart, moyenne, couple = _meilleur_continu(
+                s["quotients"], s["ratios"], s["prelevés"], s["totaux"], s["continu_ok"],
+                float(current_concentration), float(dose_mg), etape, float(volume_injecte), plafond_prelevé,
+                engine.ANOVA, engine.SIGMA_MES, engine.SIGMA_RATIO)
+        if suivi is not None:
+            suivi(ordre_seringue, s["entree"]["seringue"], len(s["quotients"]))
+        if couple >= 0:
+            cles.append((ecart, moyenne, ordre_seringue, int(couple)))
+    if not cles:
+        return None
+    _, _, ordre_seringue, couple = min(cles)
+    return engine._option_continu(structure[ordre_seringue]["entree"], couple, current_concentration, etape,
+                                  volume_injecte)
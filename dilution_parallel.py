@@ -0,0 +1,248 @@
+# dilution_parallel.py
+# Exécution multi-cœurs : recherches par seringue et protocoles indépendants
+# répartis sur un pool de processus persistant. L'index des facteurs (lecture
+# seule) est placé une fois dans multiprocessing.shared_memory : les processus
+# s'y rattachent sans copie au démarrage.
+#
+# Un aller-retour vers le pool coûte environ 0,1 ms par tâche, autant que le
+# choix d'une seringue par le moteur « index », et un protocole 1 à 10 ms : le
+# travail est découpé en une tâche par processus, et n'est confié au pool qu'à
+# partir de SERINGUES_MIN_POOL seringues (une étape) ou REQUETES_MIN_POOL
+# protocoles, sur une machine à plusieurs cœurs. Avec deux processus, n
+# seringues coûtent n × 0,05 + 0,1 ms au lieu de n × 0,1 ms : le pool gagne dès
+# 3, et l'inventaire livré (6 seringues) l'atteint. En deçà, le travail est fait
+# dans le processus, au même résultat. Le préchauffage du cache
+# (dilution_cache.prechauffer) confie ses protocoles à generer_protocoles.
+import atexit
+import contextlib
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+
+import dilution_engine as engine
+
+SERINGUES_MIN_POOL = 4
+REQUETES_MIN_POOL = 4
+
+_POOL = None
+_SHM = None
+_CLE_SYRINGES = None
+_NB_PROCESSUS = 1
+_VERROU = threading.Lock()
+_EN_COURS = 0   # utilisations du pool en cours (_utiliser)
+
+# ---------------------- INDEX EN MÉMOIRE PARTAGÉE ----------------------
+def _publier_index(index):
+    """Copie les tableaux de l'index dans un segment partagé ; renvoie (segment, disposition)."""
+    disposition = []
+    taille = 0
+    for entree in index:
+        champs = {}
+        for nom in engine.CHAMPS_INDEX:
+            tableau = entree[nom]
+            taille = -(-taille // 8) * 8  # alignement sur 8 octets
+            champs[nom] = (taille, tableau.dtype.str, tableau.shape)
+            taille += tableau.nbytes
+        disposition.append({"seringue": entree["seringue"], "graduation": entree["graduation"], "champs": champs})
+
+    segment = shared_memory.SharedMemory(create=True, size=max(taille, 1))
+    for entree, meta in zip(index, disposition):
+        for nom, (decalage, dtype, forme) in meta["champs"].items():
+            vue = np.ndarray(forme, dtype=dtype, buffer=segment.buf, offset=decalage)
+            vue[...] = entree[nom]
+    return segment, disposition
+
+def _rattacher_index(segment, disposition):
+    """Reconstruit l'index à partir de vues (sans copie) sur le segment partagé."""
+    index = []
+    for meta in disposition:
+        entree = {"seringue": meta["seringue"], "graduation": meta["graduation"]}
+        for nom, (decalage, dtype, forme) in meta["champs"].items():
+            vue = np.ndarray(forme, dtype=dtype, buffer=segment.buf, offset=decalage)
+            vue.flags.writeable = False
+            entree[nom] = vue
+        entree["injectés"] = entree["injectés_arr"].tolist()
+        index.append(entree)
+    return index
+
+def _initialiser_processus(nom_segment, disposition, cle_syringes):
+    global _SHM
+    _SHM = shared_memory.SharedMemory(name=nom_segment)
+    engine._INDEX_CACHE[cle_syringes] = _rattacher_index(_SHM, disposition)
+
+# ---------------------- POOL PERSISTANT ----------------------
+def _nb_coeurs():
+    return os.cpu_count() or 1
+
+def _demarrer(nb_processus, syringes):
+    global _POOL, _SHM, _CLE_SYRINGES, _NB_PROCESSUS
+    cle = tuple(syringes.items())
+    if _POOL is not None and _CLE_SYRINGES == cle:
+        return _POOL
+    if _EN_COURS:
+        raise RuntimeError("Le pool travaille sur un autre inventaire de seringues : arrêt impossible.")
+    _arreter()
+
+    _SHM, disposition = _publier_index(engine.construire_index(syringes))
+    _CLE_SYRINGES = cle
+    _NB_PROCESSUS = nb_processus or _nb_coeurs()
+    _POOL = ProcessPoolExecutor(
+        max_workers=_NB_PROCESSUS,
+        initializer=_initialiser_processus,
+        initargs=(_SHM.name, disposition, cle),
+    )
+    return _POOL
+
+def _arreter():
+    global _POOL, _SHM, _CLE_SYRINGES
+    if _POOL is not None:
+        _POOL.shutdown(wait=True)
+        _POOL = None
+    if _SHM is not None:
+        _SHM.close()
+        _SHM.unlink()
+        _SHM = None
+    _CLE_SYRINGES = None
+
+def demarrer(nb_processus=None, syringes=engine.SYRINGES):
+    """Démarre (une fois) le pool de processus partageant l'index de syringes.
+
+    Changer d'inventaire remplace le pool ; RuntimeError si des tâches sont en cours.
+    """
+    with _VERROU:
+        return _demarrer(nb_processus, syringes)
+
+def arreter():
+    """Arrête le pool et libère le segment partagé ; RuntimeError si des tâches sont en cours."""
+    with _VERROU:
+        if _EN_COURS:
+            raise RuntimeError("Le pool a des tâches en cours : arrêt impossible.")
+        _arreter()
+
+@contextlib.contextmanager
+def _utiliser(syringes):
+    """Pool de l'inventaire syringes, protégé d'un arrêt ou d'un changement d'inventaire pendant l'usage."""
+    global _EN_COURS
+    with _VERROU:
+        pool = _demarrer(None, syringes)
+        _EN_COURS += 1
+    try:
+        yield pool
+    finally:
+        with _VERROU:
+            _EN_COURS -= 1
+
+def _decouper(elements, nb_lots):
+    """nb_lots tranches contiguës (non vides) de elements."""
+    taille = -(-len(elements) // max(1, min(nb_lots, len(elements))))
+    return [elements[i:i + taille] for i in range(0, len(elements), taille)]
+
+# À la sortie du processus, les threads de tâches sont abandonnés : arrêt sans condition.
+atexit.register(_arreter)
+
+# ---------------------- TÂCHES DES PROCESSUS ----------------------
+def _tache_discontinu(cle_syringes, ordres, dose_mg, current_concentration, nb_mes):
+    resultats = []
+    for ordre_seringue in ordres:
+        entree = engine._INDEX_CACHE[cle_syringes][ordre_seringue]
+        borne = engine._borne_discontinu(entree, dose_mg, current_concentration, nb_mes)
+        resultats.append(engine._meilleur_discontinu_seringue(entree, ordre_seringue, dose_mg,
+                                                              current_concentration, nb_mes, borne))
+    return resultats
+
+def _tache_continu(cle_syringes, ordres, dose_mg, current_concentration, etape, volume_injecte,
+                   volume_max_prelevé):
+    contexte = (dose_mg, current_concentration, etape, volume_injecte, volume_max_prelevé)
+    resultats = []
+    for ordre_seringue in ordres:
+        entree = engine._INDEX_CACHE[cle_syringes][ordre_seringue]
+        borne = engine._borne_continu(entree, *contexte)
+        resultats.append(engine._meilleur_continu_seringue(entree, ordre_seringue, *contexte, borne))
+    return resultats
+
+def _tache_protocole(mode, args, kwargs):
+    if kwargs.get("moteur") == "parallele":
+        # Déjà dans un processus du pool : le moteur « index » rend le même protocole.
+        kwargs = dict(kwargs, moteur="index")
+    if mode == "Continu":
+        return engine.generate_dilution_steps_continu(*args, **kwargs)
+    return engine.generate_dilution_steps_discontinu(*args, **kwargs)
+
+def _tache_protocoles(lot):
+    return [_tache_protocole(*requete) for requete in lot]
+
+# ---------------------- MOTEUR « parallele » ----------------------
+# Chaque processus renvoie le meilleur local de chacune de ses seringues (borne
+# locale, donc au moins aussi large que la borne globale) ; le parent fusionne
+# par min(), avec le même départage que le moteur séquentiel.
+
+def _par_pool(syringes):
+    return _nb_coeurs() > 1 and len(syringes) >= SERINGUES_MIN_POOL
+
+def _recolter(futures, index, suivi):
+    cles = []
+    ordre_seringue = 0
+    for future in futures:
+        for cle, nb in future.result():
+            if suivi is not None:
+                suivi(ordre_seringue, index[ordre_seringue]["seringue"], nb)
+            if cle is not None:
+                cles.append(cle)
+            ordre_seringue += 1
+    return cles
+
+def choisir_discontinu(syringes, dose_mg, current_concentration, nb_mes, suivi=None):
+    if not _par_pool(syringes):
+        return engine._choisir_discontinu(syringes, dose_mg, current_concentration, nb_mes, suivi=suivi)
+    index = engine.construire_index(syringes)
+    with _utiliser(syringes) as pool:
+        futures = [pool.submit(_tache_discontinu, _CLE_SYRINGES, lot, dose_mg, current_concentration, nb_mes)
+                   for lot in _decouper(list(range(len(index))), _NB_PROCESSUS)]
+        cles = _recolter(futures, index, suivi)
+    if not cles:
+        return None
+    _, _, ordre_seringue, k = min(cles)
+    return engine._option_discontinu(index[ordre_seringue], k, current_concentration, nb_mes)
+
+def choisir_continu(syringes, dose_mg, current_concentration, etape, volume_injecte, volume_max_prelevé,
+                    suivi=None):
+    if not _par_pool(syringes):
+        return engine._choisir_continu(syringes, dose_mg, current_concentration, etape, volume_injecte,
+                                       volume_max_prelevé, suivi=suivi)
+    index = engine.construire_index(syringes)
+    with _utiliser(syringes) as pool:
+        futures = [pool.submit(_tache_continu, _CLE_SYRINGES, lot, dose_mg, current_concentration, etape,
+                               volume_injecte, volume_max_prelevé)
+                   for lot in _decouper(list(range(len(index))), _NB_PROCESSUS)]
+        cles = _recolter(futures, index, suivi)
+    if not cles:
+        return None
+    _, _, ordre_seringue, couple = min(cles)
+    return engine._option_continu(index[ordre_seringue], couple, current_concentration, etape, volume_injecte)
+
+def generer_protocoles(requetes, syringes=engine.SYRINGES):
+    """Calcule des protocoles indépendants, en parallèle à partir de REQUETES_MIN_POOL requêtes.
+
+    requetes : itérable de (mode, dose_mg, concentration_init) ou
+    (mode, dose_mg, concentration_init, kwargs), mode valant "Continu" ou "Discontinu".
+    Les résultats sont renvoyés dans l'ordre des requêtes.
+    """
+    taches = []
+    for requete in requetes:
+        mode, dose_mg, concentration_init, *reste = requete
+        kwargs = dict(reste[0]) if reste else {}
+        kwargs["syringes"] = syringes
+        taches.append((mode, (dose_mg, concentration_init), kwargs))
+    if _nb_coeurs() == 1 or len(taches) < REQUETES_MIN_POOL:
+        return _tache_protocoles(taches)
+    return _protocoles_en_pool(taches, syringes)
+
+def _protocoles_en_pool(taches, syringes):
+    with _utiliser(syringes) as pool:
+        # Lots entrelacés : les requêtes lentes se répartissent entre les processus.
+        futures = [pool.submit(_tache_protocoles, taches[debut::_NB_PROCESSUS]) for debut in range(_NB_PROCESSUS)]
+        lots = [f.result() for f in futures]
+    return [lots[i % _NB_PROCESSUS][i // _NB_PROCESSUS] for i in range(len(taches))]
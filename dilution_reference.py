@@ -0,0 +1,225 @@
+# dilution_reference.py
+# Boucles d'origine de code_correction.py (avant l'index des facteurs),
+# conservées telles quelles comme référence pour fuzz_dilution.py.
+# Volontairement lentes : ne pas optimiser ce fichier.
+import numpy as np
+
+from dilution_engine import (SYRINGES, arrondir_volume, calculer_ecart_type, calculer_IC,
+                             calculer_moyenne_precision, est_mesurable)
+
+# ---------------------- MODE DISCONTINU (LOGIQUE MODIFIÉE) ----------------------
+def generate_dilution_steps_discontinu(dose_mg, concentration_init, syringes=SYRINGES):
+    current_concentration = concentration_init
+    steps = []
+    cible_min = dose_mg - 1.0
+    cible_max = dose_mg + 1.0
+    is_first_step = True
+    etape_compteur = 1
+
+    for etape in range(5):
+        meilleures_options = []
+        for syringe_volume, graduation in syringes.items():
+            vol_prelevables = np.arange(graduation, syringe_volume + 0.01, graduation)
+            for volume_prelevé in vol_prelevables:
+                if volume_prelevé < 2 * graduation:
+                    continue
+                if not est_mesurable(volume_prelevé, graduation):
+                    continue
+                if (volume_prelevé / syringe_volume) * 100 < 30:
+                    continue
+
+                max_ajout = syringe_volume - volume_prelevé
+                for vol_ajouté in np.arange(0, max_ajout + 0.01, graduation):
+                    volume_total = round(volume_prelevé + vol_ajouté, 2)
+                    if volume_total > syringe_volume:
+                        continue
+                    if not est_mesurable(volume_total, graduation):
+                        continue
+                    ratio = round((volume_total / syringe_volume) * 100, 2)
+                    if ratio < 30:
+                        continue
+
+                    new_concentration = round(current_concentration * (volume_prelevé / volume_total), 2)
+
+                    for volume_injecte in np.arange(graduation, syringe_volume + 0.01, graduation):
+                        volume_injecte = arrondir_volume(volume_injecte, graduation)
+                        if volume_injecte > syringe_volume:
+                            continue
+
+                        dose = round(new_concentration * volume_injecte, 2)
+                        if dose > dose_mg + 1.5:
+                            continue
+
+                        moyenne_precision = calculer_moyenne_precision(dose, etape_compteur, ratio)
+                        ecart_type = calculer_ecart_type(dose, etape_compteur, ratio)
+                        ic_inf, ic_sup = calculer_IC(moyenne_precision, ecart_type)
+
+                        option = {
+                            "étape": etape_compteur,
+                            "seringue": syringe_volume,
+                            "volume prélevé": volume_prelevé,
+                            "volume ajouté": round(vol_ajouté, 2),
+                            "volume total": volume_total,
+                            "ratio": ratio,
+                            "concentration finale": new_concentration,
+                            "dose obtenue": dose,
+                            "volume injecté": volume_injecte,
+                            "moyenne_precision": moyenne_precision,
+                            "ecart_type": ecart_type,
+                            "IC": (ic_inf, ic_sup)
+                        }
+
+                        
+
+                        meilleures_options.append(option)
+
+        meilleures_options = sorted(meilleures_options, key=lambda x: (abs(x['dose obtenue'] - dose_mg), x['moyenne_precision']))
+
+        if not meilleures_options:
+            break
+
+        meilleure = meilleures_options[0]
+
+        if is_first_step and meilleure['volume ajouté'] != 0.0:
+            etape_virtuelle = {
+                "type": "virtuelle",
+                "étape": 1,
+                "seringue": meilleure['seringue'],
+                "volume prélevé": meilleure['volume prélevé'],
+                "volume ajouté": 0.0,
+                "ratio": round((meilleure['volume prélevé'] / meilleure['seringue']) * 100, 2),
+                "concentration": concentration_init,
+                
+            }
+            steps.append(etape_virtuelle)
+            meilleure['étape'] = 2
+            etape_compteur += 1
+
+        meilleure["type"] = "réelle"
+        steps.append(meilleure)
+        etape_compteur += 1
+        is_first_step = False
+
+        if cible_min <= meilleure['dose obtenue'] <= cible_max:
+            break
+
+        current_concentration = meilleure['concentration finale']
+
+    if steps:
+        for step in reversed(steps):
+            if step.get("type") == "réelle":
+                derniere = step
+                break
+        steps.append({
+            "type": "metriques",
+            "moyenne_precision": derniere['moyenne_precision'],
+            "ecart_type": derniere['ecart_type'],
+            "IC": derniere['IC']
+        })
+
+    return steps
+
+
+# ---------------------- MODE CONTINU (LOGIQUE MODIFIÉE) ----------------------
+def generate_dilution_steps_continu(dose_mg, concentration_init, nb_hours=24, debit_mlh=0.1, syringes=SYRINGES):
+    current_concentration = concentration_init
+    steps = []
+    cible_min = dose_mg - 1.0
+    cible_max = dose_mg + 1.0
+    volume_injecte = round(debit_mlh * nb_hours, 2)
+    affichage_etapes = []
+    derniere_etape = None
+
+    for etape in range(5):
+        meilleures_options = []
+        for syringe_volume, graduation in syringes.items():
+            vol_prelevables = np.arange(graduation, syringe_volume + 0.01, graduation)
+            for volume_prelevé in vol_prelevables:
+                if volume_prelevé < 2 * graduation:
+                    continue
+                if not est_mesurable(volume_prelevé, graduation):
+                    continue
+                if (volume_prelevé / syringe_volume) * 100 < 30:
+                    continue
+                if steps and volume_prelevé > steps[-1]['volume total']:
+                    continue
+
+                max_ajout = syringe_volume - volume_prelevé
+                for vol_ajouté in np.arange(0, max_ajout + 0.01, graduation):
+                    volume_total = round(volume_prelevé + vol_ajouté, 2)
+                    if volume_total > syringe_volume:
+                        continue
+                    if not est_mesurable(volume_total, graduation):
+                        continue
+                    if (volume_total / syringe_volume) * 100 < 30:
+                        continue
+                    if etape >= 1 and volume_total < volume_injecte:
+                        continue
+                    if etape >= 1 and syringe_volume < 5:
+                        continue
+
+                    new_concentration = round(current_concentration * (volume_prelevé / volume_total), 2)
+                    dose = round(new_concentration * volume_injecte, 2)
+                    ratio_ser = round((volume_total / syringe_volume) * 100, 2)
+                    moyenne_precision = calculer_moyenne_precision(dose, etape + 1, ratio_ser)
+                    ecart_type = calculer_ecart_type(dose, etape + 1, ratio_ser)
+                    ic_inf, ic_sup = calculer_IC(moyenne_precision, ecart_type)
+
+                    option = {
+                        "étape": etape + 1,
+                        "seringue": syringe_volume,
+                        "volume prélevé": volume_prelevé,
+                        "volume ajouté": round(vol_ajouté, 2),
+                        "volume total": volume_total,
+                        "ratio": ratio_ser,
+                        "concentration": new_concentration,
+                        "dose": dose,
+                        "moyenne_precision": moyenne_precision,
+                        "ecart_type": ecart_type,
+                        "IC": (ic_inf, ic_sup)
+                    }
+
+                    meilleures_options.append(option)
+
+        meilleures_options = sorted(meilleures_options, key=lambda x: (abs(x['dose'] - dose_mg), x['moyenne_precision']))
+
+        if not meilleures_options:
+            break
+
+        meilleure = meilleures_options[0]
+
+        if meilleure['volume ajouté'] != 0:
+            ratio_virtuel = round((meilleure['volume prélevé'] / meilleure['seringue']) * 100, 2)
+            concentration_virtuelle = (meilleure['volume total'] * meilleure['concentration']) / meilleure['volume prélevé']
+            concentration_virtuelle = round(concentration_virtuelle + 1e-3, 2)
+            dose_obtenue = round(concentration_virtuelle * volume_injecte, 2)
+            etape_virtuelle = {
+                "type": "virtuelle",
+                "seringue": meilleure['seringue'],
+                "volume prélevé": meilleure['volume prélevé'],
+                "ratio": ratio_virtuel,
+                "concentration": concentration_virtuelle,
+                "dose": dose_obtenue
+            }
+            affichage_etapes.append(etape_virtuelle)
+
+        meilleure["type"] = "réelle"
+        steps.append(meilleure)
+        affichage_etapes.append(meilleure)
+        derniere_etape = meilleure
+
+        if cible_min <= meilleure['dose'] <= cible_max:
+            break
+
+        current_concentration = meilleure['concentration']
+
+    if derniere_etape:
+        affichage_etapes.append({
+            "type": "metriques",
+            "moyenne_precision": derniere_etape['moyenne_precision'],
+            "ecart_type": derniere_etape['ecart_type'],
+            "IC": derniere_etape['IC']
+        })
+
+    return affichage_etapes
+
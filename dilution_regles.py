@@ -0,0 +1,139 @@
+# dilution_regles.py
+# Règles de préparation déclaratives, par médicament et par site.
+#
+# Les contraintes de base (prélevé ≥ 2 graduations, ratio ≥ 30 %, total ≤
+# seringue...) sont celles de l'index des seringues. Un site ajoute les siennes
+# dans un fichier JSON, sans toucher aux boucles :
+#
+#   {"jeux": [
+#     {"medicament": "*", "site": "neonatologie", "regles": [
+#       {"champ": "volume total", "op": ">=", "valeur": 0.8},
+#       {"champ": "volume injecté", "op": "<=", "champ_ref": "volume total"},
+#       {"champ": "volume prélevé", "op": ">=", "champ_ref": "graduation", "facteur": 5},
+#       {"champ": "seringue", "op": ">=", "valeur": 5, "etape_min": 2}
+#     ]},
+#     {"medicament": "vancomycine", "site": "*", "regles": [...]}
+#   ]}
+#
+# Une règle compare un champ du candidat à une valeur, ou à un autre champ
+# multiplié par facteur ; etape_min la réserve aux étapes de ce numéro et au-delà.
+# Chaque jeu de règles est compilé une fois, pour chaque seringue, en un masque
+# booléen sur la grille des candidats (couples × volumes injectés en discontinu,
+# couples en continu) ; l'index restreint ne garde que les candidats admis.
+import json
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+import dilution_engine as engine
+
+CHAMPS = ("seringue", "graduation", "volume prélevé", "volume ajouté", "volume total", "ratio", "volume injecté")
+
+# Les volumes de la grille sont des multiples flottants des graduations (0.30000000000000004).
+TOLERANCE = 1e-9
+
+OPERATEURS = {
+    ">=": lambda a, b: a >= b - TOLERANCE,
+    "<=": lambda a, b: a <= b + TOLERANCE,
+    ">": lambda a, b: a > b + TOLERANCE,
+    "<": lambda a, b: a < b - TOLERANCE,
+    "==": lambda a, b: np.abs(a - b) <= TOLERANCE,
+    "!=": lambda a, b: np.abs(a - b) > TOLERANCE,
+}
+
+# Index restreints les plus récemment servis, par (règles actives, inventaire, mode,
+# volume injecté) ; chacun copie les pointeurs de l'index : le cache est borné.
+TAILLE_MAX_RESTREINTS = 16
+_INDEX_RESTREINTS = OrderedDict()
+_VERROU = threading.Lock()
+
+# ---------------------- CHARGEMENT ----------------------
+def verifier(regles):
+    """Lève ValueError si une règle est mal formée ; renvoie regles."""
+    for regle in regles:
+        if regle.get("champ") not in CHAMPS:
+            raise ValueError(f"Champ de règle inconnu : {regle.get('champ')!r} (attendu : {', '.join(CHAMPS)}).")
+        if regle.get("op") not in OPERATEURS:
+            raise ValueError(f"Opérateur de règle inconnu : {regle.get('op')!r}.")
+        if ("valeur" in regle) == ("champ_ref" in regle):
+            raise ValueError(f"La règle {regle!r} doit donner soit valeur, soit champ_ref.")
+        if "champ_ref" in regle and regle["champ_ref"] not in CHAMPS:
+            raise ValueError(f"Champ de référence inconnu : {regle['champ_ref']!r}.")
+    return regles
+
+def selectionner_regles(config, medicament=None, site=None):
+    """Règles des jeux de config applicables à medicament et site ("*" : tous)."""
+    regles = []
+    for jeu in config.get("jeux", []):
+        if jeu.get("medicament", "*") not in ("*", medicament):
+            continue
+        if jeu.get("site", "*") not in ("*", site):
+            continue
+        regles.extend(jeu.get("regles", []))
+    return verifier(regles)
+
+def charger_regles(chemin, medicament=None, site=None):
+    with open(chemin, encoding="utf-8") as fichier:
+        return selectionner_regles(json.load(fichier), medicament, site)
+
+# ---------------------- COMPILATION ----------------------
+def _colonnes(entree, mode, volume_injecte):
+    """Champs des candidats d'une seringue, un élément par point de la grille."""
+    nb_couples = len(entree["quotients"])
+    if mode == "Discontinu":
+        nb_inj = len(entree["injectés"])
+        couples = np.repeat(np.arange(nb_couples), nb_inj)
+        injectes = entree["injectés_arr"][np.tile(np.arange(nb_inj), nb_couples)]
+    else:
+        couples = np.arange(nb_couples)
+        injectes = np.full(nb_couples, float(volume_injecte))
+    return {
+        "seringue": np.full(len(couples), float(entree["seringue"])),
+        "graduation": np.full(len(couples), float(entree["graduation"])),
+        "volume prélevé": entree["volume prélevé"][couples],
+        "volume ajouté": entree["volume ajouté"][couples],
+        "volume total": entree["volume total"][couples],
+        "ratio": entree["ratio"][couples],
+        "volume injecté": injectes,
+    }
+
+def compiler(regles, entree, mode, volume_injecte=None):
+    """Masque des candidats admis par toutes les règles (une passe vectorielle par règle)."""
+    colonnes = _colonnes(entree, mode, volume_injecte)
+    masque = np.ones(len(colonnes["seringue"]), dtype=bool)
+    for regle in regles:
+        reference = (colonnes[regle["champ_ref"]] * regle.get("facteur", 1) if "champ_ref" in regle
+                     else regle["valeur"])
+        masque &= OPERATEURS[regle["op"]](colonnes[regle["champ"]], reference)
+    return masque
+
+def _restreindre(entree, masque, mode):
+    restreinte = dict(entree)
+    if mode == "Discontinu":
+        gardes = masque[entree["pointeurs"]]
+        restreinte["pointeurs"] = entree["pointeurs"][gardes]
+        restreinte["facteurs"] = entree["facteurs"][gardes]
+    else:
+        gardes = masque[entree["pointeurs_continu"]]
+        restreinte["pointeurs_continu"] = entree["pointeurs_continu"][gardes]
+        restreinte["quotients_continu"] = entree["quotients_continu"][gardes]
+    return restreinte
+
+def index_restreint(regles, syringes, mode, etape, volume_injecte=None):
+    """Index de syringes limité aux candidats admis par les règles actives à l'étape etape."""
+    actives = [regle for regle in regles if regle.get("etape_min", 1) <= etape]
+    cle = (json.dumps(actives, sort_keys=True), tuple(syringes.items()), mode,
+           volume_injecte if mode == "Continu" else None)
+    with _VERROU:
+        index = _INDEX_RESTREINTS.get(cle)
+        if index is not None:
+            _INDEX_RESTREINTS.move_to_end(cle)
+            return index
+    index = [_restreindre(entree, compiler(actives, entree, mode, volume_injecte), mode)
+             for entree in engine.construire_index(syringes)]
+    with _VERROU:
+        _INDEX_RESTREINTS[cle] = index
+        while len(_INDEX_RESTREINTS) > TAILLE_MAX_RESTREINTS:
+            _INDEX_RESTREINTS.popitem(last=False)
+    return index
@@ -0,0 +1,256 @@
+# dilution_taches.py
+# Calcul d'un protocole en tâche de fond, avec progression et annulation,
+# pour que l'interface Streamlit ne reste pas bloquée pendant la recherche.
+#
+# Une tâche simple tourne dans un thread. Les deux recherches d'une comparaison
+# (lancer_comparaison) sont confiées à un pool de deux processus, que le GIL ne
+# sérialise pas ; un thread par tâche relaie seulement la progression et les
+# étapes reçues du processus.
+import multiprocessing
+import queue
+import threading
+import time
+from concurrent.futures import CancelledError, ProcessPoolExecutor
+
+import dilution_audit
+import dilution_cache
+import dilution_engine as engine
+import dilution_metriques as metriques
+
+_POOL = None
+_GESTIONNAIRE = None
+_VERROU = threading.Lock()
+_SESSIONS = {}   # dans un processus du pool : une session par mode, gardée d'une comparaison à l'autre
+_OCCUPEES = {}   # id(session) -> thread de la dernière tâche lancée sur cette session
+
+def lancer_calcul(mode, dose_mg, concentration_init, journal=None, cache=None, **kwargs):
+    """Démarre la recherche dans un thread et renvoie l'état de la tâche.
+
+    L'état est un dict partagé avec le thread : "progression" (étape, seringue,
+    candidats évalués, fraction), "etapes" (étapes déjà choisies, complétée au
+    fur et à mesure), puis "resultat" ou "erreur" une fois terminé.
+    Si journal est donné, le protocole obtenu y est enregistré (dilution_audit) ;
+    si cache est donné, il est d'abord cherché dans le cache persistant (dilution_cache).
+    """
+    tache = _nouvelle_tache(mode, dose_mg, concentration_init)
+
+    def progression(infos):
+        if tache["annulation"].is_set():
+            raise engine.CalculAnnule()
+        tache["progression"] = infos
+
+    def executer():
+        try:
+            _reserver_session(kwargs.get("session"))
+            for step in _etapes(mode, dose_mg, concentration_init, cache, progression, kwargs):
+                # list.append est atomique : l'interface lit les étapes pendant le calcul.
+                tache["etapes"].append(step)
+            tache["resultat"] = list(tache["etapes"])
+            tache["duree"] = time.perf_counter() - tache["debut"]
+        except engine.CalculAnnule:
+            tache["annulee"] = True
+            return
+        except Exception as erreur:
+            tache["erreur"] = erreur
+            return
+        finally:
+            _liberer_session(kwargs.get("session"))
+        _journaliser(journal, mode, dose_mg, concentration_init, tache["resultat"], kwargs)
+
+    tache["thread"] = threading.Thread(target=executer, name="calcul-dilution", daemon=True)
+    tache["thread"].start()
+    return tache
+
+def _reserver_session(session):
+    """Attend la tâche précédente de session (annulée, elle s'arrête au prochain point de progression).
+
+    annuler() n'attend qu'une seconde : sans cela, la nouvelle tâche modifierait les tables
+    de la session en même temps qu'elle. Appelé dans le thread de la nouvelle tâche.
+    """
+    if session is None:
+        return
+    with _VERROU:
+        precedente = _OCCUPEES.get(id(session))
+        _OCCUPEES[id(session)] = threading.current_thread()
+    if precedente is not None:
+        precedente.join()
+
+def _liberer_session(session):
+    if session is not None:
+        with _VERROU:
+            if _OCCUPEES.get(id(session)) is threading.current_thread():
+                del _OCCUPEES[id(session)]
+
+def _nouvelle_tache(mode, dose_mg, concentration_init):
+    return {
+        "parametres": (mode, dose_mg, concentration_init),
+        "annulation": threading.Event(),
+        "progression": {"étape": 0, "seringue": None, "candidats": 0, "fraction": 0.0},
+        "etapes": [],
+        "resultat": None,
+        "erreur": None,
+        "annulee": False,
+        "debut": time.perf_counter(),
+        "duree": None,
+    }
+
+def _etapes(mode, dose_mg, concentration_init, cache, progression, kwargs):
+    if cache is not None:
+        return dilution_cache.iterer(cache, mode, dose_mg, concentration_init, progression=progression, **kwargs)
+    if mode == "Continu":
+        return engine.iterer_dilution_steps_continu(dose_mg, concentration_init, progression=progression, **kwargs)
+    return engine.iterer_dilution_steps_discontinu(dose_mg, concentration_init, progression=progression, **kwargs)
+
+def _journaliser(journal, mode, dose_mg, concentration_init, resultat, kwargs):
+    if journal is not None:
+        parametres = {k: v for k, v in kwargs.items() if k in ("nb_hours", "debit_mlh")}
+        dilution_audit.enregistrer(journal, mode, dose_mg, concentration_init, resultat,
+                                   parametres=parametres, moteur=kwargs.get("moteur", "index"))
+
+# ---------------------- COMPARAISON EN PROCESSUS ----------------------
+def _pool():
+    """Pool de deux processus et gestionnaire des files de progression, créés au premier appel.
+
+    Les processus sont lancés par spawn : un fork du serveur Streamlit, qui a
+    plusieurs threads, peut hériter d'un verrou pris.
+    """
+    global _POOL, _GESTIONNAIRE
+    with _VERROU:
+        if _POOL is None:
+            contexte = multiprocessing.get_context("spawn")
+            _GESTIONNAIRE = contexte.Manager()
+            _POOL = ProcessPoolExecutor(max_workers=2, mp_context=contexte)
+    return _POOL, _GESTIONNAIRE
+
+def _calculer_en_processus(mode, dose_mg, concentration_init, cache, file, annulation, kwargs):
+    """Recherche exécutée dans un processus du pool ; progression et étapes passent par file."""
+    def progression(infos):
+        if annulation.is_set():
+            raise engine.CalculAnnule()
+        file.put(("progression", infos))
+
+    if kwargs.get("regles") is None and kwargs.get("session") is None:
+        kwargs = dict(kwargs, session=_SESSIONS.setdefault(mode, engine.nouvelle_session()))
+    avant = metriques.instantane()
+    try:
+        resultat = []
+        for step in _etapes(mode, dose_mg, concentration_init, cache, progression, kwargs):
+            resultat.append(step)
+            file.put(("etape", step))
+        return resultat
+    finally:
+        # Métriques de cette recherche, versées dans celles du processus de l'interface.
+        file.put(("metriques", {cle: [v - a for v, a in zip(serie, avant.get(cle, [0] * len(serie)))]
+                                for cle, serie in metriques.instantane().items()}))
+
+def _lancer_en_processus(mode, dose_mg, concentration_init, journal, cache, kwargs):
+    """Comme lancer_calcul, mais la recherche tourne dans un processus du pool."""
+    pool, gestionnaire = _pool()
+    tache = _nouvelle_tache(mode, dose_mg, concentration_init)
+    file, annulation = gestionnaire.Queue(), gestionnaire.Event()
+    futur = pool.submit(_calculer_en_processus, mode, dose_mg, concentration_init, cache, file, annulation, kwargs)
+
+    def relayer(message):
+        nature, valeur = message
+        if nature == "progression":
+            tache["progression"] = valeur
+        elif nature == "metriques":
+            metriques.verser(valeur)
+        else:
+            tache["etapes"].append(valeur)
+
+    def suivre():
+        while True:
+            if tache["annulation"].is_set():
+                futur.cancel()
+                annulation.set()
+            try:
+                relayer(file.get(timeout=0.05))
+            except queue.Empty:
+                if futur.done():
+                    break
+        while not file.empty():
+            relayer(file.get())
+        try:
+            tache["resultat"] = futur.result()
+            tache["duree"] = time.perf_counter() - tache["debut"]
+        except (engine.CalculAnnule, CancelledError):
+            tache["annulee"] = True
+            return
+        except Exception as erreur:
+            tache["erreur"] = erreur
+            return
+        _journaliser(journal, mode, dose_mg, concentration_init, tache["resultat"], kwargs)
+
+    tache["thread"] = threading.Thread(target=suivre, name="suivi-dilution", daemon=True)
+    tache["thread"].start()
+    return tache
+
+def lancer_comparaison(dose_mg, concentration_init, journal=None, cache=None, nb_hours=24, debit_mlh=0.1, **kwargs):
+    """Lance les recherches continue et discontinue en même temps : {mode: tâche}.
+
+    Chaque recherche tourne dans un processus du pool (même état que lancer_calcul,
+    relayé par un thread). Sur au moins deux cœurs, la comparaison est prête au
+    bout de la plus lente des deux, plus l'aller-retour vers le pool ; sur un seul
+    cœur, au bout de leur somme. Chaque processus garde une session par mode ; les
+    métriques de ses recherches sont reversées dans dilution_metriques.
+    """
+    taches = {}
+    for mode in ("Continu", "Discontinu"):
+        options = dict(kwargs)
+        if mode == "Continu":
+            options.update(nb_hours=nb_hours, debit_mlh=debit_mlh)
+        taches[mode] = _lancer_en_processus(mode, dose_mg, concentration_init, journal, cache, options)
+    return taches
+
+def _lancer_en_fond(nom, parametres, calculer):
+    """Exécute calculer() dans un thread ; même état que lancer_calcul, sans progression.
+
+    annuler() n'interrompt pas le calcul : l'interface abandonne simplement la tâche.
+    """
+    tache = {
+        "parametres": parametres,
+        "annulation": threading.Event(),
+        "resultat": None,
+        "erreur": None,
+        "annulee": False,
+        "debut": time.perf_counter(),
+        "duree": None,
+    }
+
+    def executer():
+        try:
+            tache["resultat"] = calculer()
+            tache["duree"] = time.perf_counter() - tache["debut"]
+        except Exception as erreur:
+            tache["erreur"] = erreur
+
+    tache["thread"] = threading.Thread(target=executer, name=nom, daemon=True)
+    tache["thread"].start()
+    return tache
+
+def lancer_couverture(concentration_init, **kwargs):
+    """Calcule couverture_doses (dilution_engine) dans un thread (voir _lancer_en_fond)."""
+    return _lancer_en_fond("couverture-dilution", (concentration_init,),
+                           lambda: engine.couverture_doses(concentration_init, **kwargs))
+
+def lancer_sensibilite(parametres, mode, dose_mg, concentration_init, **kwargs):
+    """Calcule analyser_sensibilite (dilution_engine) dans un thread (voir _lancer_en_fond).
+
+    parametres : ce qui identifie l'analyse pour l'interface (protocole analysé, options).
+    """
+    return _lancer_en_fond("sensibilite-dilution", parametres,
+                           lambda: engine.analyser_sensibilite(mode, dose_mg, concentration_init, **kwargs))
+
+def est_terminee(tache):
+    return not tache["thread"].is_alive()
+
+def attendre(tache, delai=None):
+    """Attend la fin de la tâche ; renvoie True si elle est terminée."""
+    tache["thread"].join(delai)
+    return est_terminee(tache)
+
+def annuler(tache, delai=1.0):
+    """Demande l'arrêt de la tâche au prochain point de progression et l'attend."""
+    tache["annulation"].set()
+    return attendre(tache, delai)
@@ -0,0 +1,197 @@
+# dosage.py
+# Interface en ligne de commande : un protocole par appel, résultat en JSON.
+#
+#   python dosage.py discontinu --dose 5 --concentration 100
+#   python dosage.py continu --dose 5 --concentration 100 --heures 24 --debit 0.1
+#   python dosage.py poids --poids 3 --dose-kg 10 --concentration 5
+#   python dosage.py precompiler
+#   python dosage.py nomogramme --csv nomogramme.csv
+#   python dosage.py --cache protocoles_cache.sqlite --journal protocoles.log prechauffer
+#
+# Le temps de démarrage domine quand un logiciel de prescription appelle cette
+# commande à chaque ordonnance : ni Streamlit ni fpdf ne sont importés, le moteur
+# n'est importé que par la sous-commande qui en a besoin, et l'index des
+# seringues est chargé depuis un fichier précompilé au lieu d'être reconstruit.
+import json
+import os
+import sys
+import time
+
+LATTICE_PAR_DEFAUT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "syringes_lattice.npy")
+NOMOGRAMME_PAR_DEFAUT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "nomogramme_poids.npz")
+
+def _en_json(valeur):
+    # Scalaires numpy (np.float64...) : conversion en nombres Python.
+    if hasattr(valeur, "item"):
+        return valeur.item()
+    raise TypeError(f"type non sérialisable : {type(valeur).__name__}")
+
+def _preparer_index(chemin):
+    import dilution_engine as engine
+    if engine.charger_index(chemin) is None:
+        engine.construire_index()
+        try:
+            engine.sauvegarder_index(chemin)
+        except OSError:
+            pass
+    return engine
+
+def _protocole(args):
+    engine = _preparer_index(args.lattice)
+    regles = None
+    if args.regles:
+        import dilution_regles
+        regles = dilution_regles.charger_regles(args.regles, args.medicament, args.site)
+    options = {"delai": args.delai, "classement": args.classement, "regles": regles}
+    if args.commande == "continu":
+        options.update(nb_hours=args.heures, debit_mlh=args.debit)
+    if args.cache:
+        import dilution_cache
+        mode = "Continu" if args.commande == "continu" else "Discontinu"
+        etapes = dilution_cache.generer(dilution_cache.ouvrir(args.cache), mode, args.dose, args.concentration,
+                                        **options)
+    elif args.commande == "continu":
+        etapes = engine.generate_dilution_steps_continu(args.dose, args.concentration, **options)
+    else:
+        etapes = engine.generate_dilution_steps_discontinu(args.dose, args.concentration, **options)
+    resultat = {"mode": args.commande, "dose_mg": args.dose, "concentration": args.concentration, "etapes": etapes}
+    if args.sensibilite:
+        mode = "Continu" if args.commande == "continu" else "Discontinu"
+        options = {"nb_hours": args.heures, "debit_mlh": args.debit} if args.commande == "continu" else {}
+        resultat["sensibilite"] = engine.analyser_sensibilite(mode, args.dose, args.concentration, etapes=etapes,
+                                                              rechercher=True, regles=regles,
+                                                              classement=args.classement, delai=args.delai,
+                                                              **options)
+    if args.journal:
+        import dilution_audit
+        mode = "Continu" if args.commande == "continu" else "Discontinu"
+        parametres = {"nb_hours": args.heures, "debit_mlh": args.debit} if args.commande == "continu" else {}
+        dilution_audit.enregistrer(args.journal, mode, args.dose, args.concentration, etapes, parametres=parametres)
+    return resultat
+
+def _poids(args):
+    import dosage_poids
+    resultat = None
+    if args.volume_final is None:
+        nomogramme = dosage_poids.charger_nomogramme(args.nomogramme)
+        if nomogramme is not None:
+            resultat = dosage_poids.consulter(nomogramme, args.poids, args.dose_kg, args.concentration)
+    if resultat is None:
+        resultat = dosage_poids.optimize_dosage(args.poids, args.dose_kg, args.concentration, args.volume_final)
+    best, volume_necessaire, attendue = resultat
+    nb_mes, ratio_ser, seringue, moyenne, ecart_type, volume_manipule = best
+    return {
+        "poids": args.poids,
+        "dose_kg": args.dose_kg,
+        "concentration": args.concentration,
+        "dose_attendue": attendue,
+        "volume_necessaire": volume_necessaire,
+        "NbMes": nb_mes,
+        "RatioSer": ratio_ser,
+        "seringue": seringue,
+        "moyenne": moyenne,
+        "ecart_type": ecart_type,
+        "volume_manipule": volume_manipule,
+        "IC": dosage_poids.calculate_confidence_interval(moyenne, ecart_type),
+    }
+
+def _precompiler(args):
+    import dilution_engine as engine
+    engine.sauvegarder_index(args.lattice)
+    return {"lattice": args.lattice}
+
+def _nomogramme(args):
+    import dosage_poids
+    nomogramme = dosage_poids.construire_nomogramme()
+    dosage_poids.sauvegarder_nomogramme(args.nomogramme, nomogramme)
+    if args.csv:
+        dosage_poids.exporter_csv(nomogramme, args.csv)
+    return {"nomogramme": args.nomogramme, "csv": args.csv, "points": int(nomogramme["choix"].size)}
+
+def _prechauffer(args):
+    import dilution_cache
+    _preparer_index(args.lattice)
+    cache = dilution_cache.ouvrir(args.cache)
+    depuis = time.time() - args.jours * 86400 if args.jours else None
+    regles = None
+    if args.regles:
+        import dilution_regles
+        regles = dilution_regles.charger_regles(args.regles, args.medicament, args.site)
+    calcules = dilution_cache.prechauffer(cache, args.journal, args.nombre, depuis, regles)
+    return dict(dilution_cache.statistiques(cache), calcules=calcules)
+
+def construire_parser():
+    import argparse
+    parser = argparse.ArgumentParser(prog="dosage", description="Protocoles de dilution et dosage au poids (JSON).")
+    parser.add_argument("--lattice", default=LATTICE_PAR_DEFAUT, help="index précompilé des seringues (.npy)")
+    parser.add_argument("--journal", default=os.environ.get("DOSAGE_JOURNAL"),
+                        help="journal de pharmacovigilance où enregistrer le protocole")
+    parser.add_argument("--cache", default=os.environ.get("DOSAGE_CACHE"),
+                        help="cache persistant des protocoles (SQLite, voir dilution_cache.py)")
+    sous = parser.add_subparsers(dest="commande", required=True)
+
+    for nom in ("discontinu", "continu"):
+        p = sous.add_parser(nom, help=f"protocole de dilution en mode {nom}")
+        p.add_argument("--dose", type=float, required=True, help="dose cible (mg)")
+        p.add_argument("--concentration", type=float, required=True, help="concentration initiale (mg/mL)")
+        if nom == "continu":
+            p.add_argument("--heures", type=float, default=24, help="durée de perfusion (h)")
+            p.add_argument("--debit", type=float, default=0.1, help="débit (mL/h)")
+        p.add_argument("--delai", type=float, default=None,
+                       help="durée maximale de la recherche (s) ; meilleur protocole trouvé à l'échéance")
+        p.add_argument("--classement", default="precision", choices=["precision", "ecart", "surdosage"],
+                       help="règle de classement des candidats")
+        p.add_argument("--regles", default=os.environ.get("DOSAGE_REGLES"),
+                       help="fichier JSON des règles de préparation (voir dilution_regles.py)")
+        p.add_argument("--medicament", default=None, help="médicament, pour choisir les règles")
+        p.add_argument("--site", default=os.environ.get("DOSAGE_SITE"), help="site, pour choisir les règles")
+        p.add_argument("--sensibilite", action="store_true",
+                       help="doses et protocole pour une concentration réelle à ± 5 %% de l'étiquette")
+        p.set_defaults(action=_protocole)
+
+    p = sous.add_parser("poids", help="optimize_dosage : dosage selon le poids")
+    p.add_argument("--poids", type=float, required=True, help="poids (kg)")
+    p.add_argument("--dose-kg", type=float, required=True, help="dose prescrite (mg/kg)")
+    p.add_argument("--concentration", type=float, required=True, help="concentration (mg/mL)")
+    p.add_argument("--volume-final", type=float, default=None, help="volume final prescrit (mL)")
+    p.add_argument("--nomogramme", default=NOMOGRAMME_PAR_DEFAUT,
+                   help="nomogramme précalculé (.npz), lu s'il existe et sans volume final")
+    p.set_defaults(action=_poids)
+
+    p = sous.add_parser("nomogramme", help="précalcule le nomogramme poids × dose_kg × concentration")
+    p.add_argument("--nomogramme", default=NOMOGRAMME_PAR_DEFAUT, help="fichier .npz à écrire")
+    p.add_argument("--csv", default=None, help="export CSV pour le nomogramme papier")
+    p.set_defaults(action=_nomogramme)
+
+    p = sous.add_parser("prechauffer", help="calcule dans le cache les prescriptions fréquentes du journal")
+    p.add_argument("--nombre", type=int, default=100, help="nombre de prescriptions distinctes")
+    p.add_argument("--jours", type=float, default=None, help="n'examiner que les derniers jours du journal")
+    p.add_argument("--regles", default=os.environ.get("DOSAGE_REGLES"),
+                   help="règles de préparation des protocoles à préchauffer (voir dilution_regles.py)")
+    p.add_argument("--medicament", default=None, help="médicament, pour choisir les règles")
+    p.add_argument("--site", default=os.environ.get("DOSAGE_SITE"), help="site, pour choisir les règles")
+    p.set_defaults(action=_prechauffer)
+
+    p = sous.add_parser("precompiler", help="écrit l'index précompilé des seringues")
+    p.set_defaults(action=_precompiler)
+    return parser
+
+def _erreur(message):
+    print(json.dumps({"erreur": message}, ensure_ascii=False))
+    return 2
+
+def main(argv=None):
+    args = construire_parser().parse_args(argv)
+    if getattr(args, "concentration", 1) <= 0:
+        return _erreur("La concentration doit être strictement positive.")
+    if getattr(args, "dose", 1) <= 0:
+        return _erreur("La dose doit être strictement positive.")
+    if args.commande == "prechauffer" and (not args.cache or not args.journal):
+        return _erreur("--cache et --journal sont nécessaires au préchauffage.")
+    resultat = args.action(args)
+    json.dump(resultat, sys.stdout, ensure_ascii=False, default=_en_json)
+    sys.stdout.write("\n")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
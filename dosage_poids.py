@@ -0,0 +1,169 @@
+# dosage_poids.py
+# Optimisation du dosage selon le poids (NbMes × seringue), sans dépendance à Streamlit.
+import itertools
+
+import numpy as np
+
+def calculate_mean(attendue, anova_cst, nb_mes, sd_nb_mes, ratio_ser, sd_ratio_ser):
+    """Calcule la moyenne de la dose obtenue en fonction des paramètres du modèle."""
+    ratio_ser_eq = ratio_ser / 100  
+    return (attendue / 100) * (anova_cst + (nb_mes * sd_nb_mes) + (ratio_ser_eq * sd_ratio_ser))
+
+def calculate_std(nb_mes, ratio_ser, attendue):
+    """Calcule l'écart-type du dosage en fonction du nombre de mesures et du ratio seringue."""
+    facteur_lineaire = 2  
+    equation_ratio_ser = -26.15 * np.log(ratio_ser) + 95
+    equation_nb_mes = facteur_lineaire * nb_mes
+    ds_pour_100 = equation_ratio_ser + equation_nb_mes
+    attendue_ratio = attendue / 100
+    ds_normalise = ds_pour_100 * attendue_ratio
+    return abs(ds_normalise) / (1.96 * 2)
+
+def calculate_confidence_interval(mean, std_dev):
+    """Calcule l'intervalle de confiance à 95% autour de la moyenne obtenue."""
+    lower_bound = max(0, mean - 1.96 * std_dev)  
+    upper_bound = mean + 1.96 * std_dev
+    return lower_bound, upper_bound
+
+def optimize_dosage(poids, dose_kg, concentration, volume_final_fixé=None):
+    """Optimise le dosage en tenant compte des contraintes de volume, seringues et NbMes."""
+    
+    # ✅ Définition des constantes du modèle
+    anova_cst = 109
+    sd_nb_mes = 0.7
+    sd_ratio_ser = 7.9
+    nb_mes_range = range(1, 10)  
+    available_syringes = [2, 5, 10, 20]  
+    min_ratio = 30  
+
+    # ✅ Calcul de la dose attendue et du volume nécessaire
+    attendue = poids * dose_kg  
+    volume_necessaire = attendue / concentration  
+    
+    # ✅ Gestion du volume final
+    if volume_final_fixé and volume_final_fixé > 0:
+        volume_final = volume_final_fixé
+    else:
+        volume_final = max(volume_necessaire, 3)  
+
+    best_combination = None
+    min_variability = float('inf')
+    min_error = float('inf')
+
+    # 🔹 Parcours des combinaisons (NbMes, Seringue)
+    for nb_mes, syringe in itertools.product(nb_mes_range, available_syringes):
+        if syringe < volume_necessaire:
+            continue  
+
+        ratio_ser = (volume_necessaire / syringe) * 100
+
+        # ✅ Vérification des contraintes RatioSer
+        if ratio_ser < min_ratio:
+            continue  
+
+        # ✅ Éviter les volumes trop grands
+        volume_manipule = round(volume_necessaire * nb_mes, 2)
+        if volume_manipule > volume_final:
+            continue  
+
+        # ✅ Calcul de la moyenne et de l'écart-type
+        mean = calculate_mean(attendue, anova_cst, nb_mes, sd_nb_mes, ratio_ser, sd_ratio_ser)
+        std_dev = calculate_std(nb_mes, ratio_ser, attendue)
+        error = abs(mean - attendue)
+
+        # ✅ Sélection du meilleur choix basé sur l’erreur et la variabilité
+        if error < min_error or (error == min_error and std_dev < min_variability):
+            min_error = error
+            min_variability = std_dev
+            best_combination = (nb_mes, ratio_ser, syringe, mean, std_dev, volume_manipule)
+
+    # ✅ Sécurisation si aucune solution optimale trouvée
+    if not best_combination:
+        best_combination = (
+            nb_mes_range[0], min_ratio, min(available_syringes),
+            calculate_mean(attendue, anova_cst, nb_mes_range[0], sd_nb_mes, min_ratio, sd_ratio_ser),
+            calculate_std(nb_mes_range[0], min_ratio, attendue),
+            round(volume_necessaire, 2)
+        )
+
+    return best_combination, volume_necessaire, attendue
+
+# ---------------------- NOMOGRAMME ----------------------
+# En néonatologie, poids (0,4–5 kg) et doses en mg/kg varient peu : le meilleur
+# choix d'optimize_dosage est précalculé sur une grille poids × dose_kg ×
+# concentration, puis lu directement (consulter) ou exporté en CSV pour le
+# nomogramme papier. La grille vaut pour un volume final non imposé.
+POIDS_NOMOGRAMME = np.round(np.arange(0.4, 5.0 + 1e-9, 0.05), 2)
+DOSES_KG_NOMOGRAMME = np.round(np.arange(0.5, 20.0 + 1e-9, 0.5), 2)
+CONCENTRATIONS_NOMOGRAMME = np.array([1.0, 2.0, 5.0, 10.0, 20.0, 50.0, 100.0])
+
+DTYPE_NOMOGRAMME = np.dtype([
+    ("nb_mes", "u1"),
+    ("seringue", "u1"),
+    ("ratio_ser", "<f8"),
+    ("moyenne", "<f8"),
+    ("ecart_type", "<f8"),
+    ("volume_manipule", "<f8"),
+])
+
+COLONNES_CSV = ("poids", "dose_kg", "concentration", "dose_attendue", "volume_necessaire", "NbMes", "RatioSer",
+                "Seringue", "moyenne", "ecart_type", "volume_manipule", "IC_inf", "IC_sup")
+
+def construire_nomogramme(poids=POIDS_NOMOGRAMME, doses_kg=DOSES_KG_NOMOGRAMME,
+                          concentrations=CONCENTRATIONS_NOMOGRAMME):
+    """Table {"poids", "doses_kg", "concentrations", "choix"} ; choix[i, j, k] est le meilleur choix."""
+    poids = np.asarray(poids, dtype=float)
+    doses_kg = np.asarray(doses_kg, dtype=float)
+    concentrations = np.asarray(concentrations, dtype=float)
+    choix = np.zeros((len(poids), len(doses_kg), len(concentrations)), dtype=DTYPE_NOMOGRAMME)
+    for (i, p), (j, d), (k, c) in itertools.product(enumerate(poids), enumerate(doses_kg), enumerate(concentrations)):
+        nb_mes, ratio_ser, seringue, moyenne, ecart_type, volume_manipule = optimize_dosage(float(p), float(d), float(c))[0]
+        choix[i, j, k] = (nb_mes, seringue, ratio_ser, moyenne, ecart_type, volume_manipule)
+    return {"poids": poids, "doses_kg": doses_kg, "concentrations": concentrations, "choix": choix}
+
+def sauvegarder_nomogramme(chemin, nomogramme):
+    np.savez_compressed(chemin, **nomogramme)
+
+def charger_nomogramme(chemin):
+    """Table écrite par sauvegarder_nomogramme, ou None si le fichier est absent."""
+    try:
+        with np.load(chemin) as donnees:
+            return {cle: donnees[cle] for cle in ("poids", "doses_kg", "concentrations", "choix")}
+    except FileNotFoundError:
+        return None
+
+def _position(axe, valeur):
+    i = int(np.searchsorted(axe, valeur - 1e-9))
+    if i < len(axe) and abs(axe[i] - valeur) <= 1e-9:
+        return i
+    return None
+
+def consulter(nomogramme, poids, dose_kg, concentration):
+    """Même résultat qu'optimize_dosage (sans volume final imposé) si le point est sur la grille, sinon None."""
+    positions = (_position(nomogramme["poids"], poids), _position(nomogramme["doses_kg"], dose_kg),
+                 _position(nomogramme["concentrations"], concentration))
+    if None in positions:
+        return None
+    choix = nomogramme["choix"][positions]
+    attendue = poids * dose_kg
+    best_combination = (int(choix["nb_mes"]), float(choix["ratio_ser"]), int(choix["seringue"]),
+                        float(choix["moyenne"]), float(choix["ecart_type"]), float(choix["volume_manipule"]))
+    return best_combination, attendue / concentration, attendue
+
+def exporter_csv(nomogramme, chemin):
+    """Une ligne par point de la grille, pour le nomogramme papier."""
+    import csv
+    with open(chemin, "w", newline="", encoding="utf-8") as fichier:
+        ecrivain = csv.writer(fichier)
+        ecrivain.writerow(COLONNES_CSV)
+        for (i, p), (j, d), (k, c) in itertools.product(enumerate(nomogramme["poids"]),
+                                                        enumerate(nomogramme["doses_kg"]),
+                                                        enumerate(nomogramme["concentrations"])):
+            choix = nomogramme["choix"][i, j, k]
+            attendue = p * d
+            ic_inf, ic_sup = calculate_confidence_interval(choix["moyenne"], choix["ecart_type"])
+            ecrivain.writerow([f"{p:g}", f"{d:g}", f"{c:g}", round(attendue, 4), round(attendue / c, 4),
+                               int(choix["nb_mes"]), round(float(choix["ratio_ser"]), 2), int(choix["seringue"]),
+                               round(float(choix["moyenne"]), 4), round(float(choix["ecart_type"]), 4),
+                               round(float(choix["volume_manipule"]), 2), round(float(ic_inf), 4),
+                               round(float(ic_sup), 4)])
@@ -0,0 +1,193 @@
+# fuzz_dilution.py
+# Fuzzing différentiel : un moteur optimisé contre les boucles d'origine
+# (dilution_reference.py), sur des prescriptions aléatoires et des cas limites.
+#
+#   python fuzz_dilution.py --nombre 30 --moteur index
+#   python fuzz_dilution.py --moteur session --graine 7 --temps-max 600
+#
+# Chaque écart est classé (départage entre options équivalentes, ou protocole
+# différent), puis réduit à une prescription minimale qui le reproduit. Tout se
+# fait hors ligne ; le code de sortie vaut 1 s'il reste un protocole différent.
+import argparse
+import itertools
+import random
+import statistics
+import sys
+import time
+
+import dilution_engine as engine
+import dilution_reference as reference
+
+# (mode, dose_mg, concentration, nb_hours, debit_mlh)
+CAS_LIMITES = [
+    ("Discontinu", 5.0, 100.0, None, None),
+    ("Discontinu", 0.01, 1000.0, None, None),     # dilution profonde
+    ("Discontinu", 100.0, 0.1, None, None),       # dose inatteignable
+    ("Discontinu", 3.5, 2.0, None, None),         # dose au plafond dose_mg + 1.5
+    ("Discontinu", 11.0, 10.0, None, None),       # dose en bord de cible
+    ("Discontinu", 0.5, 0.0, None, None),         # concentration nulle
+    ("Continu", 5.0, 100.0, 24, 0.1),
+    ("Continu", 2.4, 1.0, 24, 0.1),
+    ("Continu", 0.05, 500.0, 1, 0.05),            # volume injecté minimal
+    ("Continu", 20.0, 10.0, 48, 2.0),             # volume injecté plus grand que les seringues
+    ("Continu", 3.4, 1.0, 24, 0.1),               # dose en bord de cible
+]
+
+CHAMPS_CONTINU = ("dose_mg", "concentration", "nb_hours", "debit_mlh")
+CHAMPS_DISCONTINU = ("dose_mg", "concentration")
+
+def cas(mode, dose_mg, concentration, nb_hours=None, debit_mlh=None):
+    return {"mode": mode, "dose_mg": dose_mg, "concentration": concentration,
+            "nb_hours": nb_hours, "debit_mlh": debit_mlh}
+
+def tirer_cas(rng):
+    """Prescription aléatoire : doses et concentrations réparties en échelle logarithmique."""
+    mode = rng.choice(("Discontinu", "Continu"))
+    dose_mg = round(10 ** rng.uniform(-2, 2), 2)
+    concentration = round(10 ** rng.uniform(-1, 3.3), 2)
+    if mode == "Continu":
+        return cas(mode, dose_mg, concentration, rng.choice((1, 2, 6, 12, 24, 48)),
+                   rng.choice((0.05, 0.1, 0.2, 0.5, 1.0, 2.0)))
+    return cas(mode, dose_mg, concentration)
+
+def executer(module, c, **options):
+    if c["mode"] == "Continu":
+        return module.generate_dilution_steps_continu(c["dose_mg"], c["concentration"], nb_hours=c["nb_hours"],
+                                                      debit_mlh=c["debit_mlh"], **options)
+    return module.generate_dilution_steps_discontinu(c["dose_mg"], c["concentration"], **options)
+
+def options_moteur(moteur):
+    # Une même session pour toute la campagne : les tables réutilisées sont aussi testées.
+    if moteur == "session":
+        return {"session": engine.nouvelle_session()}
+    return {"moteur": moteur}
+
+# ---------------------- COMPARAISON ----------------------
+def comparer(c, attendu, obtenu):
+    """None si les protocoles sont identiques, sinon (nature, détail).
+
+    nature vaut "départage" quand la première étape divergente choisit une option
+    de même écart et même moyenne_precision que la référence, "écart" sinon.
+    """
+    if repr(attendu) == repr(obtenu):
+        return None
+    cle_dose = "dose" if c["mode"] == "Continu" else "dose obtenue"
+    reelles_attendues = [s for s in attendu if s.get("type") == "réelle"]
+    reelles_obtenues = [s for s in obtenu if s.get("type") == "réelle"]
+    for numero, (a, b) in enumerate(itertools.zip_longest(reelles_attendues, reelles_obtenues), start=1):
+        if repr(a) == repr(b):
+            continue
+        if a is None or b is None:
+            return "écart", f"{len(reelles_attendues)} étape(s) attendue(s), {len(reelles_obtenues)} obtenue(s)"
+        if (abs(a[cle_dose] - c["dose_mg"]) == abs(b[cle_dose] - c["dose_mg"])
+                and a["moyenne_precision"] == b["moyenne_precision"]):
+            return "départage", (f"étape {numero} : seringue {a['seringue']} ({a['volume prélevé']} + "
+                                 f"{a['volume ajouté']} mL) attendue, seringue {b['seringue']} "
+                                 f"({b['volume prélevé']} + {b['volume ajouté']} mL) obtenue, même score")
+        return "écart", f"étape {numero} : dose {a[cle_dose]} attendue, {b[cle_dose]} obtenue"
+    return "écart", "étapes virtuelles ou métriques différentes"
+
+# ---------------------- RÉDUCTION ----------------------
+def _complexite(valeur):
+    decimales = next((k for k in range(10) if round(valeur, k) == valeur), 10)
+    return (decimales, abs(valeur))
+
+def _simplifications(valeur):
+    return [1.0, float(round(valeur)), round(valeur, 1), round(valeur / 2, 2), float(int(valeur / 10) * 10)]
+
+def reduire(c, echoue, essais_max=40):
+    """Simplifie les valeurs de c (moins de décimales, plus petites) tant que echoue(c) reste vrai."""
+    champs = CHAMPS_CONTINU if c["mode"] == "Continu" else CHAMPS_DISCONTINU
+    essais = 0
+    progres = True
+    while progres:
+        progres = False
+        for champ in champs:
+            for candidat in _simplifications(c[champ]):
+                if candidat <= 0 or _complexite(candidat) >= _complexite(c[champ]):
+                    continue
+                if essais >= essais_max:
+                    return c
+                essais += 1
+                essai = dict(c, **{champ: candidat})
+                if echoue(essai):
+                    c = essai
+                    progres = True
+                    break
+    return c
+
+def reproducteur(c, moteur):
+    options = "session=e.nouvelle_session()" if moteur == "session" else f"moteur={moteur!r}"
+    if c["mode"] == "Continu":
+        args = f"{c['dose_mg']}, {c['concentration']}, nb_hours={c['nb_hours']}, debit_mlh={c['debit_mlh']}"
+        fonction = "generate_dilution_steps_continu"
+    else:
+        args = f"{c['dose_mg']}, {c['concentration']}"
+        fonction = "generate_dilution_steps_discontinu"
+    return (f"import dilution_engine as e, dilution_reference as r; "
+            f"print(r.{fonction}({args}) == e.{fonction}({args}, {options}))")
+
+# ---------------------- CAMPAGNE ----------------------
+def campagne(nombre=20, graine=0, moteur="index", temps_max=None, sortie=print):
+    """Exécute la campagne et renvoie le rapport (dict) ; sortie reçoit les lignes de progression."""
+    rng = random.Random(graine)
+    options = options_moteur(moteur)
+    cas_testes = [cas(*limite) for limite in CAS_LIMITES] + [tirer_cas(rng) for _ in range(nombre)]
+    debut = time.perf_counter()
+    rapport = {"moteur": moteur, "graine": graine, "identiques": 0, "départages": [], "écarts": [], "accélérations": []}
+
+    for numero, c in enumerate(cas_testes, start=1):
+        if temps_max is not None and time.perf_counter() - debut > temps_max:
+            sortie(f"temps écoulé : {numero - 1} cas sur {len(cas_testes)}")
+            break
+        t0 = time.perf_counter()
+        attendu = executer(reference, c)
+        t1 = time.perf_counter()
+        obtenu = executer(engine, c, **options)
+        t2 = time.perf_counter()
+        rapport["accélérations"].append((t1 - t0) / max(t2 - t1, 1e-9))
+
+        difference = comparer(c, attendu, obtenu)
+        if difference is None:
+            rapport["identiques"] += 1
+            continue
+        nature, detail = difference
+
+        def echoue(essai):
+            autre = comparer(essai, executer(reference, essai), executer(engine, essai, **options))
+            return autre is not None and autre[0] == nature
+
+        minimal = reduire(c, echoue)
+        rapport["départages" if nature == "départage" else "écarts"].append(
+            {"cas": c, "détail": detail, "minimal": minimal, "reproducteur": reproducteur(minimal, moteur)})
+        sortie(f"[{numero}] {nature} {c['mode']} dose={c['dose_mg']} C={c['concentration']} : {detail}")
+    return rapport
+
+def resumer(rapport, sortie=print):
+    accelerations = rapport["accélérations"]
+    sortie(f"moteur {rapport['moteur']} (graine {rapport['graine']}) : {len(accelerations)} cas, "
+           f"{rapport['identiques']} identiques, {len(rapport['départages'])} départages, "
+           f"{len(rapport['écarts'])} écarts")
+    if accelerations:
+        sortie(f"accélération : médiane x{statistics.median(accelerations):.0f}, "
+               f"min x{min(accelerations):.0f}, max x{max(accelerations):.0f}")
+    for nature in ("écarts", "départages"):
+        for ecart in rapport[nature]:
+            sortie(f"{nature[:-1]} minimal : {ecart['minimal']}")
+            sortie(f"  {ecart['reproducteur']}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Fuzzing différentiel moteur / boucles d'origine.")
+    parser.add_argument("--nombre", type=int, default=20, help="nombre de prescriptions aléatoires")
+    parser.add_argument("--graine", type=int, default=0)
+    parser.add_argument("--moteur", default="index", choices=sorted(engine.MOTEURS_DISCONTINU) + ["session"])
+    parser.add_argument("--temps-max", type=float, default=None, help="budget en secondes")
+    parser.add_argument("--strict", action="store_true", help="échoue aussi sur un départage différent")
+    args = parser.parse_args(argv)
+
+    rapport = campagne(args.nombre, args.graine, args.moteur, args.temps_max)
+    resumer(rapport)
+    return 1 if rapport["écarts"] or (args.strict and rapport["départages"]) else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -5,6 +5,8 @@ import math
 from fpdf import FPDF
 import tempfile
 
+from dilution_affichage import afficher_protocole
+
 # ----------------------------- PARAMÈTRES -----------------------------
 SYRINGES = {
     2: 0.1,
@@ -275,6 +277,8 @@ mode = st.radio("Mode d'administration :", ["Continu", "Discontinu"])
 dose = st.number_input("Dose cible (en mg) :", min_value=0.0, step=0.1)
 concentration = st.number_input("Concentration initiale (en mg/mL) :", min_value=0.0, step=1.0)
 
+compact = st.checkbox("Affichage compact du protocole", value=True)
+
 if st.button("🧪 Générer le protocole de dilution"):
     if dose == 0 or concentration == 0:
         st.warning("Veuillez entrer une dose et une concentration valides.")
@@ -285,28 +289,7 @@ if st.button("🧪 Générer le protocole de dilution"):
             st.error("❌ Aucun protocole trouvé.")
         else:
             st.success(f"✅ Protocole généré pour {dose} mg :")
-            for idx, step in enumerate(resultats, 1):
-                if step.get("type") == "metriques":
-                    st.markdown("### 📊 Métriques finales")
-                    st.write(f"**Précision (moyenne)** : {step['moyenne_precision']:.2f}")
-                    st.write(f"**Écart-type** : {step['ecart_type']:.2f}")
-                    st.write(f"**Intervalle de confiance (95%)** : [{step['IC'][0]}, {step['IC'][1]}]")
-                else:
-                    with st.expander(f"🧪 Étape {idx}"):
-                        st.write(f"**Seringue utilisée** : {step['seringue']} mL")
-                        label_volume = "Volume gardé" if idx >= 2 else "Volume prélevé"
-                        st.write(f"**{label_volume}** : {step['volume prélevé']:.2f} mL")
-                        if step.get('type') == 'réelle':
-                            st.write(f"**Volume ajouté** : {step['volume ajouté']:.2f} mL")
-                            st.write(f"**Volume total** : {step['volume total']:.2f} mL")
-                        if step.get('type') == 'virtuelle':
-                            st.write(f"**Volume ajouté** : 0.0 mL")
-                            st.write(f"**Volume total** : {step['volume prélevé']:.2f} mL")
-                        st.write(f"**Ratio seringue rempli** : {step['ratio']}%")
-                        st.write(f"**Concentration obtenue** : {step['concentration']} mg/mL")
-                        st.write(f"**Dose obtenue** : {step['dose']} mg")
-                        if 'volume injecté' in step:
-                            st.write(f"**Volume injecté** : {step['volume injecté']:.2f} mL")
+            afficher_protocole(st, resultats, mode, compact=compact)
 
             if st.button("📄 Télécharger le protocole en PDF"):
                 pdf_path = export_to_pdf(resultats, dose, mode)
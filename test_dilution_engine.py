@@ -0,0 +1,244 @@
+# test_dilution_engine.py
+# Tests du moteur de dilution : python -m pytest -q
+import tracemalloc
+
+import numpy as np
+import pytest
+
+import dilution_engine as engine
+import dilution_regles
+
+# ---------------------- MÉMOIRE DU MOTEUR « flux » ----------------------
+def _pic_flux_kio(syringes):
+    """Pic d'allocation (kio) du choix d'une étape discontinue par le moteur flux."""
+    engine._choisir_flux_discontinu(syringes, 5.0, 100.0, 1)
+    tracemalloc.start()
+    try:
+        engine._choisir_flux_discontinu(syringes, 5.0, 100.0, 1)
+        _, pic = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return pic / 1024
+
+def test_pic_memoire_flux_independant_de_l_inventaire():
+    # Les candidats sont évalués en flux : le pic ne suit pas leur nombre
+    # (2 400 candidats pour {2: 0.1}, plus de 130 000 pour SYRINGES).
+    pics = [_pic_flux_kio(syringes) for syringes in ({2: 0.1}, {10: 0.2}, {60: 1.0}, engine.SYRINGES)]
+    assert max(pics) < 64
+    assert max(pics) <= 2 * min(pics)
+
+# ---------------------- SENSIBILITÉ ET RÈGLES DE SITE ----------------------
+REGLES = dilution_regles.verifier([
+    {"champ": "seringue", "op": ">=", "valeur": 10},
+    {"champ": "volume prélevé", "op": ">=", "champ_ref": "graduation", "facteur": 5},
+])
+
+@pytest.mark.parametrize("mode, generer", [
+    ("Discontinu", engine.generate_dilution_steps_discontinu),
+    ("Continu", engine.generate_dilution_steps_continu),
+])
+@pytest.mark.parametrize("dose_mg, concentration", [(0.5, 50.0), (5.0, 100.0)])
+def test_sensibilite_ecart_nul_garde_le_plan_avec_regles(mode, generer, dose_mg, concentration):
+    etapes = generer(dose_mg, concentration, regles=REGLES)
+    # Les règles changent le protocole : une nouvelle recherche sans elles le verrait modifié.
+    assert engine._plan(etapes) != engine._plan(generer(dose_mg, concentration))
+    analyse = engine.analyser_sensibilite(mode, dose_mg, concentration, etapes=etapes, rechercher=True,
+                                          regles=REGLES)
+    assert analyse["plan_change"][analyse["ecarts"].index(0.0)] is False
+
+@pytest.mark.parametrize("mode, generer", [
+    ("Discontinu", engine.generate_dilution_steps_discontinu),
+    ("Continu", engine.generate_dilution_steps_continu),
+])
+@pytest.mark.parametrize("regles", [None, REGLES])
+def test_sensibilite_recherche_groupee_identique_aux_recherches_separees(mode, generer, regles):
+    dose_mg, concentration = 5.0, 100.0
+    analyse = engine.analyser_sensibilite(mode, dose_mg, concentration, rechercher=True, regles=regles)
+    cle_dose = "dose" if mode == "Continu" else "dose obtenue"
+    for c, dose in zip(analyse["concentrations"], analyse["doses_recherche"]):
+        reelles = [s for s in generer(dose_mg, c, regles=regles) if s.get("type") == "réelle"]
+        assert dose == (reelles[-1][cle_dose] if reelles else None)
+
+# ---------------------- SESSION (RECALCUL INCRÉMENTAL) ----------------------
+@pytest.mark.parametrize("generer", [engine.generate_dilution_steps_discontinu,
+                                     engine.generate_dilution_steps_continu])
+def test_session_apres_changement_de_dose_identique_au_moteur_index(generer):
+    session = engine.nouvelle_session()
+    for dose_mg, concentration in [(5.0, 100.0), (2.4, 100.0), (7.0, 100.0), (0.37, 100.0), (5.0, 10.0)]:
+        # Les tables des requêtes précédentes sont réutilisées, pas reconstruites.
+        assert generer(dose_mg, concentration, session=session) == generer(dose_mg, concentration)
+    assert session["succes"] > 0
+
+# ---------------------- RECHERCHE EN FAISCEAU ----------------------
+def _qualite(etapes, dose_mg, cle_dose):
+    """(écart final arrondi, nombre d'étapes réelles), comme le classement des plans du faisceau."""
+    reelles = [s for s in etapes if s.get("type") == "réelle"]
+    return (round(abs(reelles[-1][cle_dose] - dose_mg), 2), len(reelles)) if reelles else (float("inf"), 0)
+
+@pytest.mark.parametrize("generer, cle_dose", [
+    (engine.generate_dilution_steps_discontinu, "dose obtenue"),
+    (engine.generate_dilution_steps_continu, "dose"),
+])
+@pytest.mark.parametrize("dose_mg, concentration", [(2.4, 250.0), (0.37, 40.0), (7.0, 100.0), (43.6, 10.0)])
+def test_faisceau_jamais_pire_que_glouton(generer, cle_dose, dose_mg, concentration):
+    glouton = _qualite(generer(dose_mg, concentration), dose_mg, cle_dose)
+    for largeur in (2, 3, 4, 16):
+        assert _qualite(generer(dose_mg, concentration, faisceau=largeur), dose_mg, cle_dose) <= glouton
+
+# ---------------------- COUVERTURE DES DOSES ----------------------
+def _couverture_brute(concentration_init, nb_etapes_max, tolerance, syringes):
+    """{cible (centièmes de mg): nombre minimal d'étapes}, par énumération de toutes les dilutions.
+
+    Mêmes arrondis que _option_discontinu : les volumes de l'index sont des scalaires numpy.
+    """
+    index = engine.construire_index(syringes)
+    concentrations, atteintes = {concentration_init}, {}
+    for etape in range(1, nb_etapes_max + 1):
+        suivantes = set()
+        for concentration in concentrations:
+            for entree in index:
+                for quotient in np.unique(entree["quotients"]):
+                    diluee = round(concentration * quotient, 2)
+                    suivantes.add(diluee)
+                    for injecte in entree["injectés_arr"]:
+                        atteintes.setdefault(int(round(round(diluee * injecte, 2) * 100)), etape)
+        concentrations = suivantes
+    largeur = int(round(tolerance * 100))
+    couverture = {}
+    for dose, etape in atteintes.items():
+        for cible in range(max(dose - largeur, 1), dose + largeur + 1):
+            couverture[cible] = min(couverture.get(cible, etape), etape)
+    return couverture
+
+@pytest.mark.parametrize("concentration, tolerance", [(5.0, 0.0), (37.5, 0.05), (12.34, 0.02)])
+def test_couverture_identique_a_l_enumeration(concentration, tolerance):
+    syringes = {5: 0.5, 2: 0.2}
+    obtenue = {}
+    for plage in engine.couverture_doses(concentration, tolerance=tolerance, syringes=syringes):
+        for cible in range(round(plage["dose_min"] * 100), round(plage["dose_max"] * 100) + 1):
+            obtenue[cible] = plage["nb_etapes"]
+    attendue = _couverture_brute(concentration, 3, tolerance, syringes)
+    # Les trois nombres d'étapes sont représentés : la propagation des concentrations est vérifiée.
+    assert set(attendue.values()) == {1, 2, 3}
+    assert obtenue == attendue
+
+# ---------------------- PLUSIEURS DOSES CIBLES ----------------------
+@pytest.mark.parametrize("generer, generer_lot", [
+    (engine.generate_dilution_steps_discontinu, engine.generate_dilution_steps_discontinu_lot),
+    (engine.generate_dilution_steps_continu, engine.generate_dilution_steps_continu_lot),
+])
+@pytest.mark.parametrize("concentration", [100.0, 10.0, 1.0])
+def test_lot_identique_aux_appels_separes(generer, generer_lot, concentration):
+    # Doses proches (états partagés, tables de session) et isolées (moteur « index »).
+    doses = [0.1, 0.37, 2.4, 2.41, 2.42, 5.0, 5.0, 12.5, 40.0]
+    assert generer_lot(doses, concentration) == [generer(dose_mg, concentration) for dose_mg in doses]
+
+# ---------------------- LIGNE DE COMMANDE ----------------------
+@pytest.mark.parametrize("arguments, code", [
+    (["discontinu", "--dose", "5", "--concentration", "100"], 0),
+    (["continu", "--dose", "5", "--concentration", "100"], 0),
+    (["discontinu", "--dose", "5", "--concentration", "0"], 2),
+    (["discontinu", "--dose", "0", "--concentration", "100"], 2),
+    (["continu", "--dose", "-1", "--concentration", "100"], 2),
+    (["prechauffer"], 2),
+])
+def test_dosage_codes_de_sortie(tmp_path, capsys, monkeypatch, arguments, code):
+    import json
+
+    import dosage
+    monkeypatch.delenv("DOSAGE_CACHE", raising=False)
+    monkeypatch.delenv("DOSAGE_JOURNAL", raising=False)
+    assert dosage.main(["--lattice", str(tmp_path / "lattice.npy")] + arguments) == code
+    sortie = json.loads(capsys.readouterr().out)
+    assert ("erreur" in sortie) == (code != 0)
+
+def test_index_precompile_identique_a_l_index_construit(tmp_path):
+    chemin = tmp_path / "lattice.npy"
+    engine.sauvegarder_index(chemin)
+    construit = engine.construire_index()
+    cle = tuple(engine.SYRINGES.items())
+    del engine._INDEX_CACHE[cle]
+    try:
+        charge = engine.charger_index(chemin)
+    finally:
+        engine._INDEX_CACHE[cle] = construit
+    assert [sorted(entree) for entree in charge] == [sorted(entree) for entree in construit]
+    for entree_chargee, entree in zip(charge, construit):
+        for nom in engine.CHAMPS_INDEX:
+            assert entree_chargee[nom].dtype == entree[nom].dtype
+            assert (entree_chargee[nom] == entree[nom]).all()
+
+def test_index_restreints_bornes(monkeypatch):
+    monkeypatch.setattr(dilution_regles, "TAILLE_MAX_RESTREINTS", 3)
+    for volume in range(1, 8):
+        regles = [{"champ": "volume total", "op": ">=", "valeur": float(volume)}]
+        dilution_regles.index_restreint(regles, engine.SYRINGES, "Discontinu", 1)
+    assert len(dilution_regles._INDEX_RESTREINTS) <= 3
+
+# ---------------------- JOURNAL D'AUDIT ----------------------
+def test_audit_enregistrer_puis_rechercher_et_lire(tmp_path):
+    import json
+
+    import dilution_audit
+    chemin = str(tmp_path / "journal")
+    prescriptions = [("Discontinu", 5.0, 100.0), ("Continu", 2.4, 250.0), ("Discontinu", 12.5, 10.0),
+                     ("Continu", 5.0, 100.0)]
+    attendus = []
+    for jour, (mode, dose_mg, concentration) in enumerate(prescriptions):
+        generer = (engine.generate_dilution_steps_continu if mode == "Continu"
+                   else engine.generate_dilution_steps_discontinu)
+        etapes = generer(dose_mg, concentration)
+        dilution_audit.enregistrer(chemin, mode, dose_mg, concentration, etapes, horodatage=86400.0 * (jour + 1))
+        # Relu depuis le JSON : tuples en listes, scalaires numpy en float.
+        attendus.append(json.loads(json.dumps(etapes, default=dilution_audit._json_defaut)))
+
+    lecteur = dilution_audit.ouvrir(chemin)
+    try:
+        assert list(dilution_audit.rechercher(lecteur)) == [0, 1, 2, 3]
+        assert list(dilution_audit.rechercher(lecteur, debut=2 * 86400.0, fin=3 * 86400.0)) == [1, 2]
+        assert list(dilution_audit.rechercher(lecteur, concentration=100.0)) == [0, 3]
+        assert list(dilution_audit.rechercher(lecteur, concentration=(10.0, 100.0), dose_min=5.0)) == [0, 2, 3]
+        assert list(dilution_audit.rechercher(lecteur, mode="Continu", dose_max=3.0)) == [1]
+        protocoles = dilution_audit.lire(lecteur, dilution_audit.rechercher(lecteur))
+    finally:
+        dilution_audit.fermer(lecteur)
+    for protocole, (mode, dose_mg, concentration), etapes in zip(protocoles, prescriptions, attendus):
+        assert (protocole["mode"], protocole["dose_mg"], protocole["concentration"]) == (mode, dose_mg, concentration)
+        assert protocole["etapes"] == etapes
+        assert protocole["version"] == engine.VERSION_MOTEUR
+
+# ---------------------- CACHE PERSISTANT ----------------------
+def test_cache_rend_le_protocole_enregistre(tmp_path):
+    import dilution_cache
+    cache = dilution_cache.ouvrir(str(tmp_path / "cache.sqlite"))
+    for mode, generer in (("Discontinu", engine.generate_dilution_steps_discontinu),
+                          ("Continu", engine.generate_dilution_steps_continu)):
+        attendu = generer(5.0, 100.0)
+        assert dilution_cache.generer(cache, mode, 5.0, 100.0) == attendu
+        cle = dilution_cache.cle(mode, 5.0, 100.0)
+        assert dilution_cache.lire(cache, cle) == attendu
+        assert dilution_cache.generer(cache, mode, 5.0, 100.0) == attendu
+    assert dilution_cache.statistiques(cache)["protocoles"] == 2
+
+def test_cache_eviction_respecte_taille_max(tmp_path):
+    import dilution_cache
+    cache = dilution_cache.ouvrir(str(tmp_path / "cache.sqlite"), taille_max=1500)
+    for dose_mg in (1.0, 2.0, 3.0, 4.0, 5.0, 6.0, 7.0, 8.0, 9.0, 10.0):
+        dilution_cache.generer(cache, "Discontinu", dose_mg, 100.0)
+        connexion = dilution_cache._connexion(cache)
+        total = connexion.execute("SELECT COALESCE(SUM(taille), 0) FROM protocoles").fetchone()[0]
+        assert total <= 1500
+        # Le compteur tenu par déclencheurs suit la table.
+        assert connexion.execute("SELECT taille FROM totaux WHERE id = 0").fetchone()[0] == total
+    assert 0 < dilution_cache.statistiques(cache)["protocoles"] < 10
+    # La prescription la plus récente est restée.
+    assert dilution_cache.lire(cache, dilution_cache.cle("Discontinu", 10.0, 100.0)) is not None
+
+def test_cache_cle_distingue_les_regles():
+    import dilution_cache
+    sans = dilution_cache.cle("Discontinu", 5.0, 100.0)
+    avec = dilution_cache.cle("Discontinu", 5.0, 100.0, regles=REGLES)
+    assert sans != avec
+    assert dilution_cache.cle("Discontinu", 5.0, 100.0, regles=REGLES[::-1]) == avec
+    autres = [dict(REGLES[0], valeur=20)] + REGLES[1:]
+    assert dilution_cache.cle("Discontinu", 5.0, 100.0, regles=autres) != avec